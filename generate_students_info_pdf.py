@@ -1,70 +1,139 @@
 import os
+import io
+import csv
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
 
-def generate_pdf(students_info_dir, output_pdf):
-    # List all student subfolders
+IMG_DISP_HEIGHT = 60  # Display height in points (not pixels)
+IMG_DISP_WIDTH = 220  # Display width in points (not pixels)
+# reportlab keeps every page of a PDF in memory until it is saved, so large
+# cohorts are split into files of at most this many students (about 56 pages)
+MAX_PER_PDF = 500
+
+def prepare_crop(img_path, dpi=150, encoding="jpeg", quality=60):
+    """Downscale a crop to its display box at `dpi` and encode it compactly.
+
+    Returns (encoded_bytes, draw_w, draw_h), with the draw size in points, or
+    None if the image cannot be read. `encoding` is "jpeg" (grayscale) or
+    "1bit" (thresholded black and white, stored as PNG).
+    """
+    try:
+        img = Image.open(img_path)
+        img.load()
+    except Exception:
+        return None
+    # Fit to display box, but do not upscale (1 px = 1 pt, as before)
+    scale = min(IMG_DISP_WIDTH / img.width, IMG_DISP_HEIGHT / img.height, 1.0)
+    draw_w = int(img.width * scale)
+    draw_h = int(img.height * scale)
+    # Never keep more pixels than the print resolution can show
+    px_w = max(1, min(img.width, round(draw_w * dpi / 72)))
+    px_h = max(1, min(img.height, round(draw_h * dpi / 72)))
+    img = img.convert("L")
+    if (px_w, px_h) != img.size:
+        img = img.resize((px_w, px_h), Image.LANCZOS)
+    buf = io.BytesIO()
+    if encoding == "1bit":
+        img.point(lambda v: 255 if v > 160 else 0).convert("1").save(buf, "PNG", optimize=True)
+    else:
+        img.save(buf, "JPEG", quality=quality, optimize=True)
+    return buf.getvalue(), draw_w, draw_h
+
+def prepare_student(student_path, dpi=150, encoding="jpeg", quality=60):
+    """Prepare the name and id crops of one student directory (runs in a worker process)."""
+    return (prepare_crop(os.path.join(student_path, "name.png"), dpi, encoding, quality),
+            prepare_crop(os.path.join(student_path, "id.png"), dpi, encoding, quality))
+
+def _part_path(output_pdf, part, split):
+    if not split:
+        return output_pdf
+    root, ext = os.path.splitext(output_pdf)
+    return f"{root}_{part:03d}{ext}"
+
+def generate_pdf(students_info_dir, output_pdf, dpi=150, encoding="jpeg", quality=60,
+                 workers=None, max_per_pdf=MAX_PER_PDF):
+    """Lay out every student's name/id crops in a compact PDF for manual matching.
+
+    Crops are downscaled and encoded in parallel worker processes; only a
+    bounded window of prepared students is held in memory while pages are
+    drawn. The pages of one PDF stay in memory until it is saved, so more
+    than `max_per_pdf` students are split into several PDFs of at most that
+    many each (`<output>_001.pdf`, `<output>_002.pdf`, ...); a falsy
+    `max_per_pdf` writes one file, with memory growing with its page count.
+    """
+    # List all student subfolders that have both crops
     student_dirs = [d for d in os.listdir(students_info_dir) if os.path.isdir(os.path.join(students_info_dir, d))]
     student_dirs.sort()
-    c = canvas.Canvas(output_pdf, pagesize=A4)
+    student_dirs = [d for d in student_dirs
+                    if os.path.exists(os.path.join(students_info_dir, d, "name.png"))
+                    and os.path.exists(os.path.join(students_info_dir, d, "id.png"))]
     width, height = A4
     margin = 40
-    y = height - margin
     row_height = 80  # Fixed row height for compact layout
-    img_disp_height = 60  # Display height in points (not pixels)
-    img_disp_width = 220  # Display width in points (not pixels)
     font_size = 12
-    c.setFont("Helvetica", font_size)
+    split = bool(max_per_pdf) and len(student_dirs) > max_per_pdf
     # Prepare for CSV template
     csv_rows = []
-    for student in student_dirs:
-        student_path = os.path.join(students_info_dir, student)
-        name_img_path = os.path.join(student_path, "name.png")
-        id_img_path = os.path.join(student_path, "id.png")
-        if not (os.path.exists(name_img_path) and os.path.exists(id_img_path)):
-            continue
-        # Draw filename
-        c.drawString(margin, y + img_disp_height // 2 - font_size // 2, student)
-        # Draw name image
-        x_name = margin + 120
-        try:
-            name_img = Image.open(name_img_path)
-            aspect = name_img.width / name_img.height
-            # Fit to display box, but do not upscale
-            scale = min(img_disp_width / name_img.width, img_disp_height / name_img.height, 1.0)
-            draw_w = int(name_img.width * scale)
-            draw_h = int(name_img.height * scale)
-            # Center in box
-            x_offset = x_name + (img_disp_width - draw_w) // 2
-            y_offset = y + (img_disp_height - draw_h) // 2
-            c.drawImage(ImageReader(name_img), x_offset, y_offset, width=draw_w, height=draw_h, preserveAspectRatio=True, mask='auto')
-        except Exception as e:
-            pass
-        # Draw id image
-        x_id = x_name + img_disp_width + 40
-        try:
-            id_img = Image.open(id_img_path)
-            aspect = id_img.width / id_img.height
-            scale = min(img_disp_width / id_img.width, img_disp_height / id_img.height, 1.0)
-            draw_w = int(id_img.width * scale)
-            draw_h = int(id_img.height * scale)
-            x_offset = x_id + (img_disp_width - draw_w) // 2
-            y_offset = y + (img_disp_height - draw_h) // 2
-            c.drawImage(ImageReader(id_img), x_offset, y_offset, width=draw_w, height=draw_h, preserveAspectRatio=True, mask='auto')
-        except Exception as e:
-            pass
-        csv_rows.append({"image": student, "name": "", "id": ""})
-        y -= row_height
-        if y < margin + row_height:
-            c.showPage()
-            c.setFont("Helvetica", font_size)
-            y = height - margin
+    c = None
+    part = 0
+    y = height - margin
+
+    def draw_crop(prepared, x_box, y):
+        if prepared is None:
+            return
+        data, draw_w, draw_h = prepared
+        # Center in box
+        x_offset = x_box + (IMG_DISP_WIDTH - draw_w) // 2
+        y_offset = y + (IMG_DISP_HEIGHT - draw_h) // 2
+        c.drawImage(ImageReader(io.BytesIO(data)), x_offset, y_offset, width=draw_w, height=draw_h)
+
+    workers = workers or os.cpu_count() or 1
+    window = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = iter(student_dirs)
+
+        def submit_next():
+            student = next(pending, None)
+            if student is not None:
+                window.append((student, pool.submit(prepare_student, os.path.join(students_info_dir, student),
+                                                    dpi, encoding, quality)))
+
+        # Keep a bounded number of students in flight
+        for _ in range(workers * 4):
+            submit_next()
+        while window:
+            student, future = window.popleft()
+            submit_next()
+            if c is None or (split and len(csv_rows) % max_per_pdf == 0):
+                if c is not None:
+                    c.save()
+                    print(f"PDF saved to {_part_path(output_pdf, part, split)}")
+                part += 1
+                c = canvas.Canvas(_part_path(output_pdf, part, split), pagesize=A4, pageCompression=1)
+                c.setFont("Helvetica", font_size)
+                y = height - margin
+            name_crop, id_crop = future.result()
+            # Draw filename
+            c.drawString(margin, y + IMG_DISP_HEIGHT // 2 - font_size // 2, student)
+            # Draw name and id images
+            x_name = margin + 120
+            draw_crop(name_crop, x_name, y)
+            draw_crop(id_crop, x_name + IMG_DISP_WIDTH + 40, y)
+            csv_rows.append({"image": student, "name": "", "id": ""})
+            y -= row_height
+            if y < margin + row_height and window:
+                c.showPage()
+                c.setFont("Helvetica", font_size)
+                y = height - margin
+    if c is None:
+        c = canvas.Canvas(output_pdf, pagesize=A4)
     c.save()
-    print(f"PDF saved to {output_pdf}")
+    print(f"PDF saved to {_part_path(output_pdf, part, split)}")
     # Write CSV template in the same directory as the PDF
-    import csv
     output_dir = os.path.dirname(output_pdf)
     csv_path = os.path.join(output_dir, "image-to-name.csv")
     with open(csv_path, "w", newline="") as f:
@@ -74,12 +143,16 @@ def generate_pdf(students_info_dir, output_pdf):
     print(f"CSV template saved to {csv_path}")
 
 if __name__ == "__main__":
-    import sys
+    import argparse
+    p = argparse.ArgumentParser(description="Build the image-to-names PDF from students-info crops.")
     # Default to output/temaA/students-info/ and output/temaA/image-to-names.pdf
-    students_info_dir = "output/temaA/students-info/"
-    output_pdf = "output/temaA/image-to-names.pdf"
-    if len(sys.argv) > 1:
-        students_info_dir = sys.argv[1]
-    if len(sys.argv) > 2:
-        output_pdf = sys.argv[2]
-    generate_pdf(students_info_dir, output_pdf)
+    p.add_argument("students_info_dir", nargs="?", default="output/temaA/students-info/")
+    p.add_argument("output_pdf", nargs="?", default="output/temaA/image-to-names.pdf")
+    p.add_argument("--dpi", type=int, default=150, help="Print resolution the crops are downscaled to (default: 150)")
+    p.add_argument("--encoding", default="jpeg", choices=["jpeg", "1bit"], help="Crop encoding: grayscale JPEG or 1-bit (default: jpeg)")
+    p.add_argument("--quality", type=int, default=60, help="JPEG quality (default: 60)")
+    p.add_argument("--workers", type=int, help="Worker processes preparing crops (default: CPU count)")
+    p.add_argument("--max-per-pdf", type=int, default=MAX_PER_PDF, help=f"Split the output into PDFs of at most this many students, which bounds memory (default: {MAX_PER_PDF}; 0 writes one PDF, whose pages are all held in memory until it is saved)")
+    args = p.parse_args()
+    generate_pdf(args.students_info_dir, args.output_pdf, dpi=args.dpi, encoding=args.encoding,
+                 quality=args.quality, workers=args.workers, max_per_pdf=args.max_per_pdf)
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""Headless grid calibration from one sample scan.
+
+grid_setup_multi.py needs a window and a few clicks per grid column. This
+script does the same job unattended: it warps the sample with the corner
+markers (auto_find_corners), finds the printed bubbles, fits the lattice of
+grid columns, options and rows, and writes a grid_config.json that
+omr_reader.load_layout accepts, together with a confidence report.
+
+    python grid_autocal.py sample.png --output grid_config.json
+    python grid_autocal.py sample.png --columns 2 --rows 21 --report calib.json --preview calib.png
+
+The config is only written when the fit reaches --min-confidence (or with
+--force); the exit status is 1 otherwise, so it can run in batch jobs.
+"""
+import sys
+import json
+import string
+import argparse
+
+import cv2
+import numpy as np
+
+from grid_setup_multi import auto_find_corners
+from omr_reader import Layout, load_layout
+
+def warp_sample(img, warp_w=None, warp_h=None):
+    """Warp a scan so its marker centres land on the corners, as OMR-reader.py does."""
+    pts = auto_find_corners(img)
+    tl, tr, br, bl = pts
+    W = warp_w or int(max(np.linalg.norm(br - bl), np.linalg.norm(tr - tl)))
+    H = warp_h or int(max(np.linalg.norm(tr - br), np.linalg.norm(tl - bl)))
+    dst = np.array([[0,0],[W,0],[W,H],[0,H]], dtype="float32")
+    return cv2.warpPerspective(img, cv2.getPerspectiveTransform(pts, dst), (W, H))
+
+def find_circles(gray, min_r, max_r):
+    """(x, y, r) of every round outline or blob with min_r <= r <= max_r."""
+    th = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 31, 10)
+    cnts, _ = cv2.findContours(th, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+    found = []
+    for c in cnts:
+        (x, y), r = cv2.minEnclosingCircle(c)
+        if not min_r <= r <= max_r:
+            continue
+        area = cv2.contourArea(c)
+        peri = cv2.arcLength(c, True)
+        if peri == 0 or 4 * np.pi * area / peri ** 2 < 0.75 or area < 0.7 * np.pi * r * r:
+            continue
+        found.append((x, y, r))
+    # a printed ring gives an outer and an inner contour: keep the outer one
+    found.sort(key=lambda b: -b[2])
+    kept = []
+    for x, y, r in found:
+        if all((x - kx) ** 2 + (y - ky) ** 2 > (kr / 2) ** 2 for kx, ky, kr in kept):
+            kept.append((x, y, r))
+    return np.array(kept, dtype=float).reshape(-1, 3)
+
+def bubble_radius(circles):
+    """Most common radius among the candidates (bubbles outnumber any other round shape)."""
+    radii = circles[:, 2]
+    support = [np.count_nonzero(np.abs(radii - r) <= 0.15 * r) for r in radii]
+    r0 = radii[int(np.argmax(support))]
+    return float(np.median(radii[np.abs(radii - r0) <= 0.15 * r0]))
+
+def runs(values, gap):
+    """Split values into groups of indices whose sorted neighbours are at most `gap` apart."""
+    order = np.argsort(values)
+    groups = [[order[0]]]
+    for a, b in zip(order, order[1:]):
+        if values[b] - values[a] > gap:
+            groups.append([])
+        groups[-1].append(b)
+    return groups
+
+def fit_line(idx, pos):
+    """Least-squares pos = a + b * idx; returns (a, b, rms residual)."""
+    A = np.column_stack([np.ones(len(idx)), idx])
+    (a, b), *_ = np.linalg.lstsq(A, pos, rcond=None)
+    return a, b, float(np.sqrt(np.mean((pos - (a + b * idx)) ** 2)))
+
+def fit_lattice(circles, radius):
+    """Group bubble-sized circles into grid columns of options x rows.
+
+    Returns (grids, rows, strays): one dict per grid column with the fitted
+    first-bubble centre, option spacing and row pitch, the number of rows,
+    and the count of bubble-sized circles that fit no lattice.
+    """
+    xs, ys = circles[:, 0], circles[:, 1]
+    # option columns and question rows are runs of aligned centres
+    xgroups = runs(xs, radius)
+    ygroups = runs(ys, radius)
+    biggest = max(len(g) for g in xgroups)
+    xgroups = [g for g in xgroups if len(g) >= max(3, 0.3 * biggest)]
+    biggest = max(len(g) for g in ygroups)
+    ygroups = [g for g in ygroups if len(g) >= max(2, 0.3 * biggest)]
+    if len(xgroups) < 2 or len(ygroups) < 2:
+        raise RuntimeError(f"no bubble lattice found ({len(xgroups)} option columns, {len(ygroups)} rows)")
+
+    xc = np.array([np.median(xs[g]) for g in xgroups])
+    yc = np.array([np.median(ys[g]) for g in ygroups])
+    # options of one grid are evenly spaced; a wider gap starts the next grid
+    gaps = np.diff(xc)
+    spacing = gaps.min()
+    split = [0] + [i + 1 for i, gap in enumerate(gaps) if gap > 1.5 * spacing] + [len(xc)]
+    pitch = np.median(np.diff(yc))
+    row_of = {}
+    for g, centre in zip(ygroups, yc):
+        for i in g:
+            row_of[i] = int(round((centre - yc[0]) / pitch))
+    rows = max(row_of.values()) + 1
+
+    grids, used = [], set()
+    for start, stop in zip(split, split[1:]):
+        idx_j, idx_i, px, py = [], [], [], []
+        for j, g in enumerate(xgroups[start:stop]):
+            for i in g:
+                if i in row_of:
+                    idx_j.append(j); idx_i.append(row_of[i]); px.append(xs[i]); py.append(ys[i])
+                    used.add(i)
+        idx_j, idx_i, px, py = map(np.array, (idx_j, idx_i, px, py))
+        x0, dx, rms_x = fit_line(idx_j, px)
+        y0, dy, rms_y = fit_line(idx_i, py)
+        grids.append({
+            'options': stop - start, 'x0': x0, 'spacing': dx, 'y0': y0, 'pitch': dy,
+            'found': len(px), 'rms': float(np.hypot(rms_x, rms_y)),
+        })
+    return grids, rows, len(circles) - len(used)
+
+def find_form_rects(gray, bottom):
+    """Normalized name and ID write-in cells of a 'label | answer' form table above `bottom` px.
+
+    Returns (name_rect, id_rect), or (None, None) when no two-row ruled
+    table is found.
+    """
+    H, W = gray.shape
+    band = gray[:int(bottom)]
+    th = cv2.adaptiveThreshold(band, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 31, 10)
+    horiz = cv2.morphologyEx(th, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (W // 4, 1)))
+    ys = np.flatnonzero(horiz.sum(axis=1) > 255 * W // 4)
+    lines = [int(np.mean(ys[g])) for g in runs(ys, 3)] if len(ys) else []
+    for top, mid, low in zip(lines, lines[1:], lines[2:]):
+        # two rows of similar height, closed by vertical rules
+        if not 0.7 < (low - mid) / max(mid - top, 1) < 1.4:
+            continue
+        cell = th[top:low + 1]
+        vert = cv2.morphologyEx(cell, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, (low - top) * 3 // 4)))
+        xs = np.flatnonzero(vert.sum(axis=0) > 0)
+        cols = [int(np.mean(xs[g])) for g in runs(xs, 3)] if len(xs) else []
+        # the write-in cells are the last column; the outer left rule may lie off the warp
+        if len(cols) < 2:
+            continue
+        x1, x2 = cols[-2], cols[-1]
+        pad = 3
+        name = [(x1 + pad) / W, (top + pad) / H, (x2 - x1 - 2 * pad) / W, (mid - top - 2 * pad) / H]
+        ident = [(x1 + pad) / W, (mid + pad) / H, (x2 - x1 - 2 * pad) / W, (low - mid - 2 * pad) / H]
+        return name, ident
+    return None, None
+
+def calibrate(img, options=None, columns=None, rows=None, warp_w=None, warp_h=None):
+    """Fit a grid_config from one sample scan.
+
+    Returns (config, report, warped). The report carries per-grid coverage
+    and residuals, an overall 0-1 confidence and any warnings.
+    """
+    warped = warp_sample(img, warp_w, warp_h)
+    H, W = warped.shape[:2]
+    gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
+    circles = find_circles(gray, 0.004 * W, 0.05 * W)
+    if len(circles) < 4:
+        raise RuntimeError(f"only {len(circles)} round shapes found on the warped sheet")
+    radius = bubble_radius(circles)
+    circles = circles[np.abs(circles[:, 2] - radius) <= 0.2 * radius]
+    fitted, n_rows, strays = fit_lattice(circles, radius)
+
+    warnings = []
+    counts = sorted({g['options'] for g in fitted})
+    n_opts = max(counts, key=lambda n: sum(g['options'] == n for g in fitted))
+    if len(counts) > 1:
+        warnings.append(f"grid columns have different option counts {counts}; using {n_opts}")
+    if options and len(options) != n_opts:
+        warnings.append(f"{len(options)} option labels given but {n_opts} bubbles per row found")
+    if columns and columns != len(fitted):
+        warnings.append(f"expected {columns} grid columns, found {len(fitted)}")
+    if rows and rows != n_rows:
+        warnings.append(f"expected {rows} rows, found {n_rows}")
+    labels = list(options or string.ascii_uppercase[:n_opts])
+    n_rows = rows or n_rows
+
+    r = int(round(radius))
+    config = {'warp_w': W, 'warp_h': H, 'columns': len(fitted), 'rows': n_rows, 'options': labels, 'grids': []}
+    report = {'warp_w': W, 'warp_h': H, 'bubble_radius_px': radius, 'stray_circles': strays, 'grids': []}
+    for g in fitted:
+        spacing = int(round(g['spacing']))
+        # Layout puts bubble j of row i at (x + r + j*spacing, y + (i + 0.5) * h / rows)
+        config['grids'].append({
+            'x': (g['x0'] - r) / W,
+            'y': (g['y0'] - g['pitch'] / 2) / H,
+            'w': ((len(labels) - 1) * spacing + 2 * r) / W,
+            'h': n_rows * g['pitch'] / H,
+            'bubble_spacing_px': spacing,
+            'bubble_radius_px': r,
+        })
+        expected = n_rows * len(labels)
+        report['grids'].append({
+            'options_found': g['options'], 'bubbles_found': g['found'], 'bubbles_expected': expected,
+            'coverage': round(min(g['found'], expected) / expected, 3),
+            'spacing_px': round(g['spacing'], 2), 'row_pitch_px': round(g['pitch'], 2),
+            'rms_residual_px': round(g['rms'], 2),
+        })
+
+    name_rect, id_rect = find_form_rects(gray, min(g['y0'] for g in fitted) - 1.5 * max(g['pitch'] for g in fitted))
+    if name_rect:
+        config['name_rect'], config['id_rect'] = name_rect, id_rect
+    else:
+        warnings.append("no name/ID form table found; add name_rect/id_rect by hand for OCR")
+    Layout(config)  # what OMR-reader.py will load
+
+    # every grid must be fully found and tight; a wrong count zeroes the score
+    scores = [s['coverage'] * max(0.0, 1 - s['rms_residual_px'] / (radius / 2)) for s in report['grids']]
+    confidence = min(scores)
+    if any(not w.startswith("no name/ID") for w in warnings):
+        confidence = 0.0
+    report.update(confidence=round(confidence, 3), warnings=warnings, form_found=bool(name_rect))
+    return config, report, warped
+
+def compare_layouts(config, reference_path):
+    """Largest and mean distance in px between this config's bubbles and a reference config's."""
+    ours, ref = Layout(config), load_layout(reference_path)
+    if len(ours.bubble_positions) != len(ref.bubble_positions):
+        return None
+    d = [np.hypot((a[2][0] - b[2][0]) * ours.warp_w, (a[2][1] - b[2][1]) * ours.warp_h)
+         for a, b in zip(ours.bubble_positions, ref.bubble_positions)]
+    return {'max_px': round(float(max(d)), 2), 'mean_px': round(float(np.mean(d)), 2)}
+
+def draw_preview(warped, config):
+    preview = warped.copy()
+    layout = Layout(config)
+    for q, opt, (nx, ny), col in layout.bubble_positions:
+        center = (int(nx * layout.warp_w), int(ny * layout.warp_h))
+        cv2.circle(preview, center, layout.bubble_radius(col, 20), (0, 200, 0), 2)
+    for g in config['grids']:
+        x, y = int(g['x'] * layout.warp_w), int(g['y'] * layout.warp_h)
+        cv2.rectangle(preview, (x, y), (x + int(g['w'] * layout.warp_w), y + int(g['h'] * layout.warp_h)), (255, 0, 0), 2)
+    for key in ('name_rect', 'id_rect'):
+        if key in config:
+            x, y, w, h = config[key]
+            p1 = (int(x * layout.warp_w), int(y * layout.warp_h))
+            cv2.rectangle(preview, p1, (p1[0] + int(w * layout.warp_w), p1[1] + int(h * layout.warp_h)), (0, 0, 255), 2)
+    return preview
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description="Fit grid_config.json from a sample scan without a window.")
+    p.add_argument('image', help='Sample scanned sheet (blank or filled)')
+    p.add_argument('--output', default='grid_config.json', help='Where to write the config (default: grid_config.json)')
+    p.add_argument('--options', help='Comma-separated option labels (default: A, B, ... for the bubbles found per row)')
+    p.add_argument('--columns', type=int, help='Expected number of question columns; a mismatch fails the calibration')
+    p.add_argument('--rows', type=int, help='Expected questions per column; a mismatch fails the calibration')
+    p.add_argument('--warp-w', type=int, help='Warped width in px (default: the marker distance)')
+    p.add_argument('--warp-h', type=int, help='Warped height in px (default: the marker distance)')
+    p.add_argument('--min-confidence', type=float, default=0.9, help='Refuse to write the config below this confidence (default: 0.9)')
+    p.add_argument('--force', action='store_true', help='Write the config even below --min-confidence')
+    p.add_argument('--report', help='Also save the confidence report to this JSON file')
+    p.add_argument('--preview', help='Save the warped sample with the fitted bubbles drawn on it')
+    p.add_argument('--reference', help='Existing grid_config.json to compare bubble positions against')
+    args = p.parse_args()
+
+    img = cv2.imread(args.image)
+    if img is None:
+        print("Cannot open", args.image); sys.exit(1)
+    try:
+        config, report, warped = calibrate(img, args.options.split(',') if args.options else None,
+                                           args.columns, args.rows, args.warp_w, args.warp_h)
+    except RuntimeError as e:
+        print("Calibration failed:", e); sys.exit(1)
+    if args.reference:
+        report['reference'] = compare_layouts(config, args.reference)
+
+    print(f"Warp {report['warp_w']}x{report['warp_h']}, bubble radius {report['bubble_radius_px']:.1f}px, "
+          f"{config['columns']} columns x {config['rows']} rows x {len(config['options'])} options")
+    for i, g in enumerate(report['grids'], 1):
+        print(f"  grid {i}: {g['bubbles_found']}/{g['bubbles_expected']} bubbles, spacing {g['spacing_px']}px, "
+              f"row pitch {g['row_pitch_px']}px, rms {g['rms_residual_px']}px")
+    if report.get('reference'):
+        print(f"  vs {args.reference}: max {report['reference']['max_px']}px, mean {report['reference']['mean_px']}px")
+    for w in report['warnings']:
+        print(f"  [WARN] {w}")
+    print(f"Confidence: {report['confidence']:.2f}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.preview:
+        cv2.imwrite(args.preview, draw_preview(warped, config))
+    if report['confidence'] < args.min_confidence and not args.force:
+        print(f"Not writing {args.output}: confidence below {args.min_confidence} (use --force to override)")
+        sys.exit(1)
+    with open(args.output, 'w') as f:
+        json.dump(config, f, indent=2)
+    print(f"Saved {args.output} with {len(config['grids'])} grids.")
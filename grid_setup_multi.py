@@ -22,6 +22,7 @@ def auto_find_corners(img):
     sq = sorted(sq, key=lambda p:(p[1],p[0]))
     tl, tr = sq[0], sq[1]
     bl, br = sq[2], sq[3]
+    if tl[0]>tr[0]: tl,tr = tr,tl
     if bl[0]>br[0]: bl,br = br,bl
     return np.array([tl,tr,br,bl],dtype='float32')
 
@@ -1,20 +1,81 @@
+import re
+
 from PIL import Image
-import torch
-from transformers import TrOCRProcessor, VisionEncoderDecoderModel
 
-def recognize_name_id(name_img_path, id_img_path, device='cpu'):
+ID_CHARSET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+# generate() settings per field. The name is free text read greedily; the ID is
+# a short code (DNI, NIE or passport) restricted to ID_CHARSET, read with a
+# small beam whose candidates are checked against the DNI/NIE control letter.
+PROFILES = {
+    'name': {'max_new_tokens': 32, 'num_beams': 1},
+    'id': {'max_new_tokens': 12, 'num_beams': 4, 'num_return_sequences': 4, 'charset': ID_CHARSET},
+}
+DNI_LETTERS = "TRWAGMYFPDXBNJZSQVHLCKE"
+NIE_PREFIX = {'X': '0', 'Y': '1', 'Z': '2'}
+# letters the model reads for handwritten digits in the number part of a DNI/NIE
+DIGIT_LOOKALIKES = str.maketrans('ODQILZSBG', '000112586')
+
+def load_model(device='cpu'):
     # Load model and processor only once (cache as global)
-    global _trocr_model, _trocr_processor, _trocr_device
+    global _trocr_model, _trocr_processor, _trocr_device, _allowed
     if '_trocr_model' not in globals() or _trocr_device != device:
+        # torch/transformers take seconds to import; only pay for it when OCR is used
+        from transformers import TrOCRProcessor, VisionEncoderDecoderModel
         _trocr_processor = TrOCRProcessor.from_pretrained('microsoft/trocr-base-handwritten')
         _trocr_model = VisionEncoderDecoderModel.from_pretrained('microsoft/trocr-base-handwritten').to(device)
         _trocr_device = device
-    def ocr(img_path):
-        image = Image.open(img_path).convert('RGB')
+        _allowed = {}
+
+def allowed_tokens(charset):
+    """Token ids made only of `charset` (spaces aside), plus end of sequence; computed once per charset."""
+    if charset not in _allowed:
+        tokenizer = _trocr_processor.tokenizer
+        ids = []
+        for i in range(len(tokenizer)):
+            text = tokenizer.decode([i]).strip()
+            if text and set(text) <= set(charset):
+                ids.append(i)
+        _allowed[charset] = ids + [tokenizer.eos_token_id]
+    return _allowed[charset]
+
+def check_id(text):
+    """Normalise an OCR'd ID and check it if it is shaped like a DNI or NIE.
+
+    Returns (id, status): status is 'valid' or 'invalid' for 8 digits, or
+    X/Y/Z and 7 digits, followed by a letter, and 'other' for anything else
+    (e.g. a passport number), which has no check letter.
+    """
+    code = re.sub(r'[^0-9A-Z]', '', text.upper())
+    if len(code) != 9 or not code[-1].isalpha():
+        return code, 'other'
+    prefix = code[0] if code[0] in NIE_PREFIX else ''
+    number = code[len(prefix):-1].translate(DIGIT_LOOKALIKES)
+    if not number.isdigit():
+        return code, 'other'
+    code = prefix + number + code[-1]
+    valid = DNI_LETTERS[int(NIE_PREFIX.get(prefix, '') + number) % 23] == code[-1]
+    return code, 'valid' if valid else 'invalid'
+
+def recognize_name_id(name_img_path, id_img_path, device='cpu'):
+    """Read the name and ID crops; returns (name, id).
+
+    The ID is the first beam candidate whose DNI/NIE check letter matches,
+    or the most likely one, normalised by check_id, if none does.
+    """
+    load_model(device)
+    def ocr(img, profile):
+        # a file path, or a BGR crop as produced by OpenCV
+        image = Image.open(img) if isinstance(img, str) else Image.fromarray(img[:, :, ::-1].copy())
+        image = image.convert('RGB')
         pixel_values = _trocr_processor(images=image, return_tensors="pt").pixel_values.to(device)
-        generated_ids = _trocr_model.generate(pixel_values)
-        text = _trocr_processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
-        return text.strip()
-    name_text = ocr(name_img_path)
-    id_text = ocr(id_img_path)
+        settings = dict(PROFILES[profile])
+        charset = settings.pop('charset', None)
+        if charset:
+            allowed = allowed_tokens(charset)
+            settings['prefix_allowed_tokens_fn'] = lambda batch_id, input_ids: allowed
+        generated_ids = _trocr_model.generate(pixel_values, **settings)
+        return [text.strip() for text in _trocr_processor.batch_decode(generated_ids, skip_special_tokens=True)]
+    name_text = ocr(name_img_path, 'name')[0]
+    candidates = [check_id(text) for text in ocr(id_img_path, 'id')]
+    id_text = next((code for code, status in candidates if status == 'valid'), candidates[0][0])
     return name_text, id_text
@@ -0,0 +1,212 @@
+"""Multi-process grading with zero-copy image handoff.
+
+The parent process decodes scans into a ring of slots in one
+`multiprocessing.shared_memory` block; worker processes grade each sheet
+through a NumPy view of its slot, save the detection/crop images themselves
+and hand the slot back. Only the slot index and the small SheetResult (without
+images) cross process boundaries, instead of tens of MB of pickled pixels.
+The number of slots also bounds how many decoded scans are alive at once.
+"""
+import os
+import queue
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, BrokenExecutor
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from omr_reader import (OMRReader, SheetRejected, SheetDuplicate, SheetFailed, Quarantine, list_sheets,
+                        retry_sheet, save_artifacts, ResultWriter, write_info_pdf, _output_dirs, _describe)
+
+class FrameRing:
+    """`slots` equally sized frame buffers in one shared-memory block.
+
+    Free slot indices travel through the `free` multiprocessing queue: the
+    producer takes one with acquire() and whoever consumes the frame puts the
+    index back on `free`.
+    """
+
+    def __init__(self, slots, slot_bytes, ctx=mp):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.free = ctx.Queue()
+        for i in range(slots):
+            self.free.put(i)
+
+    def acquire(self, timeout=None):
+        """Index of a free slot, or None if none came free within `timeout` seconds."""
+        try:
+            return self.free.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def view(self, slot, shape):
+        return frame_view(self.shm, self.slot_bytes, slot, shape)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+def frame_view(shm, slot_bytes, slot, shape):
+    """uint8 array of `shape` over slot `slot` of a shared-memory block (no copy)."""
+    return np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=slot * slot_bytes)
+
+# Per-worker state, set once by _init_worker
+_worker = {}
+
+def _init_worker(shm_name, slot_bytes, free, reader_kwargs, detections_dir, students_info_dir, artifact_format):
+    _worker['shm'] = shared_memory.SharedMemory(name=shm_name)
+    _worker['slot_bytes'] = slot_bytes
+    _worker['free'] = free
+    _worker['reader'] = OMRReader(**reader_kwargs)
+    _worker['dirs'] = (detections_dir, students_info_dir)
+    _worker['format'] = artifact_format
+
+def _grade_frame(name, slot, shape, frame=None):
+    """Grade one sheet held in `slot` (or passed by value as `frame`) inside a worker."""
+    try:
+        img = frame if frame is not None else frame_view(_worker['shm'], _worker['slot_bytes'], slot, shape)
+        sheet = _worker['reader'].read(img, name)
+        # saved before the slot is handed back, as the crops are views into it
+        save_artifacts(sheet, *_worker['dirs'], _worker['format'])
+    finally:
+        if frame is None:
+            _worker['free'].put(slot)
+    # crops are views into the slot, which may already hold the next scan
+    sheet.crops = {}
+    sheet.detections = None
+    return sheet
+
+def _retry_frame(path, failed):
+    """Run the retry ladder on a sheet that failed in a worker; returns retry_sheet's (rung, result)."""
+    reader = _worker['reader']
+    rung, result = retry_sheet(reader.read, path, failed, reader.layout.warp_w, reader.debug)
+    if rung is not None and not isinstance(result, SheetRejected):
+        save_artifacts(result, *_worker['dirs'], _worker['format'])
+        result.crops = {}
+        result.detections = None
+    return rung, result
+
+def process_folder_shm(reader_kwargs, folder, out_csv="results.csv", output_dir="output",
+                       get_info=False, processes=None, slots=None, shard=None, resume=False,
+                       artifact_format=None, duplicates='link'):
+    """Like omr_reader.process_folder, grading on `processes` worker processes.
+
+    `reader_kwargs` are the OMRReader arguments; every worker builds its own
+    reader once. The ring has `slots` frames (default: two per worker), each
+    sized for the first scan plus a margin; a larger scan is sent by value.
+    Rescans are recognised here as results come back, so with
+    duplicates='skip' they are left out of the outputs but were still read.
+    A sheet that raises in a worker is quarantined and goes down the retry
+    ladder on a worker too; only a dead worker process stops the run.
+    """
+    processes = processes or os.cpu_count() or 1
+    slots = slots or 2 * processes
+    detections_dir, students_info_dir = _output_dirs(output_dir)
+    # The parent only needs the reader for output columns and the Tema A mapping
+    reader = OMRReader(**dict(reader_kwargs, hand_writing=False))
+    writer = ResultWriter(reader, output_dir, out_csv, resume)
+    files = [f for f in list_sheets(folder, shard) if os.path.basename(f) not in writer.done]
+    index = writer.duplicate_index(duplicates)
+    quarantine = Quarantine(output_dir)
+
+    def unreadable(fname):
+        failed = SheetFailed(os.path.basename(fname), [('read', f"RuntimeError: Could not read image {fname}")])
+        quarantine.add(fname, failed)
+        return failed
+
+    def collect(fname, future, failed=None):
+        """Write one sheet's result; `failed` marks a future running the retry ladder."""
+        if failed is not None:
+            sheet = quarantine.resolve(fname, failed, *future.result())
+        else:
+            try:
+                sheet = future.result()
+            except SheetRejected as e:
+                sheet = e
+            except BrokenExecutor:
+                raise
+            except Exception as e:
+                failed = SheetFailed(os.path.basename(fname), [('read', _describe(e))])
+                quarantine.add(fname, failed)
+                sheet = quarantine.resolve(fname, failed, *pool.submit(_retry_frame, fname, failed).result())
+        settle(fname, sheet)
+
+    def settle(fname, sheet):
+        if isinstance(sheet, SheetFailed):
+            return
+        found = None
+        if not isinstance(sheet, SheetRejected) and index is not None:
+            found = index.check(sheet.file, sheet.phash, reader.layout, sheet.sheet_id)
+            if found and index.skip:
+                sheet = SheetDuplicate(*found)
+        if isinstance(sheet, SheetRejected):
+            print(f"[WARN] Skipping {os.path.basename(fname)}: {sheet}")
+            writer.reject(os.path.basename(fname), sheet)
+            return
+        if found:
+            sheet.duplicate_of = found
+            print(f"[WARN] {sheet.file} looks like a rescan of {found[0]}")
+        print(f"Processing image {os.path.basename(fname)}...")
+        writer.write(sheet)
+
+    # The first readable scan sizes the ring's slots
+    first, skip = None, 0
+    while skip < len(files) and first is None:
+        first = cv2.imread(files[skip])
+        skip += first is None
+    if first is None:
+        # nothing OpenCV can decode as is: only the retry ladder is left, here
+        for fname in files:
+            failed = unreadable(fname)
+            rung, sheet = retry_sheet(reader.read, fname, failed, reader.layout.warp_w, reader.debug)
+            if rung is not None and not isinstance(sheet, SheetRejected):
+                save_artifacts(sheet, detections_dir, students_info_dir, artifact_format)
+            settle(fname, quarantine.resolve(fname, failed, rung, sheet))
+    else:
+        ctx = mp.get_context()
+        ring = FrameRing(slots, int(first.nbytes * 1.25), ctx)
+        in_flight = deque()
+        try:
+            with ProcessPoolExecutor(max_workers=processes, mp_context=ctx, initializer=_init_worker,
+                                     initargs=(ring.shm.name, ring.slot_bytes, ring.free, reader_kwargs,
+                                               detections_dir, students_info_dir, artifact_format)) as pool:
+                for i, fname in enumerate(files):
+                    if i == skip:
+                        img, first = first, None
+                    else:
+                        img = cv2.imread(fname)
+                    name = os.path.basename(fname)
+                    if img is None:
+                        failed = unreadable(fname)
+                        in_flight.append((fname, pool.submit(_retry_frame, fname, failed), failed))
+                        continue
+                    if img.nbytes > ring.slot_bytes:
+                        future = pool.submit(_grade_frame, name, None, img.shape, img)
+                    else:
+                        # wait while every slot is still being graded, surfacing a dead worker
+                        slot = ring.acquire(timeout=1.0)
+                        while slot is None:
+                            for _, fut, _ in in_flight:
+                                error = fut.exception() if fut.done() else None
+                                if isinstance(error, BrokenExecutor):
+                                    raise error
+                            slot = ring.acquire(timeout=1.0)
+                        ring.view(slot, img.shape)[...] = img
+                        future = pool.submit(_grade_frame, name, slot, img.shape)
+                    img = None
+                    in_flight.append((fname, future, None))
+                    while in_flight and in_flight[0][1].done():
+                        collect(*in_flight.popleft())
+                while in_flight:
+                    collect(*in_flight.popleft())
+        finally:
+            ring.close()
+
+    writer.close()
+    quarantine.close()
+    if get_info:
+        write_info_pdf(output_dir)
@@ -0,0 +1,1743 @@
+"""Importable OMR engine.
+
+`OMRReader` is built once from a grid configuration (plus answer keys,
+scoring, themes, roster and optional OCR) and then grades sheets with
+`read(image)` or `read_many(images)`. Everything loaded at construction is
+read-only afterwards; per-sheet state lives in locals and in the optional
+`MarkerTracker` a caller passes in, so one reader can be shared by many
+threads. OMR-reader.py is the command-line front end.
+"""
+import os
+import csv as csvmod
+import glob
+import json
+import time
+import shutil
+import hashlib
+import threading
+import importlib
+import importlib.util
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from dataclasses import dataclass, field
+
+import cv2
+import numpy as np
+
+# Normalized (x, y, w, h) of the "Tema X" header drawn by omr_sheet.py, in warped coordinates
+DEFAULT_THEME_RECT = (0.22, 0.045, 0.16, 0.025)
+# Normalized region holding the optional sheet QR printed between the bottom markers
+DEFAULT_QR_RECT = (0.40, 0.925, 0.20, 0.075)
+# Orientation bar printed by omr_sheet.py beside the top-left marker, towards the
+# top-right one: (distance of its centre from the marker centre, length,
+# thickness), in marker sides; a side of the scan whose samples are at least
+# ORIENTATION_MIN_INK inked holds it (printed text stays well below)
+ORIENTATION_BAR = (1.125, 0.75, 0.3)
+ORIENTATION_MIN_INK = 0.8
+INFO_COLUMNS = ["image", "name", "id", "sheet_id", "source"]
+# Second pass: share of a bubble's inner disc that must be inked to count as marked
+RECHECK_FILL = 0.3
+# Fast pass: a runner-up this close to the darkest bubble may be a second mark
+MULTI_MARK_RATIO = 0.4
+# A blank question whose bubbles are all within this share of the darkest one is
+# clearly blank (only the printed outlines and paper shade), not sent to review
+BLANK_SPREAD = 0.15
+REVIEW_COLUMNS = ["file", "question", "answer", "confidence", "flag", "fills"]
+# Fill tensor (see FillStore): second-pass fractions are stored x RECHECK_SCALE,
+# FILL_MISSING marks questions the second pass did not re-read
+FILL_MISSING = 0xFFFF
+RECHECK_SCALE = 10000
+# Adaptive thresholds (--fill-mode sheet/column): blank and marked bubbles must
+# differ by this share of the bubble area, and two clusters must fit the fills
+# better than one by this Kittler-Illingworth error (under 0.5 when the split
+# only halves one cluster, above 5 on real sheets), or the fixed --min-fill is used
+FILL_MODES = ('fixed', 'sheet', 'column')
+ADAPTIVE_MIN_GAP = 0.15
+ADAPTIVE_MIN_GAIN = 1.0
+# Pre-flight (see preflight) on a thumbnail about PREFLIGHT_WIDTH px wide: share
+# of dark pixels of a real page, and normalised Laplacian variance below which
+# a scan is too blurred to read (sharp scans give 3-5, a 6 px blur about 0.1)
+PREFLIGHT_WIDTH = 512
+MIN_INK = 0.002
+MAX_INK = 0.5
+MIN_SHARPNESS = 0.2
+REJECT_COLUMNS = ["file", "reason", "ink", "sharpness", "markers"]
+# Duplicate detection (see sheet_hash): rescans of one sheet differ in at most a
+# few bits (3 in our tests) of their hashes, sheets one answer apart in 4 or more
+DUPLICATE_DISTANCE = 3
+DUPLICATE_COLUMNS = ["file", "duplicate_of", "distance", "action"]
+# Retry ladder (see retry_sheet) for sheets whose read raised, in the order tried,
+# and the marker search options of the rungs that change it
+RETRY_LADDER = ('blur', 'threshold', 'full-resolution', 'flip')
+MARKER_RETRIES = {'blur': {'blur': 9}, 'threshold': {'adaptive': True}}
+
+class Layout:
+    """Bubble geometry and named regions of one grid_config.json, in warped pixels."""
+
+    def __init__(self, cfg):
+        if 'grids' not in cfg and 'x_offsets' not in cfg:
+            raise RuntimeError(
+                "Invalid grid_config.json: missing grid definitions. "
+                "Please regenerate using grid_setup_multi.py with --columns <num> --rows <num> --options <labels>."
+            )
+        self.cfg = cfg
+        self.warp_w = WARP_W = cfg['warp_w']
+        self.warp_h = WARP_H = cfg['warp_h']
+        self.options = OPTIONS = tuple(cfg['options'])
+        self.rows = ROWS = cfg['rows']
+        bp = []
+        grid_bubble_params = []
+        if 'grids' in cfg:
+            grids = cfg['grids']
+            self.cols = len(grids)
+            for col, g in enumerate(grids):
+                x0, y0, w0, h0 = g['x'], g['y'], g['w'], g['h']
+                spacing = g.get('bubble_spacing_px')
+                radius = g.get('bubble_radius_px')
+                x0_px = x0 * WARP_W
+                y0_px = y0 * WARP_H
+                h0_px = h0 * WARP_H
+                grid_bubble_params.append({'spacing': spacing, 'radius': radius, 'x0_px': x0_px, 'y0_px': y0_px, 'h0_px': h0_px})
+                for i in range(ROWS):
+                    y_px = y0_px + (i + 0.5) * (h0_px / ROWS)
+                    for j, opt in enumerate(OPTIONS):
+                        x_px = x0_px + (radius or 0) + j * (spacing or 0)
+                        nx = x_px / WARP_W
+                        ny = y_px / WARP_H
+                        qnum = col * ROWS + i + 1
+                        bp.append((qnum, opt, (nx, ny), col))
+        else:
+            self.cols = COLS = cfg.get('columns', cfg.get('cols'))
+            x_offsets = cfg['x_offsets']
+            y_start = cfg['y_start']; y_step = cfg['y_step']
+            col_width = cfg.get('col_width', 0.2)
+            for col in range(COLS):
+                for i in range(ROWS):
+                    y = y_start + i*y_step
+                    xs = np.linspace(x_offsets[col], x_offsets[col] + col_width, len(OPTIONS))
+                    for j, x in enumerate(xs):
+                        qnum = col * ROWS + i + 1
+                        bp.append((qnum, OPTIONS[j], (x, y), col))
+        self.bubble_positions = tuple(bp)
+        self.grid_bubble_params = tuple(grid_bubble_params)
+        self.questions = sorted({q for q, _, _, _ in bp})
+        # answer column and bubble window area (the most dark pixels a bubble can have) of each question
+        col_of = {q: col for q, _, _, col in bp}
+        self.question_columns = np.array([col_of[q] for q in self.questions])
+        self.bubble_areas = np.array([(2 * self.bubble_radius(col_of[q], 20)) ** 2 for q in self.questions])
+        # normalized bounding box of every bubble, hashed when there are no name/ID boxes
+        pad = max(self.bubble_radius(col, 20) for col in range(self.cols))
+        xs = [x for _, _, (x, _), _ in bp]
+        ys = [y for _, _, (_, y), _ in bp]
+        self.answer_rect = (min(xs) - pad / WARP_W, min(ys) - pad / WARP_H,
+                            max(xs) - min(xs) + 2 * pad / WARP_W, max(ys) - min(ys) + 2 * pad / WARP_H)
+        self.name_rect = cfg.get('name_rect')
+        self.id_rect = cfg.get('id_rect')
+        self.theme_rect = tuple(cfg.get('theme_rect', DEFAULT_THEME_RECT))
+        self.qr_rect = tuple(cfg.get('qr_rect', DEFAULT_QR_RECT))
+
+    def bubble_radius(self, col, default):
+        if col < len(self.grid_bubble_params):
+            return int(self.grid_bubble_params[col]['radius'] or default)
+        return default
+
+def load_layout(path='grid_config.json'):
+    with open(path) as f:
+        return Layout(json.load(f))
+
+def marker_threshold(img):
+    """Otsu threshold between ink and paper, taken from every 4th pixel of a scan.
+
+    find_markers and the MarkerTracker windows binarise with this same value,
+    so a marker confirmed in a window gets exactly the centroid a full
+    search would give. Sampling keeps it cheap next to a window search.
+    """
+    gray = cv2.cvtColor(np.ascontiguousarray(img[::4, ::4]), cv2.COLOR_BGR2GRAY)
+    t, _ = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return t
+
+def find_markers(img, debug=0, return_sides=False, threshold=None, blur=5, adaptive=False, debug_dir=None):
+    """Find the four filled corner squares and return their centroids, in the sheet's TL, TR, BR, BL order.
+
+    `blur` (the Gaussian kernel) and `adaptive` (a local threshold instead of
+    the scan-wide one) are only changed by the retry ladder. With debug >= 1
+    and a `debug_dir`, a failed search saves its binarised scan there as
+    debug_markers.png.
+    """
+    threshold = marker_threshold(img) if threshold is None else threshold
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    smooth = cv2.GaussianBlur(gray, (blur, blur), 0)
+    if adaptive:
+        # a block well above a marker's side, so a marker's inside is not taken for paper
+        block = max(img.shape[:2]) // 8 | 1
+        th = cv2.adaptiveThreshold(smooth, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, block, 15)
+    else:
+        _, th = cv2.threshold(smooth, threshold, 255, cv2.THRESH_BINARY_INV)
+
+    cnts, _ = cv2.findContours(th, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if debug >= 1:
+        print(f"[DEBUG] Total contours found: {len(cnts)}")
+    squares = []
+    for idx, c in enumerate(cnts):
+        area = cv2.contourArea(c)
+        x, y, w, h = cv2.boundingRect(c)
+        if debug >= 1:
+            print(f"[DEBUG] Contour {idx}: area={area}, bbox=({x},{y},{w},{h})")
+        if area < 2000:
+            continue
+        peri = cv2.arcLength(c, True)
+        approx = cv2.approxPolyDP(c, 0.02 * peri, True)
+        if len(approx) == 4:
+            ratio = w / float(h)
+            if debug >= 1:
+                print(f"[DEBUG] Contour {idx} is quadrilateral, ratio={ratio}")
+            if 0.8 <= ratio <= 1.2:
+                cx, cy = x + w/2, y + h/2
+                squares.append((cx, cy, (w + h) / 2))
+                if debug >= 1:
+                    print(f"[DEBUG] Contour {idx} accepted as marker at ({cx},{cy})")
+    if debug >= 1:
+        print(f"[DEBUG] Total markers found: {len(squares)}")
+    if len(squares) != 4:
+        message = f"Could not find 4 markers, found {len(squares)}"
+        if debug >= 1 and debug_dir:
+            path = os.path.join(debug_dir, "debug_markers.png")
+            os.makedirs(debug_dir, exist_ok=True)
+            cv2.imwrite(path, th)
+            message += f" – see {path}"
+        if debug >= 1:
+            print(f"[DEBUG] {message}")
+        raise RuntimeError(message)
+    squares = np.array(squares, dtype="float32")
+    pts = squares[:, :2]
+    s = pts.sum(axis=1)
+    diff = np.diff(pts, axis=1)
+    order = [np.argmin(s), np.argmin(diff), np.argmax(s), np.argmax(diff)]
+    corners, sides = orient_markers(img, pts[order], squares[order, 2].tolist(), threshold, debug)
+    if debug >= 1:
+        tl, tr, br, bl = corners
+        print(f"[DEBUG] Marker coordinates: tl={tl}, tr={tr}, br={br}, bl={bl}")
+    if return_sides:
+        return corners, sides
+    return corners
+
+def orient_markers(img, corners, sides, threshold, debug=0):
+    """Rotate the TL, TR, BR, BL order of marker centroids from the scan's corners to the sheet's.
+
+    A sheet scanned upside down or sideways has its top-left marker in
+    another corner of the scan. The orientation bar printed beside it (see
+    ORIENTATION_BAR) is looked for by sampling a few pixels along each side,
+    clockwise from each marker; the image itself is never rotated. Sheets
+    without the bar (printed before it) keep the scan's order. A bar found
+    only counter-clockwise of a marker means a mirrored scan, which raises
+    RuntimeError (the retry ladder's 'flip' rung reads it mirrored back).
+    """
+    offset, length, thickness = ORIENTATION_BAR
+    u = offset + np.linspace(-0.4, 0.4, 9) * length
+    v = np.linspace(-0.25, 0.25, 3) * thickness
+
+    def with_bar(step):
+        """Markers with the bar beside them, towards the next marker (step 1) or the previous one (-1)."""
+        found = []
+        for i in range(4):
+            p, q = corners[i], corners[(i + step) % 4]
+            along = (q - p) / max(float(np.linalg.norm(q - p)), 1.0)
+            across = np.array([-along[1], along[0]])
+            at = p + sides[i] * (u[:, None, None] * along + v[None, :, None] * across)
+            x = np.clip(np.rint(at[..., 0]).astype(int), 0, img.shape[1] - 1)
+            y = np.clip(np.rint(at[..., 1]).astype(int), 0, img.shape[0] - 1)
+            px = img[y, x].astype(np.float32)
+            gray = px @ np.float32([0.114, 0.587, 0.299]) if px.ndim == 3 else px
+            if (gray < threshold).mean() >= ORIENTATION_MIN_INK:
+                found.append(i)
+        return found
+
+    clockwise = with_bar(1)
+    if not clockwise and len(with_bar(-1)) == 1:
+        raise RuntimeError("Mirrored scan: the orientation bar is counter-clockwise of a marker")
+    if len(clockwise) != 1 or clockwise[0] == 0:
+        return np.asarray(corners, dtype="float32"), list(sides)
+    k = clockwise[0]
+    if debug >= 1:
+        print(f"[DEBUG] Sheet rotated by {90 * k}°: top-left marker is scan corner {k}")
+    return np.roll(np.asarray(corners, dtype="float32"), -k, axis=0), list(sides[k:]) + list(sides[:k])
+
+class SheetRejected(RuntimeError):
+    """A page that failed the pre-flight checks; `reason` is 'blank', 'dark', 'blurred' or 'no markers'."""
+
+    def __init__(self, reason, checks=None):
+        super().__init__(reason, checks or {})
+        self.reason = reason
+        self.checks = checks or {}
+
+    def __str__(self):
+        return f"rejected ({self.reason}): " + ", ".join(f"{k} {v}" for k, v in self.checks.items())
+
+    def row(self, file):
+        """rejects.csv row of this page."""
+        return {"file": file, "reason": self.reason, **self.checks}
+
+def corner_markers(thumb):
+    """Number of quadrants of a grayscale thumbnail holding a solid, square dark blob (a corner marker)."""
+    h, w = thumb.shape
+    _, th = cv2.threshold(thumb, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    n, _, stats, centroids = cv2.connectedComponentsWithStats(th)
+    found = set()
+    for (x, y, bw, bh, area), (cx, cy) in zip(stats[1:], centroids[1:]):
+        # filled squares only: a filled bubble covers ~0.78 of its bounding box
+        if 0.01 * w <= (bw + bh) / 2 <= 0.1 * w and 0.7 <= bw / bh <= 1.4 and area >= 0.85 * bw * bh:
+            found.add((cx >= w / 2, cy >= h / 2))
+    return len(found)
+
+def preflight(img):
+    """Cheap checks on a thumbnail, before the full-resolution marker search.
+
+    Returns (reason, checks): reason is None for a page worth reading, else
+    'blank' (almost no ink: separator pages, blank backs), 'dark', 'blurred'
+    or 'no markers' (fewer than 4 corners with a marker); checks holds the
+    ink share, the sharpness and the marker count behind the decision.
+    """
+    k = max(1, round(img.shape[1] / PREFLIGHT_WIDTH))
+    # an integer factor takes OpenCV's fast INTER_AREA path (~10 ms on an A4 scan)
+    small = cv2.resize(img, None, fx=1 / k, fy=1 / k, interpolation=cv2.INTER_AREA) if k > 1 else img
+    thumb = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    ink = float((thumb < 128).mean())
+    sharpness = float(cv2.Laplacian(thumb, cv2.CV_32F).var()) / max(float(thumb.var()), 1.0)
+    markers = corner_markers(thumb)
+    checks = {"ink": round(ink, 4), "sharpness": round(sharpness, 3), "markers": markers}
+    if ink < MIN_INK:
+        reason = 'blank'
+    elif ink > MAX_INK:
+        reason = 'dark'
+    elif sharpness < MIN_SHARPNESS:
+        reason = 'blurred'
+    elif markers < 4:
+        reason = 'no markers'
+    else:
+        reason = None
+    return reason, checks
+
+class SheetDuplicate(SheetRejected):
+    """A sheet whose hash matches an earlier sheet of the run (see DuplicateIndex)."""
+
+    def __init__(self, original, distance):
+        super().__init__('duplicate', {"duplicate_of": original, "distance": distance})
+        self.args = (original, distance)   # what pickling (worker processes) passes back to __init__
+        self.original = original
+        self.distance = distance
+
+    def __str__(self):
+        return f"duplicate of {self.original} (hash distance {self.distance})"
+
+    def row(self, file):
+        """duplicates.csv row of this sheet."""
+        return {"file": file, "duplicate_of": self.original, "distance": self.distance, "action": "skipped"}
+
+class SheetFailed(RuntimeError):
+    """A sheet that raised while being read; `attempts` holds (rung, error) for the first read and each retry."""
+
+    def __init__(self, file, attempts):
+        super().__init__(file, attempts)
+        self.file = file
+        self.attempts = list(attempts)
+
+    def __str__(self):
+        return self.attempts[-1][1]
+
+    def record(self):
+        """failures.json record of this sheet."""
+        return {"file": self.file, "error": self.attempts[-1][1],
+                "attempts": [{"rung": rung, "error": error} for rung, error in self.attempts]}
+
+def _describe(error):
+    return f"{type(error).__name__}: {error}"
+
+def _marker_in_window(img, cx, cy, side, threshold):
+    """Look for one filled square marker in a small window around (cx, cy).
+
+    The window is binarised like find_markers does the whole scan, with the
+    scan's marker_threshold. Returns the marker's centroid and side length,
+    or None if no whole marker lies within half a marker side of (cx, cy)
+    or the marker would not lie wholly inside the scan (e.g. after a larger
+    or sideways scan).
+    """
+    if not (side / 2 <= cx <= img.shape[1] - side / 2 and side / 2 <= cy <= img.shape[0] - side / 2):
+        return None
+    half = int(1.5 * side)
+    x0 = max(0, int(cx) - half); y0 = max(0, int(cy) - half)
+    x1 = min(img.shape[1], int(cx) + half); y1 = min(img.shape[0], int(cy) + half)
+    gray = cv2.cvtColor(img[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+    blur = cv2.GaussianBlur(gray, (5,5), 0)
+    _, th = cv2.threshold(blur, threshold, 255, cv2.THRESH_BINARY_INV)
+    cnts, _ = cv2.findContours(th, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    for c in cnts:
+        if cv2.contourArea(c) < 0.5 * side * side:
+            continue
+        x, y, w, h = cv2.boundingRect(c)
+        # the blur differs from the full scan's within 2 px of the window
+        # border, so a marker must keep clear of it to get the same outline
+        if x < 3 or y < 3 or x + w > th.shape[1] - 3 or y + h > th.shape[0] - 3:
+            continue
+        peri = cv2.arcLength(c, True)
+        approx = cv2.approxPolyDP(c, 0.02 * peri, True)
+        if len(approx) != 4 or not 0.8 <= w / float(h) <= 1.2:
+            continue
+        mx, my = x0 + x + w/2, y0 + y + h/2
+        if abs(mx - cx) <= side / 2 and abs(my - cy) <= side / 2:
+            return (mx, my), (w + h) / 2
+    return None
+
+class MarkerTracker:
+    """Remembers the previous sheet's markers for consecutive scans from one feeder.
+
+    Not thread-safe: use one tracker per sequential stream of sheets.
+    """
+
+    def __init__(self):
+        self.last = None  # (pts, marker sides, homography, warp size) of the previous sheet
+
+    def reset(self):
+        self.last = None
+
+    def track(self, img, threshold=None):
+        """Confirm the previous sheet's markers in small windows; None if any is missing."""
+        if self.last is None:
+            return None
+        pts, sides, _, _ = self.last
+        threshold = marker_threshold(img) if threshold is None else threshold
+        found = []
+        for (cx, cy), side in zip(pts, sides):
+            m = _marker_in_window(img, cx, cy, side, threshold)
+            if m is None:
+                return None
+            found.append(m)
+        return np.array([p for p, _ in found], dtype="float32"), [s for _, s in found]
+
+def sheet_homography(img, warp_w, warp_h, tracker=None, debug=0, markers=None, debug_dir=None):
+    """Return the marker centroids and the homography to the warped sheet.
+
+    With a `tracker`, the previous sheet's markers are checked first in
+    small windows; the full contour search only runs when that fails. The
+    confirmed centroids are the ones a full search would find, and the
+    previous homography is reused when they are unchanged. Either way the
+    markers are put in the sheet's own order (see orient_markers), so the
+    next sheet may lie the other way round in the feeder.
+    `markers` skips the search when the caller already located them.
+    `debug_dir` is passed on to find_markers.
+    """
+    threshold = marker_threshold(img) if markers is None else None
+    tracked = last = None
+    if tracker is not None and markers is None:
+        tracked, last = tracker.track(img, threshold), tracker.last
+        # forgotten until this sheet succeeds, so a failed sheet is not tracked again
+        tracker.reset()
+    M = None
+    if markers is not None:
+        pts, sides = markers, [0.0] * 4
+    elif tracked is not None:
+        pts, sides = orient_markers(img, *tracked, threshold, debug)
+        prev_pts, _, prev_M, prev_size = last
+        if prev_size == (warp_w, warp_h) and np.array_equal(pts, prev_pts):
+            M = prev_M
+        if debug >= 1:
+            print(f"[DEBUG] Markers confirmed around previous positions: {pts.tolist()}")
+    else:
+        pts, sides = find_markers(img, debug, return_sides=True, threshold=threshold, debug_dir=debug_dir)
+    if M is None:
+        dst = np.array([[0,0],[warp_w,0],[warp_w,warp_h],[0,warp_h]], dtype="float32")
+        M = cv2.getPerspectiveTransform(pts, dst)
+    if tracker is not None and markers is None:
+        tracker.last = (pts, sides, M, (warp_w, warp_h))
+    return pts, M
+
+def crop_rect(warped, rect):
+    """Crop a normalized (x, y, w, h) rectangle out of a warped sheet."""
+    H, W = warped.shape[:2]
+    x, y, w, h = rect
+    x1 = max(0, int(x * W)); y1 = max(0, int(y * H))
+    x2 = min(W, int((x + w) * W)); y2 = min(H, int((y + h) * H))
+    return warped[y1:y2, x1:x2]
+
+def detect_theme(warped, templates, theme_rect, debug=0):
+    """Return the theme whose header template best matches the warped sheet, and all scores."""
+    band = cv2.cvtColor(crop_rect(warped, theme_rect), cv2.COLOR_BGR2GRAY)
+    scores = {}
+    for tema, tpl in templates.items():
+        res = cv2.matchTemplate(band, tpl, cv2.TM_CCOEFF_NORMED)
+        scores[tema] = float(res.max())
+    tema = max(scores, key=scores.get)
+    if debug >= 1:
+        print(f"[DEBUG] Theme scores: " + ", ".join(f"{t}={v:.3f}" for t, v in scores.items()) + f" -> {tema}")
+    return tema, scores
+
+def decode_sheet_qr(warped, qr_rect, debug=0):
+    """Decode the sheet QR (OMR:<layout>:<tema>:<sheet_id>) printed by omr_sheet.py.
+
+    Only the small fixed QR region of the warped sheet is searched. Returns a
+    dict with 'layout', 'tema' and 'sheet_id', or None if no valid code is found.
+    """
+    data, _, _ = cv2.QRCodeDetector().detectAndDecode(crop_rect(warped, qr_rect))
+    parts = data.split(':', 3) if data else []
+    if len(parts) != 4 or parts[0] != 'OMR':
+        if debug >= 1:
+            print("[DEBUG] No sheet QR found")
+        return None
+    if debug >= 1:
+        print(f"[DEBUG] Sheet QR: {data}")
+    return {'layout': parts[1], 'tema': parts[2], 'sheet_id': parts[3]}
+
+def measure_bubbles(warped, layout, debug=0):
+    """Return {question: [(fill, option, (x, y), column), ...]} for one warped sheet."""
+    WARP_W, WARP_H = layout.warp_w, layout.warp_h
+    gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
+    answers = {}
+    for q, opt, (nx, ny), col in layout.bubble_positions:
+        x = int(nx * WARP_W)
+        y = int(ny * WARP_H)
+        r = layout.bubble_radius(col, 20)
+        y1 = max(0, y-r); y2 = min(WARP_H, y+r)
+        x1 = max(0, x-r); x2 = min(WARP_W, x+r)
+        mask = gray[y1:y2, x1:x2]
+        _, m = cv2.threshold(mask, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        fill = cv2.countNonZero(m)
+        if debug == 2:
+            print(f"Q{q} Opt:{opt} Fill:{fill}")
+        if q not in answers:
+            answers[q] = []
+        answers[q].append((fill, opt, (x, y), col))
+    return answers
+
+def split_fills(values, min_gap=ADAPTIVE_MIN_GAP, min_gain=ADAPTIVE_MIN_GAIN):
+    """Two-cluster split of bubble fills along the last axis.
+
+    The split point minimises the Kittler-Illingworth error of fitting one
+    normal distribution to each side. Unlike Otsu's it copes with a tight
+    blank cluster next to a wide marked one (faint and dark pencil on the same
+    sheet). Returns the threshold halfway between the darkest blank and the
+    lightest marked value of each row, or NaN where the cluster means are
+    less than `min_gap` apart or where two clusters do not fit better than
+    one by `min_gain` (all blank, or all marked: the best split then just
+    halves one cluster).
+    """
+    v = np.sort(values, axis=-1).astype(float)
+    n = v.shape[-1]
+    k = np.arange(1, n)
+    p = k / n
+    s1, s2 = np.cumsum(v, axis=-1)[..., :-1], np.cumsum(v * v, axis=-1)[..., :-1]
+    t1, t2 = v.sum(axis=-1, keepdims=True), (v * v).sum(axis=-1, keepdims=True)
+    low, high = s1 / k, (t1 - s1) / (n - k)
+    var_low = np.maximum(s2 / k - low ** 2, 1e-6)
+    var_high = np.maximum((t2 - s2) / (n - k) - high ** 2, 1e-6)
+    error = (p * np.log(var_low) + (1 - p) * np.log(var_high)) / 2 - p * np.log(p) - (1 - p) * np.log(1 - p)
+    best = error.argmin(axis=-1)[..., None]
+    at = lambda a: np.take_along_axis(a, best, -1)[..., 0]
+    threshold = (at(v[..., :-1]) + at(v[..., 1:])) / 2
+    # error of a single normal distribution over all the fills
+    single = np.log(np.maximum(t2[..., 0] / n - (t1[..., 0] / n) ** 2, 1e-6)) / 2
+    gain = single - error.min(axis=-1)
+    return np.where((at(high) - at(low) >= min_gap) & (gain >= min_gain), threshold, np.nan)
+
+def fill_thresholds(fills, columns, areas, min_fill, mode='fixed'):
+    """Per-question fill threshold in pixels, for fills of shape (..., questions, options).
+
+    `min_fill` is a pixel count, or a fraction of the bubble area when below 1.
+    'sheet' splits all the bubbles of a sheet into blank and marked, 'column'
+    does it per answer column. Both split fills taken as fractions of the
+    bubble area and fall back to `min_fill` where there is no clear split.
+    """
+    areas = np.asarray(areas, dtype=float)
+    fills = np.asarray(fills, dtype=float)
+    fixed = min_fill * areas if min_fill < 1 else np.full(areas.shape, float(min_fill))
+    thresholds = np.broadcast_to(fixed, fills.shape[:-1]).copy()
+    if mode == 'fixed':
+        return thresholds
+    columns = np.asarray(columns)
+    groups = [slice(None)] if mode == 'sheet' else [columns == c for c in np.unique(columns)]
+    for sel in groups:
+        part = fills[..., sel, :] / areas[sel, None]
+        split = split_fills(part.reshape(part.shape[:-2] + (-1,)))[..., None] * areas[sel]
+        thresholds[..., sel] = np.where(np.isnan(split), thresholds[..., sel], split)
+    return thresholds
+
+def detect_answers(warped, layout, min_fill, debug=0, measured=None):
+    """Return {question: (option or '', (x, y), column, fills)} for one warped sheet.
+
+    `min_fill` is one pixel threshold or a {question: threshold} dict;
+    `measured` reuses the output of measure_bubbles.
+    """
+    answers = measured if measured is not None else measure_bubbles(warped, layout, debug)
+    results = {}
+    for q, lst in answers.items():
+        fill, opt, pos, col = max(lst, key=lambda x: x[0])
+        if fill < (min_fill[q] if isinstance(min_fill, dict) else min_fill):
+            if debug == 2:
+                print(f"Q{q} selected: - (no bubble above threshold, max fill={fill})")
+            elif debug == 1:
+                print(f"Q{q} selected: - (no bubble above threshold)")
+            opt = ""
+        else:
+            if debug == 2:
+                print(f"Q{q} selected: {opt} (fill={fill})")
+            elif debug == 1:
+                print(f"Q{q} selected: {opt}")
+        results[q] = (opt, pos, col, [f for f, _, _, _ in lst])
+    return results
+
+def question_confidence(fills, opt, min_fill):
+    """Rough 0-1 confidence of one question's decision from its bubble fills.
+
+    A marked answer is confident when it clearly beats both the runner-up
+    and min_fill; a blank one when even the darkest bubble is far below min_fill.
+    """
+    top = sorted(fills, reverse=True) + [0]
+    if opt:
+        margin = min(top[0] - top[1], top[0] - min_fill) / (top[0] or 1)
+    else:
+        margin = (min_fill - top[0]) / (min_fill or 1)
+    return round(max(0.0, min(1.0, margin)), 3)
+
+def clearly_blank(fills, min_fill):
+    """True if no bubble reaches min_fill and none stands out from the rest."""
+    top, low = max(fills), min(fills)
+    return top < min_fill and top - low <= BLANK_SPREAD * top
+
+def dct_hash(gray):
+    """63 bits of a grayscale image: its lowest 8x8 DCT frequencies (minus DC) above their median."""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].ravel()[1:]
+    return low > np.median(low)
+
+def sheet_hash(warped, layout, answers):
+    """Perceptual hash of what makes a warped sheet unique, as an int (0 without marks).
+
+    The printed form is the same on every sheet, so only its variable parts
+    are hashed: one bit per bubble, set on the answer read for its question
+    (`answers`, after the second pass; so neither sub-pixel registration nor
+    noise in blank bubbles matters), and a DCT hash of the name and ID boxes,
+    or of the whole answer area when the layout has no boxes. A rescan of
+    the same sheet lands within a few bits.
+    """
+    marks = np.array([[answers.get(q) == opt for opt in layout.options] for q in layout.questions])
+    if not marks.any():
+        return 0
+    gray = cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY)
+    rects = [rect for rect in (layout.name_rect, layout.id_rect) if rect] or [layout.answer_rect]
+    parts = [marks.ravel()] + [dct_hash(crop_rect(gray, rect)) for rect in rects]
+    return int.from_bytes(np.packbits(np.concatenate(parts)).tobytes(), 'big')
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+class DuplicateIndex:
+    """BK-tree of the sheet hashes seen in one run, for near-duplicate lookups.
+
+    Every node keeps its children by Hamming distance; by the triangle
+    inequality a lookup within `radius` only descends into children whose
+    distance is within `radius` of its own, so each check touches a small,
+    slowly growing part of the tree instead of every earlier sheet. Sheets
+    of different layouts are kept apart, and sheets whose QR carries a
+    different sheet ID are never taken for each other. Thread-safe.
+    """
+
+    def __init__(self, radius=DUPLICATE_DISTANCE, skip=False):
+        self.radius = radius
+        self.skip = skip
+        self._roots = {}
+        self._lock = threading.Lock()
+
+    def _find(self, node, name, phash, sheet_id):
+        best = None
+        stack = [node]
+        while stack:
+            h, other, other_id, children = stack.pop()
+            d = hamming(phash, h)
+            if d <= self.radius and (best is None or d < best[1]) and other != name \
+                    and not (sheet_id and other_id and sheet_id != other_id):
+                best = (other, d)
+            stack.extend(child for k, child in children.items() if d - self.radius <= k <= d + self.radius)
+        return best
+
+    def check(self, name, phash, group=None, sheet_id=None):
+        """(earlier sheet, distance) if `phash` is a near-duplicate, else None after indexing it.
+
+        A hash of 0 (a sheet without marks) is neither matched nor indexed. A
+        sheet never matches its own name: a read that failed after indexing
+        is retried under the same name.
+        """
+        if not phash:
+            return None
+        with self._lock:
+            node = self._roots.get(group)
+            if node is None:
+                self._roots[group] = (phash, name, sheet_id, {})
+                return None
+            found = self._find(node, name, phash, sheet_id)
+            if found:
+                return found
+            while True:
+                d = hamming(phash, node[0])
+                if d not in node[3]:
+                    node[3][d] = (phash, name, sheet_id, {})
+                    return None
+                node = node[3][d]
+
+def native_scale(M, layout):
+    """Scan pixels per warped pixel along the sheet width (never below 1)."""
+    corners = np.array([[0, 0], [layout.warp_w, 0], [layout.warp_w, layout.warp_h], [0, layout.warp_h]],
+                       dtype="float32").reshape(-1, 1, 2)
+    tl, tr, br, bl = cv2.perspectiveTransform(corners, np.linalg.inv(M)).reshape(4, 2)
+    width = (np.linalg.norm(tr - tl) + np.linalg.norm(br - bl)) / 2
+    return max(1.0, width / layout.warp_w)
+
+def recheck_question(img, M, layout, bubbles, scale, min_fraction=RECHECK_FILL, debug=0):
+    """Second, slower look at one question's bubbles straight from the scan.
+
+    Only the question's row is re-warped, at the scan's native resolution;
+    it is binarised with an adaptive local threshold and each bubble is
+    measured inside a circular mask that leaves out the printed outline.
+    `bubbles` is [(option, (x, y), radius)] in warped coordinates. Returns
+    (option or '', fractions of each inner disc inked, number of marked bubbles).
+    """
+    xs = [x for _, (x, _), _ in bubbles]
+    y = bubbles[0][1][1]
+    r = max(rad for _, _, rad in bubbles)
+    x0, y0 = min(xs) - 1.5 * r, y - 1.5 * r
+    w = int(np.ceil((max(xs) - min(xs) + 3 * r) * scale))
+    h = int(np.ceil(3 * r * scale))
+    P = np.array([[scale, 0, -x0 * scale], [0, scale, -y0 * scale], [0, 0, 1]]) @ M
+    row = cv2.cvtColor(cv2.warpPerspective(img, P, (w, h)), cv2.COLOR_BGR2GRAY)
+    block = int(3 * r * scale) | 1
+    ink = cv2.adaptiveThreshold(row, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, block, 10)
+    fractions = []
+    for opt, (x, _), rad in bubbles:
+        disc = np.zeros_like(ink)
+        center = (int(round((x - x0) * scale)), int(round((y - y0) * scale)))
+        cv2.circle(disc, center, max(1, int(0.75 * rad * scale)), 255, -1)
+        fractions.append(cv2.countNonZero(cv2.bitwise_and(ink, disc)) / max(1, cv2.countNonZero(disc)))
+    best = int(np.argmax(fractions))
+    marked = sum(f >= min_fraction for f in fractions)
+    opt = bubbles[best][0] if fractions[best] >= min_fraction else ''
+    if debug >= 1:
+        print(f"[DEBUG] Second pass: {opt or '-'} (inked {', '.join(f'{f:.2f}' for f in fractions)})")
+    return opt, fractions, marked
+
+def load_answers(answers_csv=None, answers_json=None):
+    """Load an answer key from JSON ({'1':'A','2':'A,D'}) or CSV (Pregunta,Respuesta)."""
+    if answers_json:
+        with open(answers_json) as f:
+            correct_answers = json.load(f)
+        return {int(k): v for k, v in correct_answers.items()}
+    if answers_csv:
+        correct_answers = {}
+        with open(answers_csv, newline='') as f:
+            reader = csvmod.DictReader(f)
+            for row in reader:
+                q = int(row['Pregunta'])
+                correct_answers[q] = row['Respuesta'].strip().upper()
+        return correct_answers
+    return None
+
+def load_roster(roster_csv):
+    """Map sheet_id -> {'name', 'id'} from a CSV with sheet_id,name,id columns."""
+    with open(roster_csv, newline='') as f:
+        return {row['sheet_id']: row for row in csvmod.DictReader(f)}
+
+def load_script(name):
+    """Import one of the helper modules in script/ (not a package) by file path."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'script', f'{name}.py')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@dataclass
+class SheetResult:
+    """Everything read from one sheet. `row`, `grades_row` and `info_row` give the CSV rows."""
+    file: str
+    answers: dict                 # question -> option ('' when blank)
+    confidence: dict              # question -> 0-1 confidence
+    flags: dict = field(default_factory=dict)   # question -> 'multi' or 'low', for human review
+    fills: dict = field(default_factory=dict, repr=False)  # question -> fast-pass fill per option
+    rechecked: dict = field(default_factory=dict, repr=False)  # question -> second-pass ink fraction per option
+    phash: int = None             # sheet_hash of the sheet
+    duplicate_of: tuple = None    # (earlier file, hash distance) when it looks like a rescan
+    tema: str = None
+    marks: dict = None            # question -> '+', '-' or 'nr' when an answer key applies
+    grade: float = None
+    student: dict = None          # info.csv row when identity was resolved
+    qr: dict = None
+    crops: dict = field(default_factory=dict, repr=False)
+    detections: np.ndarray = field(default=None, repr=False)
+
+    @property
+    def row(self):
+        row = {"file": self.file}
+        row.update({f"Q{q}": self.answers[q] for q in sorted(self.answers)})
+        if self.tema is not None:
+            row['tema'] = self.tema
+        return row
+
+    @property
+    def grades_row(self):
+        if self.marks is None:
+            return None
+        row = {"file": self.file}
+        if self.tema is not None:
+            row['tema'] = self.tema
+        row.update({f"Q{q}": m for q, m in self.marks.items()})
+        row['grade'] = self.grade
+        return row
+
+    @property
+    def info_row(self):
+        return self.student
+
+    @property
+    def sheet_id(self):
+        return self.qr['sheet_id'] if self.qr else None
+
+    @property
+    def review_rows(self):
+        return [{"file": self.file, "question": q, "answer": self.answers[q],
+                 "confidence": self.confidence[q], "flag": flag,
+                 "fills": ";".join(f"{round(f, 3):g}" if isinstance(f, float) else str(f)
+                                   for f in self.rechecked.get(q, self.fills.get(q, [])))}
+                for q, flag in sorted(self.flags.items())]
+
+class OMRReader:
+    """Grades OMR sheets for one layout; build once, then call read()/read_many().
+
+    All configuration (layout, answer keys, scoring, theme templates, roster,
+    OCR model) is loaded in the constructor and never mutated afterwards, so a
+    single instance can be shared between threads.
+    """
+
+    def __init__(self, config='grid_config.json', min_fill=200, debug=0,
+                 answers_csv=None, answers_json=None, scoring_json=None,
+                 themes_json=None, theme_mapping=None, read_qr=False, roster_csv=None,
+                 hand_writing=False, device='cpu', recheck_below=0.25, second_pass=True,
+                 fill_mode='fixed', preflight=True, debug_dir=None):
+        self.layout = config if isinstance(config, Layout) else load_layout(config)
+        if fill_mode not in FILL_MODES:
+            raise ValueError(f"Unknown fill mode {fill_mode!r}; expected one of {', '.join(FILL_MODES)}")
+        self.min_fill = min_fill
+        self.fill_mode = fill_mode
+        self.preflight = preflight
+        self.debug = debug
+        # where debug output about a failed sheet goes (see find_markers)
+        self.debug_dir = debug_dir
+        self.correct_answers = load_answers(answers_csv, answers_json)
+        self.scoring = {"correct": 1, "incorrect": 0, "unanswered": 0}
+        if scoring_json:
+            with open(scoring_json) as f:
+                self.scoring.update(json.load(f))
+        self.roster = load_roster(roster_csv) if roster_csv else {}
+        self.read_qr = read_qr or bool(roster_csv)
+        self.device = device
+        self.recheck_below = recheck_below
+        self.second_pass = second_pass
+
+        # Mixed-theme folders: one header template and answer key per theme
+        self.theme_templates = None
+        self.theme_answers = {}
+        if themes_json:
+            with open(themes_json) as f:
+                themes = json.load(f)
+            self.theme_templates = self._load_theme_templates(
+                {t: spec for t, spec in themes.items() if 'sample' in spec})
+            self.theme_answers = {t: load_answers(spec.get('answers_csv'), spec.get('answers_json'))
+                                  for t, spec in themes.items()}
+        self.mapping = None
+        if theme_mapping:
+            with open(theme_mapping) as f:
+                self.mapping = json.load(f)
+            # results are translated one sheet at a time; load the script and invert the options once
+            self._transform = load_script('transform_results')
+            self._inverted_opts = self._transform.build_inverted_options(self.mapping)
+
+        self.handwriting_ocr = None
+        self._ocr_lock = threading.Lock()
+        if hand_writing:
+            self.handwriting_ocr = importlib.import_module('handwriting_ocr')
+            self.handwriting_ocr.load_model(device)
+
+    def warp(self, img, tracker=None, markers=None):
+        """Return (warped sheet, homography) for a decoded scan."""
+        _, M = sheet_homography(img, self.layout.warp_w, self.layout.warp_h, tracker, self.debug, markers,
+                                self.debug_dir)
+        return cv2.warpPerspective(img, M, (self.layout.warp_w, self.layout.warp_h)), M
+
+    def _load_theme_templates(self, themes):
+        """Warp each theme's sample scan and keep its header crop as matching template.
+
+        The template is trimmed on every side so it can slide inside the header
+        region of other sheets and absorb small registration differences.
+        """
+        templates = {}
+        for tema, spec in themes.items():
+            img = cv2.imread(spec['sample'])
+            if img is None:
+                raise RuntimeError(f"Could not read sample scan for theme {tema}: {spec['sample']}")
+            warped, _ = self.warp(img)
+            band = cv2.cvtColor(crop_rect(warped, self.layout.theme_rect), cv2.COLOR_BGR2GRAY)
+            mh, mw = band.shape[0] // 6, band.shape[1] // 12
+            templates[tema] = band[mh:band.shape[0]-mh, mw:band.shape[1]-mw]
+        return templates
+
+    def result_columns(self):
+        """Fixed results.csv / grades.csv columns for the loaded layout."""
+        qs = [f"Q{q}" for q in self.layout.questions]
+        tema = ['tema'] if self.theme_answers or self.read_qr else []
+        return ['file'] + qs + tema, ['file'] + qs + ['grade'] + tema
+
+    def transformed_columns(self):
+        n_questions = max(self.layout.questions)
+        return ['file'] + [f'Q{i}' for i in range(1, n_questions + 1)] + ['tema']
+
+    def to_theme_a(self, rows):
+        """Translate result rows of any theme to Tema A coding (see script/transform_results.py)."""
+        n_questions = max(self.layout.questions)
+        return [self._transform.transform_row(row, self.mapping, self._inverted_opts, n_questions)
+                for row in rows]
+
+    def _unsure(self, fills, confidence, min_fill):
+        """True if the fast pass may have got a question wrong or missed a second mark."""
+        top = sorted(fills, reverse=True) + [0]
+        return confidence < self.recheck_below or top[1] >= max(min_fill, MULTI_MARK_RATIO * top[0])
+
+    def thresholds(self, measured):
+        """{question: fill threshold} for one sheet's measure_bubbles output."""
+        layout = self.layout
+        fills = [[f for f, _, _, _ in measured[q]] for q in layout.questions]
+        values = fill_thresholds(fills, layout.question_columns, layout.bubble_areas, self.min_fill, self.fill_mode)
+        if self.debug >= 1 and self.fill_mode != 'fixed':
+            shares = sorted({round(t / a, 3) for t, a in zip(values, layout.bubble_areas)})
+            print(f"[DEBUG] Fill thresholds ({self.fill_mode}): {', '.join(f'{t:g}' for t in shares)} of bubble area")
+        return dict(zip(layout.questions, values.tolist()))
+
+    def read(self, image, name=None, tracker=None, markers=None, duplicates=None):
+        """Warp, identify, detect and grade one sheet.
+
+        `image` is a file path or a decoded BGR array. Pass a MarkerTracker to
+        reuse the previous sheet's marker positions for consecutive scans, or
+        `markers` (TL, TR, BR, BL centroids) if they were already located.
+        Raises SheetRejected when the page fails the pre-flight checks. With a
+        DuplicateIndex in `duplicates`, a rescan of an earlier sheet is linked
+        to it, or raises SheetDuplicate before OCR if the index skips them.
+        """
+        if isinstance(image, str):
+            name = name or os.path.basename(image)
+            img = cv2.imread(image)
+            if img is None:
+                raise RuntimeError(f"Could not read image {image}")
+        else:
+            img = image
+        name = name or "sheet"
+        if self.preflight and markers is None:
+            reason, checks = preflight(img)
+            if reason:
+                raise SheetRejected(reason, checks)
+        layout = self.layout
+        WARP_W, WARP_H = layout.warp_w, layout.warp_h
+        warped, M = self.warp(img, tracker, markers)
+        measured = measure_bubbles(warped, layout, self.debug)
+        min_fill = self.thresholds(measured)
+
+        results = detect_answers(warped, layout, min_fill, self.debug, measured=measured)
+        answers = {q: (opt or '') for q, (opt, pos, col, fills) in results.items()}
+        confidence = {q: question_confidence(fills, opt, min_fill[q])
+                      for q, (opt, pos, col, fills) in results.items()}
+        fills_by_q = {q: fills for q, (opt, pos, col, fills) in results.items()}
+
+        # The fast pass decides most questions; only close calls are re-read
+        # from the scan at native resolution, and what stays unsure is flagged
+        flags = {}
+        rechecked = {}
+        scale = None
+        for q in [q for q in results if self.recheck_below and self._unsure(fills_by_q[q], confidence[q], min_fill[q])]:
+            # the fast pass's count, unless the second pass re-reads the question
+            marked = sum(f >= min_fill[q] for f in fills_by_q[q])
+            threshold = min_fill[q]
+            if self.second_pass:
+                if scale is None:
+                    scale = native_scale(M, layout)
+                bubbles = [(opt, (int(nx * WARP_W), int(ny * WARP_H)), layout.bubble_radius(col, 20))
+                           for qq, opt, (nx, ny), col in layout.bubble_positions if qq == q]
+                opt, fractions, marked = recheck_question(img, M, layout, bubbles, scale, debug=self.debug)
+                threshold = RECHECK_FILL
+                _, pos, col, _ = results[q]
+                pos = next((p for o, p, _ in bubbles if o == opt), pos)
+                results[q] = (opt, pos, col, fractions)
+                answers[q] = opt
+                confidence[q] = question_confidence(fractions, opt, RECHECK_FILL)
+                rechecked[q] = fractions
+            if marked > 1:
+                flags[q] = 'multi'
+            elif confidence[q] < self.recheck_below and (answers[q] or not clearly_blank(results[q][3], threshold)):
+                flags[q] = 'low'
+
+        # The sheet QR, when printed, resolves identity and theme without OCR
+        qr = decode_sheet_qr(warped, layout.qr_rect, self.debug) if self.read_qr else None
+        # A rescan has the same answers; it is recognised before any OCR runs
+        phash = sheet_hash(warped, layout, answers)
+        duplicate_of = None
+        if duplicates is not None:
+            duplicate_of = duplicates.check(name, phash, layout, qr['sheet_id'] if qr else None)
+        if duplicate_of and duplicates.skip:
+            raise SheetDuplicate(*duplicate_of)
+
+        tema = None
+        if qr:
+            tema = qr['tema']
+        elif self.theme_templates:
+            tema, _ = detect_theme(warped, self.theme_templates, layout.theme_rect, self.debug)
+        sheet_answers = self.theme_answers.get(tema) or self.correct_answers
+
+        crops = {}
+        for label, rect in zip(["name", "id"], [layout.name_rect, layout.id_rect]):
+            if rect:
+                x, y, w, h = rect
+                Minv = np.linalg.inv(M)
+                x1w = int(x * WARP_W)
+                y1w = int(y * WARP_H)
+                x2w = int((x + w) * WARP_W)
+                y2w = int((y + h) * WARP_H)
+                warped_corners = np.array([
+                    [x1w, y1w],
+                    [x2w, y1w],
+                    [x2w, y2w],
+                    [x1w, y2w]
+                ], dtype="float32").reshape(-1,1,2)
+                orig_corners = cv2.perspectiveTransform(warped_corners, Minv).reshape(4,2)
+                x_min, y_min = orig_corners.min(axis=0).astype(int)
+                x_max, y_max = orig_corners.max(axis=0).astype(int)
+                x_min = max(0, x_min); y_min = max(0, y_min)
+                x_max = min(img.shape[1], x_max); y_max = min(img.shape[0], y_max)
+                crops[label] = img[y_min:y_max, x_min:x_max]
+
+        student = None
+        known = self.roster.get(qr['sheet_id']) if qr else None
+        if known:
+            student = {"image": name, "name": known.get('name', ''),
+                       "id": known.get('id', ''), "sheet_id": qr['sheet_id'], "source": "qr"}
+        elif self.handwriting_ocr and 'name' in crops and 'id' in crops:
+            with self._ocr_lock:
+                name_text, id_text = self.handwriting_ocr.recognize_name_id(crops['name'], crops['id'], device=self.device)
+            # a DNI/NIE whose check letter does not match was misread somewhere
+            bad_id = self.handwriting_ocr.check_id(id_text)[1] == 'invalid'
+            student = {"image": name, "name": name_text, "id": id_text,
+                       "sheet_id": qr['sheet_id'] if qr else "", "source": "ocr-check-failed" if bad_id else "ocr"}
+        elif qr:
+            student = {"image": name, "name": "", "id": "",
+                       "sheet_id": qr['sheet_id'], "source": "qr"}
+
+        debug = warped.copy()
+        marks = {}
+        total_score = 0
+        for q, (opt, pos, col, fills) in results.items():
+            x, y = pos
+            radius = layout.bubble_radius(col, 30)
+            grade_mark = '-'
+            if sheet_answers and q in sheet_answers:
+                correct = sheet_answers[q]
+                correct_opts = [c.strip().upper() for c in correct.replace(';', ',').split(',')]
+                if not opt:
+                    color = (128, 128, 128)
+                    score = self.scoring.get('unanswered', 0)
+                    grade_mark = 'nr'
+                elif opt in correct_opts:
+                    color = (0, 200, 0)
+                    grade_mark = '+'
+                    score = self.scoring.get('correct', 1)
+                else:
+                    color = (0, 0, 255)
+                    grade_mark = '-'
+                    score = self.scoring.get('incorrect', 0)
+                total_score += score
+                if opt:
+                    overlay = debug.copy()
+                    cv2.circle(overlay, (x, y), radius, color, -1)
+                    cv2.addWeighted(overlay, 0.25, debug, 0.75, 0, debug)
+                    cv2.circle(debug, (x, y), radius, color, 2)
+            else:
+                if opt:
+                    overlay = debug.copy()
+                    cv2.circle(overlay, (x, y), radius, (0, 0, 255), -1)
+                    cv2.addWeighted(overlay, 0.25, debug, 0.75, 0, debug)
+                    cv2.circle(debug, (x, y), radius, (0, 0, 255), 2)
+            marks[q] = grade_mark
+
+        return SheetResult(
+            file=name, answers=answers, confidence=confidence, flags=flags, fills=fills_by_q,
+            rechecked=rechecked, phash=phash, duplicate_of=duplicate_of, tema=tema,
+            marks=marks if sheet_answers else None,
+            grade=total_score if sheet_answers else None,
+            student=student, qr=qr, crops=crops, detections=debug)
+
+    def read_many(self, images, reuse_markers=True):
+        """Read a sequence of sheets in order, yielding one SheetResult each.
+
+        Items are file paths or (name, BGR array) pairs. Consecutive sheets
+        share a MarkerTracker unless `reuse_markers` is False.
+        """
+        tracker = MarkerTracker() if reuse_markers else None
+        for item in images:
+            if isinstance(item, str):
+                yield self.read(item, tracker=tracker)
+            else:
+                name, img = item
+                yield self.read(img, name, tracker=tracker)
+
+@dataclass(frozen=True)
+class ArtifactFormat:
+    """How detection images are encoded: png, jpg or webp, an optional
+    quality (PNG compression level 0-9, JPEG/WebP quality 0-100) and a
+    downscale factor for lighter previews. Name/id crops stay PNG, since
+    generate_students_info_pdf.py reads them, and are never downscaled."""
+    ext: str = 'png'
+    quality: int = None
+    preview_scale: float = 1.0
+
+    def params(self, ext):
+        if self.quality is None:
+            return []
+        flag = {'png': cv2.IMWRITE_PNG_COMPRESSION, 'jpg': cv2.IMWRITE_JPEG_QUALITY,
+                'webp': cv2.IMWRITE_WEBP_QUALITY}[ext]
+        return [flag, int(self.quality)]
+
+def save_artifacts(sheet, detections_dir, students_info_dir, fmt=None):
+    """Write the name/id crops and the detections image of one sheet."""
+    fmt = fmt or ArtifactFormat()
+    base = os.path.splitext(sheet.file)[0]
+    if sheet.crops:
+        student_dir = os.path.join(students_info_dir, base)
+        os.makedirs(student_dir, exist_ok=True)
+        png = fmt.params('png') if fmt.ext == 'png' else []
+        for label, crop in sheet.crops.items():
+            cv2.imwrite(os.path.join(student_dir, f"{label}.png"), crop, png)
+    if sheet.detections is not None:
+        detections = sheet.detections
+        if fmt.preview_scale != 1.0:
+            detections = cv2.resize(detections, None, fx=fmt.preview_scale, fy=fmt.preview_scale,
+                                    interpolation=cv2.INTER_AREA)
+        cv2.imwrite(os.path.join(detections_dir, f"{base}_detections.{fmt.ext}"), detections,
+                    fmt.params(fmt.ext))
+
+class ArtifactWriter:
+    """Saves sheet artifacts on a small background thread pool.
+
+    submit() returns immediately while fewer than `queue_size` sheets are
+    waiting to be written, and blocks once the queue is full, so a slow disk
+    slows grading down instead of piling decoded images up in memory. Failed
+    writes are reported as warnings: artifacts are never worth losing a run.
+    """
+
+    def __init__(self, detections_dir, students_info_dir, fmt=None, workers=2, queue_size=None):
+        self.dirs = (detections_dir, students_info_dir)
+        self.fmt = fmt or ArtifactFormat()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(queue_size or 2 * workers + 2)
+        self.failed = 0
+
+    def _save(self, sheet):
+        try:
+            save_artifacts(sheet, *self.dirs, self.fmt)
+        except Exception as e:
+            self.failed += 1
+            print(f"[WARN] Could not save images of {sheet.file}: {e}")
+        finally:
+            self._slots.release()
+
+    def submit(self, sheet):
+        self._slots.acquire()
+        self.pool.submit(self._save, sheet)
+
+    def close(self):
+        """Wait for every pending write."""
+        self.pool.shutdown(wait=True)
+
+def _output_dirs(output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    detections_dir = os.path.join(output_dir, "detections")
+    os.makedirs(detections_dir, exist_ok=True)
+    students_info_dir = os.path.join(output_dir, "students-info")
+    os.makedirs(students_info_dir, exist_ok=True)
+    return detections_dir, students_info_dir
+
+def shard_of(name, shards):
+    """Stable shard index of a sheet file name (SHA-1 based, identical on every machine)."""
+    digest = hashlib.sha1(os.path.basename(name).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shards
+
+def list_sheets(folder, shard=None):
+    """Sorted .png sheets of `folder`; with shard=(i, n), only those of shard i of n."""
+    files = sorted(glob.glob(os.path.join(folder, "*.png")))
+    if shard is not None:
+        i, n = shard
+        files = [f for f in files if shard_of(f, n) == i]
+    return files
+
+def _read_or_reject(read, fname, **kwargs):
+    try:
+        return read(fname, **kwargs)
+    except SheetRejected as e:
+        return e
+    except Exception as e:
+        return SheetFailed(os.path.basename(fname), [('read', _describe(e))])
+
+def decode_full(path, min_width=0):
+    """Decode a scan for the retry ladder at its full depth and at least `min_width` pixels wide.
+
+    Transparency is flattened onto white paper instead of being dropped,
+    16-bit samples are cut to 8 bits and a scan narrower than `min_width`
+    (e.g. a fax-quality or downsampled batch) is upscaled to it.
+    """
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise RuntimeError(f"Could not read image {path}")
+    if img.dtype == np.uint16:
+        img = (img >> 8).astype(np.uint8)
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    elif img.shape[2] == 4:
+        alpha = img[..., 3:].astype(np.float32) / 255
+        img = (img[..., :3] * alpha + 255 * (1 - alpha)).astype(np.uint8)
+    if img.shape[1] < min_width:
+        scale = min_width / img.shape[1]
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+    return img
+
+def retry_sheet(read, path, failed, min_width=0, debug=0):
+    """Read a sheet whose first read raised again, one rung of RETRY_LADDER at a time.
+
+    'blur' and 'threshold' search the markers after a stronger blur and with
+    a local threshold (specks, shadows), 'full-resolution' decodes the file
+    again with decode_full and 'flip' mirrors the scan back (see
+    orient_markers). `read(img, name, markers=...)` grades the sheet.
+    Returns (rung, result) for the first rung that gets a result or a
+    SheetRejected, else (None, SheetFailed) with every attempt's error.
+    """
+    name = os.path.basename(path)
+    attempts = list(failed.attempts)
+    for rung in RETRY_LADDER:
+        try:
+            img = decode_full(path, min_width) if rung == 'full-resolution' else cv2.imread(path)
+            if img is None:
+                raise RuntimeError(f"Could not read image {path}")
+            if rung == 'flip':
+                img = cv2.flip(img, 1)
+            markers = find_markers(img, debug, **MARKER_RETRIES.get(rung, {}))
+            return rung, read(img, name, markers=markers)
+        except SheetRejected as e:
+            return rung, e
+        except Exception as e:
+            attempts.append((rung, _describe(e)))
+    return None, SheetFailed(name, attempts)
+
+def read_sheets(read, files, jobs=1, reuse_markers=True):
+    """Yield (file, result) for each file in order, calling read(file, tracker=...).
+
+    A page that fails the pre-flight checks yields its SheetRejected as
+    result instead of stopping the run. With jobs > 1 sheets are read on a
+    thread pool (OpenCV releases the GIL), keeping at most a few sheets per
+    worker in flight; the marker tracker is only used for sequential reads,
+    where consecutive sheets follow each other.
+    """
+    if jobs <= 1:
+        tracker = MarkerTracker() if reuse_markers else None
+        for fname in files:
+            yield fname, _read_or_reject(read, fname, tracker=tracker)
+        return
+    window = deque()
+    pending = iter(files)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for fname in pending:
+            window.append((fname, pool.submit(_read_or_reject, read, fname)))
+            if len(window) >= jobs * 2:
+                break
+        while window:
+            fname, future = window.popleft()
+            nxt = next(pending, None)
+            if nxt is not None:
+                window.append((nxt, pool.submit(_read_or_reject, read, nxt)))
+            yield fname, future.result()
+
+def _drop_torn_tail(path):
+    """Cut a CSV back to its last complete line (a crash can leave half a row)."""
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            f.truncate(end)
+
+class ResultWriter:
+    """Streams one run's CSVs to disk as sheets are graded.
+
+    Every table has a fixed column schema from the layout and is written to
+    `<name>.partial`, appended and flushed after each sheet, so memory stays
+    flat and a crash loses at most the sheet in progress. close() moves the
+    partials into place atomically; until then the previous outputs (if any)
+    are left untouched. With `resume`, the partials of an interrupted run are
+    kept and `done` holds the sheets they already cover.
+    """
+
+    def __init__(self, reader, output_dir, out_csv="results.csv", resume=False):
+        results_cols, grades_cols = reader.result_columns()
+        students_info_dir = os.path.join(output_dir, "students-info")
+        self.reader = reader
+        # results goes last: a sheet listed there has all its other rows written
+        self.tables = {
+            'grades': (os.path.join(output_dir, 'grades.csv'), grades_cols, 'file'),
+            'review': (os.path.join(output_dir, 'review.csv'), REVIEW_COLUMNS, 'file'),
+            'info': (os.path.join(students_info_dir, 'info.csv'), INFO_COLUMNS, 'image'),
+            'results': (os.path.join(output_dir, os.path.basename(out_csv)), results_cols, 'file'),
+        }
+        if reader.mapping:
+            self.tables['transformed'] = (os.path.join(output_dir, 'results_transformed_to_A.csv'),
+                                          reader.transformed_columns(), 'file')
+        self.tables['fills'] = (os.path.join(output_dir, 'fills_index.csv'), ['file', 'tema', 'phash'], 'file')
+        self.tables['rejects'] = (os.path.join(output_dir, 'rejects.csv'), REJECT_COLUMNS, 'file')
+        self.tables['duplicates'] = (os.path.join(output_dir, 'duplicates.csv'), DUPLICATE_COLUMNS, 'file')
+        self.fill_store = FillStore(reader.layout, output_dir)
+        self.counts = {key: 0 for key in self.tables}
+        self._files = {}
+        self._writers = {}
+        self.done = set()
+        self.hashes = {}   # file -> sheet_hash of the sheets already written
+        self.sheet_ids = {}   # file -> QR sheet ID, where one was read
+        partials = {key: path + '.partial' for key, (path, _, _) in self.tables.items()}
+        if resume and os.path.exists(partials['results']):
+            self._recover(partials)
+        else:
+            for path in partials.values():
+                if os.path.exists(path):
+                    os.remove(path)
+        self.fill_store.open(self.counts['fills'])
+
+    def _recover(self, partials):
+        _drop_torn_tail(partials['results'])
+        with open(partials['results'], newline='') as f:
+            self.done = {r['file'] for r in csvmod.DictReader(f)}
+        for key, path in partials.items():
+            if not os.path.exists(path):
+                continue
+            _drop_torn_tail(path)
+            _, cols, file_key = self.tables[key]
+            with open(path, newline='') as f:
+                rows = [r for r in csvmod.DictReader(f) if r[file_key] in self.done]
+            # rows of a sheet that never reached results.csv are graded again
+            with open(path, 'w', newline='') as f:
+                writer = csvmod.DictWriter(f, fieldnames=cols, lineterminator='\n')
+                writer.writeheader()
+                writer.writerows(rows)
+            self.counts[key] = len(rows)
+            self._open(key)
+            if key == 'info':
+                self.sheet_ids = {r['image']: r['sheet_id'] for r in rows if r.get('sheet_id')}
+            if key == 'fills':
+                self.hashes = {r['file']: int(r['phash'], 16) for r in rows if r.get('phash')}
+        print(f"Resuming: {len(self.done)} sheets already graded")
+
+    def _open(self, key):
+        path, cols, _ = self.tables[key]
+        partial = path + '.partial'
+        new = not os.path.exists(partial) or os.path.getsize(partial) == 0
+        f = open(partial, 'a', newline='')
+        self._files[key] = f
+        self._writers[key] = csvmod.DictWriter(f, fieldnames=cols, restval='', extrasaction='ignore',
+                                                lineterminator='\n')
+        if new:
+            self._writers[key].writeheader()
+
+    def _write(self, key, rows):
+        if key not in self._writers:
+            self._open(key)
+        self._writers[key].writerows(rows)
+        self.counts[key] += len(rows)
+
+    def write(self, sheet):
+        """Append one graded sheet to every table and flush it to disk."""
+        if sheet.grades_row:
+            grades_row = dict(sheet.grades_row)
+            for q in self.reader.layout.questions:
+                grades_row.setdefault(f"Q{q}", '-')
+            self._write('grades', [grades_row])
+        if sheet.review_rows:
+            self._write('review', sheet.review_rows)
+        if sheet.info_row:
+            self._write('info', [sheet.info_row])
+        # Translate every theme to Tema A coding in the same pass
+        if 'transformed' in self.tables and sheet.tema is not None:
+            self._write('transformed', self.reader.to_theme_a([sheet.row]))
+        # the tensor block goes before its index row, which goes before results
+        if sheet.duplicate_of:
+            original, distance = sheet.duplicate_of
+            self._write('duplicates', [{"file": sheet.file, "duplicate_of": original,
+                                        "distance": distance, "action": "graded"}])
+        self.fill_store.write(sheet)
+        phash = format(sheet.phash, 'x') if sheet.phash is not None else ''
+        self._write('fills', [{"file": sheet.file, "tema": sheet.tema or '', "phash": phash}])
+        self._write('results', [sheet.row])
+        for f in self._files.values():
+            f.flush()
+        self.done.add(sheet.file)
+        if sheet.phash is not None:
+            self.hashes[sheet.file] = sheet.phash
+        if sheet.sheet_id:
+            self.sheet_ids[sheet.file] = sheet.sheet_id
+
+    def reject(self, file, rejected):
+        """List a page that failed the pre-flight checks in rejects.csv (skipped duplicates in duplicates.csv)."""
+        key = 'duplicates' if isinstance(rejected, SheetDuplicate) else 'rejects'
+        self._write(key, [rejected.row(file)])
+        self._files[key].flush()
+
+    def duplicate_index(self, mode='link'):
+        """DuplicateIndex for this run ('link', 'skip' or 'off' for None), holding the sheets already written."""
+        if mode == 'off':
+            return None
+        index = DuplicateIndex(skip=mode == 'skip')
+        for file, phash in self.hashes.items():
+            index.check(file, phash, self.reader.layout, self.sheet_ids.get(file))
+        return index
+
+    def close(self):
+        """Finish the run: sync the partials and atomically replace the final CSVs."""
+        for key in ('results', 'fills'):
+            if key not in self._writers:
+                self._open(key)
+        labels = {'results': "results", 'transformed': "Tema A results", 'grades': "grades",
+                  'review': "flagged questions", 'info': "student info", 'rejects': "rejected pages",
+                  'duplicates': "duplicate sheets"}
+        self.fill_store.close(self.reader.min_fill, self.counts['fills'], self.reader.fill_mode)
+        for key, f in self._files.items():
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            path = self.tables[key][0]
+            os.replace(path + '.partial', path)
+            if key in labels:
+                print(f"Saved {labels[key]} to {path} ({self.counts[key]} rows)")
+        self._files = {}
+        self._writers = {}
+
+class Quarantine:
+    """Sheets that raised while being read, kept apart so the rest of the run goes on.
+
+    A failed sheet is copied to <output>/quarantine/ next to a JSON record of
+    its error before the retry ladder runs (see retry_sheet), so a crash mid
+    retry still leaves it there. A sheet the ladder reads is taken back out.
+    close() writes failures.json with the sheets that remain and the ones
+    each rung recovered (none when there are neither), and drops entries
+    left by earlier runs.
+    """
+
+    def __init__(self, output_dir):
+        self.dir = os.path.join(output_dir, 'quarantine')
+        self.path = os.path.join(output_dir, 'failures.json')
+        self.failed = []
+        self.recovered = []
+
+    def _record_path(self, name):
+        return os.path.join(self.dir, name + '.json')
+
+    def add(self, path, failed):
+        """Copy a failed sheet into the quarantine with its error record."""
+        os.makedirs(self.dir, exist_ok=True)
+        name = os.path.basename(path)
+        if os.path.exists(path):
+            shutil.copy2(path, os.path.join(self.dir, name))
+        with open(self._record_path(name), 'w') as f:
+            json.dump(dict(failed.record(), quarantined=os.path.join('quarantine', name)), f, indent=2)
+
+    def resolve(self, path, failed, rung, result):
+        """Record how the retry ladder (rung, result) ended for a sheet quarantined as `failed`; returns `result`."""
+        name = os.path.basename(path)
+        if rung is None:
+            record = dict(result.record(), quarantined=os.path.join('quarantine', name))
+            with open(self._record_path(name), 'w') as f:
+                json.dump(record, f, indent=2)
+            self.failed.append(record)
+            print(f"[WARN] Could not read {name}, quarantined: {result}")
+            return result
+        for leftover in (os.path.join(self.dir, name), self._record_path(name)):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        self.recovered.append({"file": name, "error": str(failed), "rung": rung})
+        print(f"[WARN] {name} failed to read and was recovered by the '{rung}' retry")
+        return result
+
+    def retry(self, read, path, failed, min_width=0, debug=0):
+        """Quarantine a failed sheet and run the retry ladder on it; returns what the ladder read, or the SheetFailed."""
+        self.add(path, failed)
+        return self.resolve(path, failed, *retry_sheet(read, path, failed, min_width, debug))
+
+    def close(self):
+        """Write failures.json and remove quarantine entries whose sheets were read this time."""
+        keep = {r['file'] for r in self.failed}
+        for record in glob.glob(os.path.join(glob.escape(self.dir), '*.json')):
+            name = os.path.basename(record)[:-len('.json')]
+            if name not in keep:
+                os.remove(record)
+                if os.path.exists(os.path.join(self.dir, name)):
+                    os.remove(os.path.join(self.dir, name))
+        if not (self.failed or self.recovered):
+            # a clean run leaves no failures.json, not even an earlier run's
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        tmp = self.path + '.partial'
+        with open(tmp, 'w') as f:
+            json.dump({"failed": sorted(self.failed, key=lambda r: r['file']),
+                       "recovered": sorted(self.recovered, key=lambda r: r['file'])}, f, indent=2)
+        os.replace(tmp, self.path)
+        print(f"Saved failures to {self.path} ({len(self.failed)} quarantined, {len(self.recovered)} recovered)")
+
+class FillStore:
+    """Appends every graded sheet's raw bubble fills to a uint16 tensor on disk.
+
+    fills.u16 holds one (2, questions, options) block per sheet: plane 0 is
+    the fast-pass fill of each bubble, plane 1 the second-pass ink fraction
+    (x RECHECK_SCALE) of re-read questions and FILL_MISSING elsewhere.
+    Row order is given by fills_index.csv, which ResultWriter streams like
+    its other tables, and fills.json describes the shape. omr_regrade.py
+    memory-maps the tensor to regrade with another threshold or key
+    without touching the images.
+    """
+
+    def __init__(self, layout, output_dir):
+        self.questions = list(layout.questions)
+        self.options = list(layout.options)
+        self.columns = layout.question_columns.tolist()
+        self.areas = layout.bubble_areas.tolist()
+        self.path = os.path.join(output_dir, 'fills.u16')
+        self.meta_path = os.path.join(output_dir, 'fills.json')
+        self.block = 2 * len(self.questions) * len(self.options) * 2
+        self._f = None
+
+    def open(self, rows=0):
+        """Start the partial tensor, keeping its first `rows` blocks (0 for a fresh run)."""
+        partial = self.path + '.partial'
+        mode = 'r+b' if rows and os.path.exists(partial) else 'wb'
+        self._f = open(partial, mode)
+        # drop blocks of sheets that never reached the index
+        self._f.truncate(rows * self.block)
+        self._f.seek(rows * self.block)
+
+    def encode(self, sheet):
+        block = np.full((2, len(self.questions), len(self.options)), FILL_MISSING, dtype=np.uint16)
+        for i, q in enumerate(self.questions):
+            block[0, i] = np.clip(sheet.fills.get(q, [0] * len(self.options)), 0, FILL_MISSING - 1)
+            if q in sheet.rechecked:
+                block[1, i] = np.round(np.asarray(sheet.rechecked[q]) * RECHECK_SCALE)
+        return block
+
+    def write(self, sheet):
+        self._f.write(self.encode(sheet).tobytes())
+        self._f.flush()
+
+    def close(self, min_fill, rows, fill_mode='fixed'):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+        os.replace(self.path + '.partial', self.path)
+        meta = {"version": 1, "dtype": "uint16", "shape": [rows, 2, len(self.questions), len(self.options)],
+                "questions": self.questions, "options": self.options,
+                "planes": ["fill", "recheck"], "recheck_scale": RECHECK_SCALE, "missing": FILL_MISSING,
+                "min_fill": min_fill, "fill_mode": fill_mode, "columns": self.columns, "areas": self.areas,
+                "recheck_fill": RECHECK_FILL, "index": "fills_index.csv"}
+        with open(self.meta_path, 'w') as f:
+            json.dump(meta, f, indent=2)
+
+def load_fills(run_dir):
+    """Return (meta, index rows, read-only memmap of shape meta['shape']) of a run's fill tensor."""
+    with open(os.path.join(run_dir, 'fills.json')) as f:
+        meta = json.load(f)
+    with open(os.path.join(run_dir, meta['index']), newline='') as f:
+        index = list(csvmod.DictReader(f))
+    shape = tuple(meta['shape'])
+    if shape[0] == 0:
+        return meta, index, np.zeros(shape, dtype=np.uint16)
+    return meta, index, np.memmap(os.path.join(run_dir, 'fills.u16'), dtype=np.uint16, mode='r', shape=shape)
+
+def write_info_pdf(output_dir):
+    """Lay out the saved name/id crops in image-to-names.pdf for manual matching."""
+    try:
+        from generate_students_info_pdf import generate_pdf
+        output_pdf = os.path.join(output_dir, "image-to-names.pdf")
+        generate_pdf(os.path.join(output_dir, "students-info"), output_pdf)
+    except Exception as e:
+        print(f"[WARN] Could not generate PDF: {e}")
+
+def process_folder(reader, folder, out_csv="results.csv", output_dir="output",
+                   get_info=False, reuse_markers=True, jobs=1, shard=None, resume=False,
+                   artifact_format=None, artifact_workers=2, duplicates='link'):
+    """Grade every .png sheet in `folder` (or one shard of them) and write results, grades and info CSVs.
+
+    Rows are streamed to disk as each sheet is graded (see ResultWriter) and
+    images are encoded in the background (see ArtifactWriter); with `resume`,
+    sheets already covered by an interrupted run's partial outputs are skipped.
+    Rescans of an earlier sheet are listed in duplicates.csv and, with
+    duplicates='skip', not graded again ('off' disables the check). A sheet
+    that raises is quarantined and retried (see Quarantine) instead of
+    stopping the run.
+    """
+    artifacts = ArtifactWriter(*_output_dirs(output_dir), artifact_format, artifact_workers)
+    writer = ResultWriter(reader, output_dir, out_csv, resume)
+    quarantine = Quarantine(output_dir)
+    files = [f for f in list_sheets(folder, shard) if os.path.basename(f) not in writer.done]
+    read = partial(reader.read, duplicates=writer.duplicate_index(duplicates))
+
+    for fname, sheet in read_sheets(read, files, jobs, reuse_markers):
+        if isinstance(sheet, SheetFailed):
+            sheet = quarantine.retry(read, fname, sheet, reader.layout.warp_w, reader.debug)
+            if isinstance(sheet, SheetFailed):
+                continue
+        if isinstance(sheet, SheetRejected):
+            print(f"[WARN] Skipping {os.path.basename(fname)}: {sheet}")
+            writer.reject(os.path.basename(fname), sheet)
+            continue
+        if sheet.duplicate_of:
+            print(f"[WARN] {os.path.basename(fname)} looks like a rescan of {sheet.duplicate_of[0]}")
+        print(f"Processing image {os.path.basename(fname)}...")
+        artifacts.submit(sheet)
+        writer.write(sheet)
+
+    artifacts.close()
+    writer.close()
+    quarantine.close()
+    if get_info:
+        write_info_pdf(output_dir)
+
+def append_csv_row(path, fieldnames, row):
+    """Append one row to a CSV, writing the header first if the file is new.
+
+    An existing file keeps its own header, so rows stay aligned with earlier runs.
+    """
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, newline='') as f:
+            fieldnames = next(csvmod.reader(f))
+        new = False
+    else:
+        new = True
+    with open(path, 'a', newline='') as f:
+        writer = csvmod.DictWriter(f, fieldnames=fieldnames, restval='', extrasaction='ignore', lineterminator='\n')
+        if new:
+            writer.writeheader()
+        writer.writerow(row)
+        f.flush()
+
+def iter_new_sheets(folder, seen=(), poll_interval=0.25, settle=0.5):
+    """Yield each new .png sheet in `folder` once it has stopped changing.
+
+    Uses inotify when the optional `inotify_simple` package is available and
+    falls back to polling the directory otherwise. A file is only yielded
+    after its size and mtime stayed unchanged for `settle` seconds, so sheets
+    still being written by the scanner are not picked up half-done.
+    """
+    try:
+        from inotify_simple import INotify, flags
+        inotify = INotify()
+        inotify.add_watch(folder, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+    except (ImportError, OSError):
+        inotify = None
+    seen = set(seen)
+    # path -> ((size, mtime), time the signature was last seen changing)
+    pending = {path: None for path in glob.glob(os.path.join(folder, "*.png")) if path not in seen}
+    while True:
+        if inotify is not None:
+            events = inotify.read(timeout=int(poll_interval * 1000))
+            candidates = [os.path.join(folder, e.name) for e in events if e.name]
+        else:
+            time.sleep(poll_interval)
+            candidates = glob.glob(os.path.join(folder, "*.png"))
+        for path in candidates:
+            if path.endswith(".png") and path not in seen:
+                pending.setdefault(path, None)
+        now = time.monotonic()
+        for path in sorted(pending):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del pending[path]
+                continue
+            sig = (st.st_size, st.st_mtime_ns)
+            prev = pending[path]
+            if prev is None or prev[0] != sig:
+                pending[path] = (sig, now)
+            elif st.st_size > 0 and now - prev[1] >= settle:
+                del pending[path]
+                seen.add(path)
+                yield path
+
+def watch_folder(reader, folder, out_csv="results.csv", output_dir="output",
+                 poll_interval=0.25, settle=0.5, reuse_markers=True, artifact_format=None,
+                 artifact_workers=2, duplicates='link'):
+    """Grade sheets as they land in `folder`, appending to the outputs as it goes.
+
+    The reader keeps the grid, answer keys and models warm; sheets already
+    listed in the results CSV are skipped, so a restarted watcher resumes.
+    Rescans are only recognised among the sheets of the current session.
+    Sheets that raise are quarantined and retried as in process_folder.
+    Runs until interrupted (Ctrl+C).
+    """
+    detections_dir, students_info_dir = _output_dirs(output_dir)
+    results_cols, grades_cols = reader.result_columns()
+    csv_path = os.path.join(output_dir, os.path.basename(out_csv))
+    grades_csv_path = os.path.join(output_dir, 'grades.csv')
+    info_csv_path = os.path.join(students_info_dir, "info.csv")
+    review_csv_path = os.path.join(output_dir, 'review.csv')
+    rejects_csv_path = os.path.join(output_dir, 'rejects.csv')
+    duplicates_csv_path = os.path.join(output_dir, 'duplicates.csv')
+    index = DuplicateIndex(skip=duplicates == 'skip') if duplicates != 'off' else None
+    transformed_path = os.path.join(output_dir, 'results_transformed_to_A.csv')
+
+    done = set()
+    if os.path.exists(csv_path):
+        with open(csv_path, newline='') as f:
+            done = {os.path.join(folder, r['file']) for r in csvmod.DictReader(f)}
+    tracker = MarkerTracker() if reuse_markers else None
+    artifacts = ArtifactWriter(detections_dir, students_info_dir, artifact_format, artifact_workers)
+    quarantine = Quarantine(output_dir)
+    read = partial(reader.read, duplicates=index)
+    print(f"Watching {folder} for new sheets (Ctrl+C to stop)...")
+    try:
+        for fname in iter_new_sheets(folder, done, poll_interval, settle):
+            start = time.perf_counter()
+            sheet = _read_or_reject(read, fname, tracker=tracker)
+            if isinstance(sheet, SheetFailed):
+                sheet = quarantine.retry(read, fname, sheet, reader.layout.warp_w, reader.debug)
+                if isinstance(sheet, SheetFailed):
+                    continue
+            if isinstance(sheet, SheetDuplicate):
+                print(f"[WARN] Skipping {os.path.basename(fname)}: {sheet}")
+                append_csv_row(duplicates_csv_path, DUPLICATE_COLUMNS, sheet.row(os.path.basename(fname)))
+                continue
+            if isinstance(sheet, SheetRejected):
+                print(f"[WARN] Skipping {os.path.basename(fname)}: {sheet}")
+                append_csv_row(rejects_csv_path, REJECT_COLUMNS, sheet.row(os.path.basename(fname)))
+                continue
+            if sheet.duplicate_of:
+                original, distance = sheet.duplicate_of
+                print(f"[WARN] {sheet.file} looks like a rescan of {original}")
+                append_csv_row(duplicates_csv_path, DUPLICATE_COLUMNS,
+                               {"file": sheet.file, "duplicate_of": original, "distance": distance, "action": "graded"})
+            artifacts.submit(sheet)
+            append_csv_row(csv_path, results_cols, sheet.row)
+            if sheet.grades_row:
+                append_csv_row(grades_csv_path, grades_cols, sheet.grades_row)
+            if sheet.info_row:
+                append_csv_row(info_csv_path, INFO_COLUMNS, sheet.info_row)
+            for row in sheet.review_rows:
+                append_csv_row(review_csv_path, REVIEW_COLUMNS, row)
+            if reader.mapping and sheet.tema is not None:
+                append_csv_row(transformed_path, reader.transformed_columns(), reader.to_theme_a([sheet.row])[0])
+            grade = f", grade {sheet.grade}" if sheet.grades_row else ""
+            grade += f", {len(sheet.flags)} flagged" if sheet.flags else ""
+            print(f"Graded {sheet.file}{grade} in {time.perf_counter() - start:.2f}s")
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        artifacts.close()
+        quarantine.close()
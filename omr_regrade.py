@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Regrade a finished run from its saved bubble fills, without reading any image.
+
+Every run of OMR-reader.py leaves fills.u16 (memory-mapped uint16 tensor of
+sheets x 2 x questions x options), fills_index.csv and fills.json in its
+output folder (see omr_reader.FillStore). This script applies another
+--min-fill, answer key or scoring to them and writes results.csv and
+grades.csv again:
+
+    python omr_regrade.py output/temaA --min-fill 150 --answers-json inputs/answersA_fixed.json
+
+Questions the run re-read in its second pass keep that reading (decided with
+--recheck-fill on the stored ink fractions); the other questions are decided
+on the fast-pass fills with --min-fill. A lower --min-fill cannot trigger new
+second-pass re-reads, as that needs the scans; --fast-only ignores the
+second pass altogether. --fill-mode sheet/column recomputes each sheet's
+adaptive thresholds from the stored fills, exactly as the run did.
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import csv as csvmod
+
+import numpy as np
+
+from omr_reader import FILL_MODES, fill_thresholds, load_answers, load_fills, load_script
+
+def decide(tensor, meta, min_fill, recheck_fill=None, fast_only=False, fill_mode='fixed'):
+    """Chosen option index per sheet and question (-1 for blank), as OMRReader.read decides it."""
+    fills = np.asarray(tensor[:, 0], dtype=np.int32)
+    best = fills.argmax(axis=2)
+    if fill_mode == 'fixed' and min_fill >= 1:
+        thresholds = min_fill
+    else:
+        thresholds = fill_thresholds(fills, meta['columns'], meta['areas'], min_fill, fill_mode)
+    chosen = np.where(np.take_along_axis(fills, best[..., None], 2)[..., 0] >= thresholds, best, -1)
+    if fast_only:
+        return chosen
+    rechecked = np.asarray(tensor[:, 1], dtype=np.int32)
+    reread = (rechecked != meta['missing']).all(axis=2)
+    fraction = meta['recheck_fill'] if recheck_fill is None else recheck_fill
+    best2 = rechecked.argmax(axis=2)
+    top2 = np.take_along_axis(rechecked, best2[..., None], 2)[..., 0] / meta['recheck_scale']
+    chosen2 = np.where(top2 >= fraction, best2, -1)
+    return np.where(reread, chosen2, chosen)
+
+def grade(chosen, options, questions, key, scoring):
+    """Marks ('+', '-', 'nr') and total score of each sheet against one answer key."""
+    n_opts = len(options)
+    in_key = np.array([q in key for q in questions])
+    correct = np.zeros((len(questions), n_opts + 1), dtype=bool)   # last column: blank
+    for j, q in enumerate(questions):
+        if q in key:
+            opts = {c.strip().upper() for c in key[q].replace(';', ',').split(',')}
+            correct[j, :n_opts] = [o in opts for o in options]
+    picked = np.where(chosen < 0, n_opts, chosen)
+    right = correct[np.arange(len(questions)), picked]
+    blank = chosen < 0
+    marks = np.where(~in_key, '-', np.where(blank, 'nr', np.where(right, '+', '-')))
+    # the scoring values themselves (not a numpy dtype), summed left to right
+    # as OMRReader.read does, so ints stay ints and floats round the same way
+    values = np.array([scoring.get('incorrect', 0), scoring.get('correct', 1),
+                       scoring.get('unanswered', 0), 0], dtype=object)
+    score = values[np.where(~in_key, 3, np.where(blank, 2, right.astype(int)))]
+    return marks, [sum(row) for row in score.tolist()]
+
+def _write_csv(path, header, rows):
+    with open(path + '.partial', 'w', newline='') as f:
+        writer = csvmod.writer(f, lineterminator='\n')
+        writer.writerow(header)
+        writer.writerows(rows)
+    os.replace(path + '.partial', path)
+
+def regrade(run_dir, output_dir, min_fill=None, answers_csv=None, answers_json=None, scoring_json=None,
+            themes_json=None, theme_mapping=None, recheck_fill=None, fast_only=False, fill_mode=None):
+    """Regrade `run_dir` from its fill tensor into `output_dir`; returns the number of sheets."""
+    meta, index, tensor = load_fills(run_dir)
+    min_fill = meta['min_fill'] if min_fill is None else min_fill
+    fill_mode = fill_mode or meta.get('fill_mode', 'fixed')
+    if (fill_mode != 'fixed' or min_fill < 1) and 'areas' not in meta:
+        raise ValueError(f"{run_dir}/fills.json has no bubble areas (older run); "
+                         "only a fixed pixel --min-fill can regrade it")
+    questions, options = meta['questions'], meta['options']
+    chosen = decide(tensor, meta, min_fill, recheck_fill, fast_only, fill_mode)
+    letters = np.array(list(options) + [''], dtype=object)
+    answers = letters[chosen]          # -1 picks the trailing ''
+
+    scoring = {"correct": 1, "incorrect": 0, "unanswered": 0}
+    if scoring_json:
+        with open(scoring_json) as f:
+            scoring.update(json.load(f))
+    keys = {None: load_answers(answers_csv, answers_json)}
+    if themes_json:
+        with open(themes_json) as f:
+            themes = json.load(f)
+        keys.update({t: load_answers(spec.get('answers_csv'), spec.get('answers_json'))
+                     for t, spec in themes.items()})
+    files = [r['file'] for r in index]
+    temas = np.array([r['tema'] for r in index], dtype=object)
+    qs = [f"Q{q}" for q in questions]
+    with_tema = bool(themes_json) or any(temas)
+    tail = [[t] for t in temas] if with_tema else [[]] * len(files)
+    results = [[f] + a + t for f, a, t in zip(files, answers.tolist(), tail)]
+
+    # every theme is graded in one vectorised pass against its own key
+    grades = [None] * len(files)
+    for t in sorted(set(temas)):
+        key = keys.get(t) or keys.get(None)
+        if not key:
+            continue
+        rows = np.flatnonzero(temas == t)
+        marks, totals = grade(chosen[rows], options, questions, key, scoring)
+        for r, m, total in zip(rows, marks.tolist(), totals):
+            grades[r] = [files[r]] + m + [total] + tail[r]
+    grades = [g for g in grades if g is not None]
+
+    os.makedirs(output_dir, exist_ok=True)
+    tema = ['tema'] if with_tema else []
+    _write_csv(os.path.join(output_dir, 'results.csv'), ['file'] + qs + tema, results)
+    print(f"Saved results to {os.path.join(output_dir, 'results.csv')} ({len(results)} rows)")
+    if grades:
+        _write_csv(os.path.join(output_dir, 'grades.csv'), ['file'] + qs + ['grade'] + tema, grades)
+        print(f"Saved grades to {os.path.join(output_dir, 'grades.csv')} ({len(grades)} rows)")
+    if theme_mapping:
+        with open(theme_mapping) as f:
+            mapping = json.load(f)
+        transform_results = load_script('transform_results')
+        inverted_opts = transform_results.build_inverted_options(mapping)
+        n_questions = max(questions)
+        header = ['file'] + qs + tema
+        rows = [transform_results.transform_row(dict(zip(header, r)), mapping, inverted_opts, n_questions)
+                for r in results if with_tema and r[-1]]
+        cols = ['file'] + [f'Q{i}' for i in range(1, n_questions + 1)] + ['tema']
+        _write_csv(os.path.join(output_dir, 'results_transformed_to_A.csv'), cols,
+                   [[r.get(c, '') for c in cols] for r in rows])
+    return len(results)
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Regrade an OMR-reader.py run from its saved bubble fills.")
+    p.add_argument("run_dir", help="Output folder of the run (holds fills.u16, fills_index.csv and fills.json)")
+    p.add_argument("--output", help="Where to write the regraded CSVs (default: <run_dir>/regraded)")
+    p.add_argument("--min-fill", type=float, help="Fast-pass fill threshold, in pixels or as a fraction of the bubble area below 1 (default: the run's)")
+    p.add_argument("--fill-mode", choices=FILL_MODES, help="fixed, sheet or column thresholds as in OMR-reader.py (default: the run's)")
+    p.add_argument("--recheck-fill", type=float, help="Ink fraction that marks a bubble on re-read questions (default: the run's)")
+    p.add_argument("--fast-only", action="store_true", help="Ignore the second-pass readings")
+    p.add_argument("--answers-csv", help="Answer key CSV (Pregunta,Respuesta)")
+    p.add_argument("--answers-json", help="Answer key JSON")
+    p.add_argument("--scoring-json", help="Scoring JSON")
+    p.add_argument("--themes", help="Themes JSON as given to OMR-reader.py, for per-theme answer keys")
+    p.add_argument("--theme-mapping", help="Theme mapping JSON: also write results_transformed_to_A.csv")
+    args = p.parse_args()
+
+    start = time.perf_counter()
+    try:
+        n = regrade(args.run_dir, args.output or os.path.join(args.run_dir, 'regraded'), args.min_fill,
+                    args.answers_csv, args.answers_json, args.scoring_json, args.themes, args.theme_mapping,
+                    args.recheck_fill, args.fast_only, args.fill_mode)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    print(f"Regraded {n} sheets in {(time.perf_counter() - start) * 1000:.0f} ms")
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Local HTTP grading service for the OMR pipeline.
+
+Keeps the grid layout, answer keys and (optionally) the OCR model loaded and
+grades uploaded scans with a bounded pool of worker threads:
+
+    python omr_service.py serve --answers-json answersA.json --scoring-json scoring.json
+    python omr_service.py post http://127.0.0.1:8765 scan1.png scan2.png
+
+Endpoints:
+    GET  /health       -> {"status": "ok", "in_flight": n, "capacity": n}
+    POST /grade        -> body is one PNG/JPEG image, ?name=<file name>
+    POST /grade-batch  -> body is JSON {"images": [{"name": ..., "data": <base64>}, ...]}
+
+Each graded sheet is returned as {"file", "answers", "marks", "grade", "tema",
+"confidence", "question_confidence", "flags", "student"}; `flags` lists the
+questions left for human review ("multi" for several marks, "low" for low
+confidence). When all worker slots and queue slots are taken the service
+answers 503 instead of queueing unboundedly.
+"""
+import os
+import sys
+import json
+import base64
+import argparse
+import threading
+import urllib.request
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class QueueFull(Exception):
+    pass
+
+class GradingService:
+    """Grades decoded images with a fixed number of workers and a bounded queue."""
+
+    def __init__(self, reader, workers=2, queue_size=16):
+        self.reader = reader
+        self.capacity = workers + queue_size
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def _acquire(self, n):
+        taken = 0
+        while taken < n and self._slots.acquire(blocking=False):
+            taken += 1
+        if taken < n:
+            for _ in range(taken):
+                self._slots.release()
+            raise QueueFull(f"grading queue is full ({self.capacity} sheets)")
+        with self._lock:
+            self.in_flight += n
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def _grade(self, name, data):
+        import cv2
+        import numpy as np
+        try:
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                return {"file": name, "error": "could not decode image"}
+            # no MarkerTracker: uploads do not come from one sequential feeder
+            sheet = self.reader.read(img, name)
+        except Exception as e:
+            return {"file": name, "error": str(e)}
+        finally:
+            self._release()
+        return {
+            "file": name,
+            "answers": {str(q): a for q, a in sorted(sheet.answers.items())},
+            "marks": {str(q): m for q, m in sheet.marks.items()} if sheet.marks is not None else None,
+            "grade": sheet.grade,
+            "tema": sheet.tema,
+            "confidence": min(sheet.confidence.values()) if sheet.confidence else None,
+            "question_confidence": {str(q): c for q, c in sorted(sheet.confidence.items())},
+            "flags": {str(q): f for q, f in sorted(sheet.flags.items())},
+            "student": sheet.student,
+        }
+
+    def grade_many(self, images):
+        """Grade [(name, bytes), ...]; raises QueueFull if they do not fit in the queue."""
+        self._acquire(len(images))
+        futures = [self.pool.submit(self._grade, name, data) for name, data in images]
+        return [f.result() for f in futures]
+
+def make_handler(service, max_body):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload, headers=()):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for k, v in headers:
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlparse(self.path).path != '/health':
+                return self._send(404, {"error": "not found"})
+            self._send(200, {"status": "ok", "in_flight": service.in_flight, "capacity": service.capacity})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get('Content-Length', 0))
+            if length <= 0:
+                return self._send(400, {"error": "empty request body"})
+            if length > max_body:
+                return self._send(413, {"error": f"request body larger than {max_body} bytes"})
+            body = self.rfile.read(length)
+            try:
+                if url.path == '/grade':
+                    name = parse_qs(url.query).get('name', ['upload'])[0]
+                    result = service.grade_many([(name, body)])[0]
+                    return self._send(422 if 'error' in result else 200, result)
+                if url.path == '/grade-batch':
+                    try:
+                        items = json.loads(body)['images']
+                        images = [(it.get('name', f'upload_{i}'), base64.b64decode(it['data']))
+                                  for i, it in enumerate(items)]
+                    except (ValueError, KeyError, TypeError) as e:
+                        return self._send(400, {"error": f"invalid batch request: {e}"})
+                    if len(images) > service.capacity:
+                        return self._send(413, {"error": f"batch larger than queue capacity ({service.capacity})"})
+                    return self._send(200, {"results": service.grade_many(images)})
+            except QueueFull as e:
+                return self._send(503, {"error": str(e)}, headers=[('Retry-After', '1')])
+            self._send(404, {"error": "not found"})
+
+        def log_message(self, fmt, *args):
+            if service.reader.debug >= 1:
+                super().log_message(fmt, *args)
+    return Handler
+
+def post_images(url, paths):
+    """Stand-in client: grade local image files through a running service."""
+    url = url.rstrip('/')
+    if len(paths) == 1:
+        with open(paths[0], 'rb') as f:
+            req = urllib.request.Request(f"{url}/grade?name={os.path.basename(paths[0])}", data=f.read(),
+                                         headers={'Content-Type': 'application/octet-stream'})
+    else:
+        images = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                images.append({"name": os.path.basename(path), "data": base64.b64encode(f.read()).decode('ascii')})
+        req = urllib.request.Request(f"{url}/grade-batch", data=json.dumps({"images": images}).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return json.load(resp)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Local HTTP grading service for OMR sheets.")
+    sub = p.add_subparsers(dest="command", required=True)
+    s = sub.add_parser("serve", help="Load the grid and answer keys and serve grading requests")
+    s.add_argument("--host", default="127.0.0.1")
+    s.add_argument("--port", type=int, default=8765)
+    s.add_argument("--workers", type=int, default=2, help="Sheets graded concurrently (default: 2)")
+    s.add_argument("--queue-size", type=int, default=16, help="Sheets allowed to wait for a worker before answering 503 (default: 16)")
+    s.add_argument("--max-body-mb", type=int, default=64, help="Largest accepted request body in MB (default: 64)")
+    s.add_argument("--min-fill", type=float, default=200, help="Minimum fill threshold for answer detection, in pixels or, below 1, as a fraction of the bubble area (default: 200)")
+    s.add_argument("--fill-mode", default="fixed", choices=["fixed", "sheet", "column"], help="Per-sheet or per-column adaptive threshold (see OMR-reader.py; default: fixed)")
+    s.add_argument("--answers-csv", help="CSV file with correct answers (Pregunta,Respuesta)")
+    s.add_argument("--answers-json", help="JSON file with correct answers, e.g. {'1':'A','2':'A,D'}")
+    s.add_argument("--scoring-json", help="JSON file with scoring for correct/incorrect/unanswered")
+    s.add_argument("--themes", help="JSON mapping each theme to a sample scan and its answer key (see OMR-reader.py)")
+    s.add_argument("--qr", action="store_true", help="Decode the sheet QR to resolve theme and sheet ID")
+    s.add_argument("--roster", help="CSV with sheet_id,name,id columns (implies --qr)")
+    s.add_argument("--hand-writing", action="store_true", help="Keep the handwriting OCR model loaded and read name/id fields")
+    s.add_argument("--device", default="cpu", choices=["cpu", "cuda"], help="Device for OCR model (cpu or cuda)")
+    s.add_argument("--debug", type=int, default=0, choices=[0, 1, 2], help="Debug level of the reader (default: 0)")
+    c = sub.add_parser("post", help="Send local images to a running service and print the JSON reply")
+    c.add_argument("url", help="Service URL, e.g. http://127.0.0.1:8765")
+    c.add_argument("images", nargs="+", help="Image files to grade")
+    args = p.parse_args()
+
+    if args.command == "post":
+        print(json.dumps(post_images(args.url, args.images), indent=2))
+        sys.exit(0)
+
+    # Only the server needs the engine (OpenCV, NumPy); the `post` client does not
+    from omr_reader import OMRReader
+    if not os.path.exists('grid_config.json'):
+        print("grid_config.json not found in the working directory.")
+        sys.exit(1)
+    reader = OMRReader('grid_config.json', min_fill=args.min_fill, fill_mode=args.fill_mode, debug=args.debug,
+                       answers_csv=args.answers_csv, answers_json=args.answers_json,
+                       scoring_json=args.scoring_json, themes_json=args.themes,
+                       read_qr=args.qr, roster_csv=args.roster,
+                       hand_writing=args.hand_writing, device=args.device)
+    service = GradingService(reader, workers=args.workers, queue_size=args.queue_size)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service, args.max_body_mb * 1024 * 1024))
+    print(f"Serving OMR grading on http://{args.host}:{args.port} ({args.workers} workers, queue {args.queue_size})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.pool.shutdown()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""Split one grading batch across machines and merge the partial outputs.
+
+Every machine runs the same command with its own shard:
+
+    python OMR-reader.py inputs/exams --output output/final --shard 0/3 ...
+    python OMR-reader.py inputs/exams --output output/final --shard 1/3 ...
+    python OMR-reader.py inputs/exams --output output/final --shard 2/3 ...
+
+Sheets are assigned by a SHA-1 of their file name over the sorted input list,
+so every machine computes the same partition. Each shard writes its outputs to
+<output>/shard-<i>-of-<N>/ together with a shard.json manifest describing the
+whole input set and its own share. Once the shard directories are gathered,
+
+    python omr_shards.py merge output/final
+
+checks that the shards cover every input exactly once and writes the same
+results.csv, grades.csv, review.csv, students-info/info.csv and fill tensor
+(fills.u16) a single-node run would have produced, plus a failures.json
+pointing into each shard's quarantine/ when any sheet failed to read. Rescans that landed in
+different shards are found from the sheet hashes and added to duplicates.csv;
+if the shards ran with --duplicates skip, they are also dropped from the
+merged tables, as a single-node run would have skipped them.
+"""
+import os
+import sys
+import glob
+import json
+import hashlib
+import argparse
+import csv as csvmod
+from datetime import datetime
+
+MANIFEST = "shard.json"
+
+def parse_shard(text):
+    """Parse 'i/N' (0 <= i < N) into (i, N)."""
+    try:
+        i, n = (int(v) for v in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {text!r}")
+    if n < 1 or not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f"shard index must satisfy 0 <= i < N, got {text!r}")
+    return i, n
+
+def shard_dir(output_dir, shard):
+    i, n = shard
+    return os.path.join(output_dir, f"shard-{i}-of-{n}")
+
+def inputs_digest(names):
+    return hashlib.sha256("\n".join(sorted(names)).encode('utf-8')).hexdigest()
+
+def write_manifest(output_dir, folder, shard, out_csv="results.csv", duplicates='link'):
+    """Describe a finished shard: the whole input set, this shard's files, its outputs and --duplicates mode."""
+    from omr_reader import list_sheets
+    names = [os.path.basename(f) for f in list_sheets(folder)]
+    manifest = {
+        "shard": shard[0],
+        "shards": shard[1],
+        "input_folder": os.path.abspath(folder),
+        "inputs": len(names),
+        "inputs_sha256": inputs_digest(names),
+        "files": [os.path.basename(f) for f in list_sheets(folder, shard)],
+        "results_csv": os.path.basename(out_csv),
+        "duplicates": duplicates,
+        "finished": datetime.now().isoformat(timespec='seconds'),
+    }
+    with open(os.path.join(output_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def _read_csv(path):
+    if not os.path.exists(path):
+        return [], []
+    with open(path, newline='') as f:
+        reader = csvmod.DictReader(f)
+        return list(reader), reader.fieldnames or []
+
+def _union(columns_lists):
+    cols = []
+    for columns in columns_lists:
+        cols += [c for c in columns if c not in cols]
+    return cols
+
+def _write_csv(path, fieldnames, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csvmod.DictWriter(f, fieldnames=fieldnames, restval='', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+
+def merge_shards(output_dir, shard_dirs=None):
+    """Check shard coverage and write the merged CSVs to `output_dir`.
+
+    Raises ValueError listing every problem (missing or repeated shards,
+    inputs assigned or graded twice, sheets without results) before anything
+    is written.
+    """
+    shard_dirs = shard_dirs or sorted(glob.glob(os.path.join(output_dir, "shard-*-of-*")))
+    manifests = []
+    for d in shard_dirs:
+        path = os.path.join(d, MANIFEST)
+        if not os.path.exists(path):
+            raise ValueError(f"{d} has no {MANIFEST}; was the shard interrupted?")
+        with open(path) as f:
+            manifests.append((d, json.load(f)))
+    if not manifests:
+        raise ValueError(f"no shard directories found in {output_dir}")
+
+    problems = []
+    first = manifests[0][1]
+    for d, m in manifests:
+        if (m['shards'], m['inputs_sha256']) != (first['shards'], first['inputs_sha256']):
+            problems.append(f"{d} was run on a different input set or shard count")
+    seen_shards = [m['shard'] for _, m in manifests]
+    missing_shards = sorted(set(range(first['shards'])) - set(seen_shards))
+    if missing_shards:
+        problems.append(f"missing shards: {missing_shards} of {first['shards']}")
+    repeated = sorted({s for s in seen_shards if seen_shards.count(s) > 1})
+    if repeated:
+        problems.append(f"shards present more than once: {repeated}")
+    modes = sorted({m.get('duplicates', 'link') for _, m in manifests})
+    if len(modes) > 1:
+        problems.append(f"shards were run with different --duplicates modes: {modes}")
+
+    assigned = {}
+    for d, m in manifests:
+        for name in m['files']:
+            if name in assigned:
+                problems.append(f"{name} assigned to both {assigned[name]} and {d}")
+            assigned[name] = d
+    if not missing_shards and len(assigned) != first['inputs']:
+        problems.append(f"shards cover {len(assigned)} of {first['inputs']} inputs")
+
+    tables = {"results": [], "transformed": [], "grades": [], "review": [], "info": [], "rejects": [],
+              "duplicates": []}
+    failures = {"failed": [], "recovered": []}
+    graded = {}
+    for d, m in manifests:
+        shard_failures = _read_failures(d)
+        for key in failures:
+            failures[key] += shard_failures[key]
+        parts = {
+            "results": _read_csv(os.path.join(d, m['results_csv'])),
+            "transformed": _read_csv(os.path.join(d, 'results_transformed_to_A.csv')),
+            "grades": _read_csv(os.path.join(d, 'grades.csv')),
+            "review": _read_csv(os.path.join(d, 'review.csv')),
+            "info": _read_csv(os.path.join(d, 'students-info', 'info.csv')),
+            "rejects": _read_csv(os.path.join(d, 'rejects.csv')),
+            "duplicates": _read_csv(os.path.join(d, 'duplicates.csv')),
+        }
+        for key, part in parts.items():
+            tables[key].append(part)
+        # pages rejected by the pre-flight check, skipped as rescans or quarantined are
+        # accounted for like graded ones
+        skipped = [r for r in parts["duplicates"][0] if r.get('action') == 'skipped']
+        for row in parts["results"][0] + parts["rejects"][0] + skipped + shard_failures["failed"]:
+            if row['file'] in graded:
+                problems.append(f"{row['file']} graded in both {graded[row['file']]} and {d}")
+            graded[row['file']] = d
+    ungraded = sorted(set(assigned) - set(graded))
+    if ungraded:
+        problems.append(f"{len(ungraded)} sheets have no results: {ungraded[:10]}")
+    if problems:
+        raise ValueError("cannot merge shards:\n  " + "\n  ".join(problems))
+
+    # rescans split across shards, which no shard could see both of
+    fills = all(os.path.exists(os.path.join(d, 'fills.json')) for d, _ in manifests)
+    mode = first.get('duplicates', 'link')
+    rescans = []
+    if fills and mode != 'off':
+        hashes = sorted((r['file'], r.get('phash', '')) for d, _ in manifests
+                        for r in _read_csv(os.path.join(d, 'fills_index.csv'))[0])
+        sheet_ids = {r['image']: r.get('sheet_id') for rows, _ in tables["info"] for r in rows}
+        listed = {r['file'] for rows, _ in tables["duplicates"] for r in rows}
+        rescans = _cross_shard_duplicates(hashes, graded, listed, sheet_ids, skip=mode == 'skip')
+    dropped = {r['file'] for r in rescans if r['action'] == 'skipped'}
+
+    def merged(key, file_key='file'):
+        rows = [r for rows, _ in tables[key] for r in rows if r[file_key] not in dropped]
+        # single-node runs grade sheets in sorted file name order
+        rows.sort(key=lambda r: r[file_key])
+        return rows, _union(cols for _, cols in tables[key])
+
+    os.makedirs(os.path.join(output_dir, 'students-info'), exist_ok=True)
+    rows, cols = merged("results")
+    _write_csv(os.path.join(output_dir, first['results_csv']), cols, rows)
+    print(f"Saved results to {os.path.join(output_dir, first['results_csv'])} ({len(rows)} sheets)")
+    graded_rows = len(rows)
+    rows, cols = merged("transformed")
+    if rows:
+        _write_csv(os.path.join(output_dir, 'results_transformed_to_A.csv'), cols, rows)
+    rows, cols = merged("grades")
+    if rows:
+        qs = sorted((c for c in cols if c.startswith('Q')), key=lambda c: int(c[1:]))
+        cols = ['file'] + qs + ['grade'] + (['tema'] if 'tema' in cols else [])
+        for row in rows:
+            for q in qs:
+                row.setdefault(q, '-')
+        _write_csv(os.path.join(output_dir, 'grades.csv'), cols, rows)
+        print(f"Saved grades to {os.path.join(output_dir, 'grades.csv')}")
+    rows, cols = merged("review")
+    if rows:
+        rows.sort(key=lambda r: (r['file'], int(r['question'])))
+        _write_csv(os.path.join(output_dir, 'review.csv'), cols, rows)
+    rows, cols = merged("info", 'image')
+    if rows:
+        _write_csv(os.path.join(output_dir, 'students-info', 'info.csv'), cols, rows)
+        print(f"Saved student info to {os.path.join(output_dir, 'students-info', 'info.csv')}")
+    rows, cols = merged("rejects")
+    if rows:
+        _write_csv(os.path.join(output_dir, 'rejects.csv'), cols, rows)
+        print(f"Saved rejected pages to {os.path.join(output_dir, 'rejects.csv')} ({len(rows)} pages)")
+    if fills:
+        _merge_fills(output_dir, [d for d, _ in manifests], dropped)
+    duplicates, cols = merged("duplicates")
+    duplicates = sorted(duplicates + rescans, key=lambda r: r['file'])
+    if duplicates:
+        from omr_reader import DUPLICATE_COLUMNS
+        _write_csv(os.path.join(output_dir, 'duplicates.csv'), cols or DUPLICATE_COLUMNS, duplicates)
+        print(f"Saved duplicate sheets to {os.path.join(output_dir, 'duplicates.csv')} ({len(duplicates)} sheets)")
+    failures_path = os.path.join(output_dir, 'failures.json')
+    if failures["failed"] or failures["recovered"]:
+        with open(failures_path, 'w') as f:
+            json.dump({key: sorted(rows, key=lambda r: r['file']) for key, rows in failures.items()}, f, indent=2)
+    elif os.path.exists(failures_path):
+        os.remove(failures_path)
+    if failures["failed"]:
+        print(f"{len(failures['failed'])} sheets stayed in the shards' quarantine, see "
+              f"{failures_path}")
+    return graded_rows
+
+def _read_failures(shard):
+    """A shard's failures.json, with the quarantined copies' paths made relative to the merged output."""
+    path = os.path.join(shard, 'failures.json')
+    if not os.path.exists(path):
+        return {"failed": [], "recovered": []}
+    with open(path) as f:
+        failures = json.load(f)
+    for record in failures["failed"]:
+        record["quarantined"] = os.path.join(os.path.basename(os.path.normpath(shard)), record["quarantined"])
+    return failures
+
+def _merge_fills(output_dir, dirs, dropped=()):
+    """Concatenate the shards' fill tensors in sorted file order, for omr_regrade.py.
+
+    Sheets in `dropped` (cross-shard rescans in skip mode) are left out.
+    """
+    import numpy as np
+    from omr_reader import load_fills
+    parts = [load_fills(d) for d in dirs]
+    meta = dict(parts[0][0])
+    entries = sorted((row['file'], row['tema'], row.get('phash', ''), k, i)
+                     for k, (_, index, _) in enumerate(parts) for i, row in enumerate(index)
+                     if row['file'] not in dropped)
+    tensor = np.stack([parts[k][2][i] for _, _, _, k, i in entries]) if entries else \
+        np.zeros([0] + meta['shape'][1:], dtype=np.uint16)
+    with open(os.path.join(output_dir, 'fills.u16'), 'wb') as f:
+        f.write(tensor.tobytes())
+    _write_csv(os.path.join(output_dir, meta['index']), ['file', 'tema', 'phash'],
+               [{'file': file, 'tema': tema, 'phash': phash} for file, tema, phash, _, _ in entries])
+    meta['shape'] = list(tensor.shape)
+    with open(os.path.join(output_dir, 'fills.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+def _cross_shard_duplicates(hashes, shard_of_file, listed, sheet_ids, skip=False):
+    """duplicates.csv rows of rescans that landed in different shards, where no shard could see both.
+
+    `hashes` is [(file, hex sheet hash)] in sorted file order, the order a
+    single-node run would have met them in; with `skip` the later sheet is
+    marked as skipped.
+    """
+    from omr_reader import DuplicateIndex
+    index = DuplicateIndex()
+    rows = []
+    for file, phash in hashes:
+        if not phash or file in listed:
+            continue
+        found = index.check(file, int(phash, 16), sheet_id=sheet_ids.get(file))
+        if found and shard_of_file[found[0]] != shard_of_file[file]:
+            rows.append({"file": file, "duplicate_of": found[0], "distance": found[1],
+                         "action": "skipped" if skip else "graded"})
+    return rows
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Merge the shard outputs of OMR-reader.py --shard i/N.")
+    sub = p.add_subparsers(dest="command", required=True)
+    m = sub.add_parser("merge", help="Verify shard coverage and write the merged CSVs")
+    m.add_argument("output_dir", help="The --output directory the shards wrote their shard-<i>-of-<N>/ folders to")
+    m.add_argument("shard_dirs", nargs="*", help="Shard directories to merge (default: every shard-*-of-* in output_dir)")
+    args = p.parse_args()
+
+    try:
+        n = merge_shards(args.output_dir, args.shard_dirs)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    print(f"Merged {n} sheets from {len(args.shard_dirs) or 'all'} shards")
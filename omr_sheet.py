@@ -10,15 +10,49 @@ ocupar el espacio vertical sobrante, y mayor separación
 horizontal entre el número de pregunta y la primera burbuja.
 """
 
-from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
+# El lienzo PDF y los gráficos del QR se importan dentro de las funciones que
+# los usan: tardan en cargar y no hacen falta para --help ni para qr_payload()
+
+# Versión de la maquetación, incluida en el QR para que el lector la valide
+LAYOUT_VERSION = "1"
+QR_SIZE = 12 * mm   # lado del QR, cabe entre los marcadores inferiores
+
+def qr_payload(tema, sheet_id, layout=LAYOUT_VERSION):
+    """Contenido del QR: OMR:<versión>:<tema>:<identificador>."""
+    return f"OMR:{layout}:{tema}:{sheet_id}"
+
+def dibujar_qr(c, payload, x, y, size=QR_SIZE):
+    from reportlab.graphics import renderPDF
+    from reportlab.graphics.barcode.qr import QrCodeWidget
+    from reportlab.graphics.shapes import Drawing
+    qr = QrCodeWidget(payload, barLevel="M", barBorder=2)
+    x0, y0, x1, y1 = qr.getBounds()
+    d = Drawing(size, size, transform=[size / (x1 - x0), 0, 0, size / (y1 - y0), 0, 0])
+    d.add(qr)
+    renderPDF.draw(d, c, x, y)
 
 def generar_hoja_respuestas(
     filename="hoja_respuestas_tema_A.pdf",
-    tema="A"
+    tema="A",
+    sheet_ids=None
 ):
+    """Genera la hoja de respuestas del tema indicado.
+
+    Si se pasa `sheet_ids`, se genera una página por identificador, cada una
+    con un código QR (identificador, tema y versión de maquetación) que
+    OMR-reader.py decodifica para identificar al estudiante sin OCR.
+    """
+    from reportlab.pdfgen import canvas
     c = canvas.Canvas(filename, pagesize=A4)
+    for sheet_id in (sheet_ids or [None]):
+        dibujar_pagina(c, tema, sheet_id)
+        c.showPage()
+    c.save()
+    print(f"Generado: {filename}")
+
+def dibujar_pagina(c, tema="A", sheet_id=None):
     ancho, alto = A4
 
     # Márgenes
@@ -51,6 +85,10 @@ def generar_hoja_respuestas(
     for x in (m_x, ancho - m_x - mk):
         c.rect(x, ty, mk, mk, stroke=0, fill=1)
         c.rect(x, by, mk, mk, stroke=0, fill=1)
+    # Barra de orientación junto al marcador superior izquierdo: el lector la
+    # busca para leer hojas escaneadas del revés o giradas 90° (ORIENTATION_BAR
+    # en omr_reader.py: centro a 1,125 lados del marcador, 0,75 × 0,3 lados)
+    c.rect(m_x + 1.25 * mk, ty + 0.35 * mk, 0.75 * mk, 0.3 * mk, stroke=0, fill=1)
 
     # Encabezado
     intro = "Introducción a la Bioinformática 24/25 - Examen final - Biomedicina (UIC)"
@@ -119,10 +157,22 @@ def generar_hoja_respuestas(
                 y_letra = y - pt2mm(font_q_pt)/2 * mm
                 c.drawCentredString(xb, y_letra, opc)
 
-    c.showPage()
-    c.save()
-    print(f"Generado: {filename}")
+    # Código QR de identificación, centrado entre los marcadores inferiores
+    if sheet_id is not None:
+        dibujar_qr(c, qr_payload(tema, sheet_id), (ancho - QR_SIZE) / 2, by + mk + 0.6 * mm)
 
 if __name__ == "__main__":
+    import argparse
+    import csv
+    p = argparse.ArgumentParser(description="Genera las hojas de respuestas de los temas A y B.")
+    p.add_argument("--hojas", type=int, help="Genera N hojas numeradas por tema, cada una con su QR")
+    p.add_argument("--roster", help="CSV con columna sheet_id: una hoja con QR por fila")
+    args = p.parse_args()
+    sheet_ids = None
+    if args.roster:
+        with open(args.roster, newline="") as f:
+            sheet_ids = [row["sheet_id"] for row in csv.DictReader(f)]
+    elif args.hojas:
+        sheet_ids = [f"{i:06d}" for i in range(1, args.hojas + 1)]
     for tema in ("A", "B"):
-        generar_hoja_respuestas(f"hoja_respuestas_tema_{tema}.pdf", tema)
\ No newline at end of file
+        generar_hoja_respuestas(f"hoja_respuestas_tema_{tema}.pdf", tema, sheet_ids)
\ No newline at end of file
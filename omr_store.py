@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""Optional SQLite store of graded runs, for lookups across exams and themes.
+
+With --db, OMR-reader.py loads each finished run into one SQLite file:
+
+    python OMR-reader.py inputs/temaA --output output/temaA --db exams.sqlite --db-exam parcial1
+    python omr_store.py import exams.sqlite output/final --exam parcial1 --theme B
+    python omr_store.py student exams.sqlite 12345678Z
+
+Tables (one run is loaded in a single transaction):
+
+    runs        id, exam, theme, output_dir, imported, sheets     unique per (exam, output_dir)
+    sheets      id, run, exam, theme, file, sheet_id, phash    unique per (exam, file)
+    answers     sheet, question, answer, mark                 marked option ('' when blank), '+', '-' or 'nr'
+    grades      sheet, grade
+    identities  sheet, name, student_id, source
+
+Sheets are indexed by exam and theme and identities by student ID. Loading
+an output folder of an exam again replaces its run and sheets, and loading
+a sheet of an exam again (a regrade or resumed run) replaces its rows.
+script/merge_datasets.py, transform_results.py and get_stats.py read the
+store with --db instead of the per-theme CSVs.
+"""
+import os
+import sys
+import sqlite3
+import argparse
+import csv as csvmod
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    exam TEXT NOT NULL,
+    theme TEXT,
+    output_dir TEXT NOT NULL,
+    imported TEXT,
+    sheets INTEGER,
+    UNIQUE (exam, output_dir)
+);
+CREATE TABLE IF NOT EXISTS sheets (
+    id INTEGER PRIMARY KEY,
+    run INTEGER NOT NULL REFERENCES runs (id),
+    exam TEXT NOT NULL,
+    theme TEXT NOT NULL DEFAULT '',
+    file TEXT NOT NULL,
+    sheet_id TEXT,
+    phash TEXT,
+    UNIQUE (exam, file)
+);
+CREATE TABLE IF NOT EXISTS answers (
+    sheet INTEGER NOT NULL REFERENCES sheets (id) ON DELETE CASCADE,
+    question INTEGER NOT NULL,
+    answer TEXT NOT NULL,
+    mark TEXT,
+    PRIMARY KEY (sheet, question)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS grades (
+    sheet INTEGER PRIMARY KEY REFERENCES sheets (id) ON DELETE CASCADE,
+    grade REAL
+);
+CREATE TABLE IF NOT EXISTS identities (
+    sheet INTEGER PRIMARY KEY REFERENCES sheets (id) ON DELETE CASCADE,
+    name TEXT,
+    student_id TEXT,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS sheets_theme ON sheets (exam, theme);
+CREATE INDEX IF NOT EXISTS identities_student ON identities (student_id);
+"""
+
+def _read_rows(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, newline='') as f:
+        return list(csvmod.DictReader(f))
+
+def _stem(name):
+    return os.path.splitext(name)[0]
+
+class ResultStore:
+    """One SQLite file holding the sheets, answers, grades and identities of every loaded run."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def import_run(self, output_dir, exam, theme=None, results_csv="results.csv"):
+        """Load the CSVs of a finished run in `output_dir`; returns the number of sheets.
+
+        A sheet's theme is its `tema` column, else `theme`. Identities come
+        from students-info/info.csv, overridden by the filled-in rows of an
+        image-to-name.csv in the output or students-info folder. Loading the
+        same `output_dir` of `exam` again replaces its run.
+        """
+        if not exam:
+            raise ValueError("an exam name is required")
+        output_dir = os.path.abspath(output_dir)
+        results = _read_rows(os.path.join(output_dir, os.path.basename(results_csv)))
+        grades = {r['file']: r for r in _read_rows(os.path.join(output_dir, 'grades.csv'))}
+        hashes = {r['file']: r.get('phash', '') for r in _read_rows(os.path.join(output_dir, 'fills_index.csv'))}
+        people = {_stem(r['image']): r for r in _read_rows(os.path.join(output_dir, 'students-info', 'info.csv'))}
+        for path in (os.path.join(output_dir, 'image-to-name.csv'),
+                     os.path.join(output_dir, 'students-info', 'image-to-name.csv')):
+            for r in _read_rows(path):
+                if r.get('name') or r.get('id'):
+                    people[_stem(r['image'])] = dict(r, source='image-to-name')
+
+        answers, marks, identities = [], [], []
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO runs (exam, theme, output_dir, imported, sheets) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (exam, output_dir) DO UPDATE SET"
+                " theme = excluded.theme, imported = excluded.imported, sheets = excluded.sheets",
+                (exam, theme, output_dir, datetime.now().isoformat(timespec='seconds'), len(results)))
+            run, = self.conn.execute("SELECT id FROM runs WHERE exam = ? AND output_dir = ?",
+                                     (exam, output_dir)).fetchone()
+            self.conn.execute("DELETE FROM sheets WHERE run = ?", (run,))
+            self.conn.executemany("DELETE FROM sheets WHERE exam = ? AND file = ?", [(exam, r['file']) for r in results])
+            for r in results:
+                person = people.get(_stem(r['file']), {})
+                sheet = self.conn.execute(
+                    "INSERT INTO sheets (run, exam, theme, file, sheet_id, phash) VALUES (?, ?, ?, ?, ?, ?)",
+                    (run, exam, r.get('tema') or theme or '', r['file'], person.get('sheet_id') or None,
+                     hashes.get(r['file']) or None)).lastrowid
+                graded = grades.get(r['file'], {})
+                answers += [(sheet, int(col[1:]), value, graded.get(col)) for col, value in r.items()
+                            if col.startswith('Q') and col[1:].isdigit()]
+                if graded.get('grade') not in (None, ''):
+                    marks.append((sheet, float(graded['grade'])))
+                if person.get('name') or person.get('id'):
+                    identities.append((sheet, person.get('name', ''), person.get('id', ''), person.get('source', '')))
+            self.conn.executemany("INSERT INTO answers (sheet, question, answer, mark) VALUES (?, ?, ?, ?)", answers)
+            self.conn.executemany("INSERT INTO grades (sheet, grade) VALUES (?, ?)", marks)
+            self.conn.executemany("INSERT INTO identities (sheet, name, student_id, source) VALUES (?, ?, ?, ?)",
+                                  identities)
+        return len(results)
+
+    def _where(self, exam, theme):
+        clauses, params = ["s.exam = ?"], [exam]
+        if theme is not None:
+            clauses.append("s.theme = ?"); params.append(theme)
+        return " WHERE " + " AND ".join(clauses), params
+
+    def _per_question(self, column, exam, theme):
+        """{(exam, file, theme): {question: value}} of one answers column, in file order."""
+        where, params = self._where(exam, theme)
+        sheets = {}
+        for key in self.conn.execute(
+                f"SELECT s.exam, s.file, s.theme, a.question, a.{column} FROM sheets s JOIN answers a ON a.sheet = s.id"
+                f"{where} ORDER BY s.exam, s.file, a.question", params):
+            sheets.setdefault(key[:3], {})[key[3]] = key[4]
+        return sheets
+
+    def results(self, exam, theme=None):
+        """results.csv rows (file, Q1..Qn, tema) of an exam's sheets, as in a merged results_all.csv."""
+        return [dict({'file': file}, **{f"Q{q}": v for q, v in qs.items()}, tema=tema)
+                for (_, file, tema), qs in self._per_question('answer', exam, theme).items()]
+
+    def grades(self, exam, theme=None):
+        """grades.csv rows (file, Q1..Qn marks, grade, tema) of an exam's graded sheets."""
+        where, params = self._where(exam, theme)
+        grade = {(e, file): g for e, file, g in self.conn.execute(
+            f"SELECT s.exam, s.file, g.grade FROM sheets s JOIN grades g ON g.sheet = s.id{where}", params)}
+        return [dict({'file': file}, **{f"Q{q}": v or '-' for q, v in qs.items()}, grade=grade[e, file], tema=tema)
+                for (e, file, tema), qs in self._per_question('mark', exam, theme).items() if (e, file) in grade]
+
+    def identities(self, exam, theme=None):
+        """image-to-name rows (image without extension, name, id) of an exam's identified sheets."""
+        where, params = self._where(exam, theme)
+        return [{'image': _stem(file), 'name': name, 'id': student_id} for file, name, student_id in self.conn.execute(
+            f"SELECT s.file, i.name, i.student_id FROM sheets s JOIN identities i ON i.sheet = s.id{where}"
+            f" ORDER BY s.exam, s.file", params)]
+
+    def student(self, student_id):
+        """Every sheet of one student across exams: (exam, theme, file, name, grade) rows."""
+        return self.conn.execute(
+            "SELECT s.exam, s.theme, s.file, i.name, g.grade FROM identities i JOIN sheets s ON s.id = i.sheet"
+            " LEFT JOIN grades g ON g.sheet = s.id WHERE i.student_id = ? ORDER BY s.exam, s.file",
+            (student_id,)).fetchall()
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="SQLite store of graded OMR runs.")
+    sub = p.add_subparsers(dest="command", required=True)
+    m = sub.add_parser("import", help="Load a finished run's output folder into the store")
+    m.add_argument("db", help="SQLite file (created if missing)")
+    m.add_argument("output_dir", help="The --output folder of the run (a merged shard output works too)")
+    m.add_argument("--exam", required=True, help="Exam name the sheets are stored under")
+    m.add_argument("--theme", help="Theme of sheets whose results have no tema column")
+    m.add_argument("--csv", default="results.csv", help="Results CSV name of the run (default: results.csv)")
+    s = sub.add_parser("student", help="List one student's sheets and grades across exams")
+    s.add_argument("db")
+    s.add_argument("student_id")
+    args = p.parse_args()
+
+    if not os.path.exists(args.db) and args.command == "student":
+        print(f"{args.db} does not exist")
+        sys.exit(1)
+    with ResultStore(args.db) as store:
+        if args.command == "import":
+            n = store.import_run(args.output_dir, args.exam, args.theme, args.csv)
+            print(f"Loaded {n} sheets of {args.exam} into {args.db}")
+        else:
+            for exam, theme, file, name, grade in store.student(args.student_id):
+                print(f"{exam}\t{theme or '-'}\t{file}\t{name}\t{'' if grade is None else grade}")
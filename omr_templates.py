@@ -0,0 +1,196 @@
+"""Registry of several sheet layouts ("templates") graded in one run.
+
+A templates.json file names each layout and its grading inputs; relative
+paths are resolved against the directory of templates.json:
+
+    {
+      "biologia": {"config": "bio/grid_config.json", "answers_json": "bio/answersA.json",
+                   "scoring_json": "scoring.json", "layout_id": "bio1"},
+      "quimica":  {"config": "qui/grid_config.json", "themes": "qui/themes.json",
+                   "pattern": "qui_*.png"}
+    }
+
+Optional keys per template: answers_csv, answers_json, scoring_json, themes,
+theme_mapping, roster, qr, min_fill, fill_mode, pattern and layout_id. Each
+sheet is matched to a template by, in order: its file name (`pattern`), the
+layout ID in the sheet QR (`layout_id`, also accepted inside grid_config.json)
+and the aspect ratio of its corner markers against each layout's warp size.
+"""
+import os
+import csv as csvmod
+import json
+import fnmatch
+from dataclasses import dataclass
+from functools import partial
+
+import cv2
+import numpy as np
+
+from omr_reader import (OMRReader, SheetRejected, SheetDuplicate, SheetFailed, DuplicateIndex,
+                        REJECT_COLUMNS, DUPLICATE_COLUMNS, load_layout, find_markers, decode_sheet_qr,
+                        preflight, list_sheets, read_sheets, ArtifactWriter, ResultWriter, Quarantine,
+                        write_info_pdf, _output_dirs)
+
+PATH_KEYS = ("config", "answers_csv", "answers_json", "scoring_json", "themes", "theme_mapping", "roster")
+
+@dataclass
+class Template:
+    name: str
+    reader: OMRReader
+    pattern: str = None
+    layout_id: str = None
+
+    @property
+    def aspect(self):
+        return self.reader.layout.warp_w / self.reader.layout.warp_h
+
+def marker_aspect(pts):
+    """Width/height of the marker quad (TL, TR, BR, BL), averaging opposite sides."""
+    tl, tr, br, bl = pts
+    w = (np.linalg.norm(tr - tl) + np.linalg.norm(br - bl)) / 2
+    h = (np.linalg.norm(bl - tl) + np.linalg.norm(br - tr)) / 2
+    return w / h
+
+class TemplateRegistry:
+    """Loads every template's layout and answer keys once and picks one per sheet."""
+
+    def __init__(self, templates_json, min_fill=200, debug=0, hand_writing=False, device='cpu',
+                 recheck_below=0.25, second_pass=True, fill_mode='fixed', preflight=True, debug_dir=None):
+        with open(templates_json) as f:
+            specs = json.load(f)
+        if not specs:
+            raise ValueError(f"{templates_json} does not define any template")
+        base = os.path.dirname(os.path.abspath(templates_json))
+        self.debug = debug
+        self.preflight = preflight
+        self.debug_dir = debug_dir
+        self.templates = {}
+        for name, spec in specs.items():
+            spec = {k: (os.path.join(base, v) if k in PATH_KEYS and v else v) for k, v in spec.items()}
+            layout = load_layout(spec.get('config', os.path.join(base, 'grid_config.json')))
+            reader = OMRReader(
+                layout,
+                min_fill=spec.get('min_fill', min_fill),
+                fill_mode=spec.get('fill_mode', fill_mode),
+                debug=debug,
+                answers_csv=spec.get('answers_csv'),
+                answers_json=spec.get('answers_json'),
+                scoring_json=spec.get('scoring_json'),
+                themes_json=spec.get('themes'),
+                theme_mapping=spec.get('theme_mapping'),
+                read_qr=spec.get('qr', False),
+                roster_csv=spec.get('roster'),
+                hand_writing=hand_writing,
+                device=device,
+                recheck_below=recheck_below,
+                second_pass=second_pass,
+                debug_dir=debug_dir
+            )
+            layout_id = spec.get('layout_id', layout.cfg.get('layout_id'))
+            self.templates[name] = Template(name, reader, spec.get('pattern'),
+                                            str(layout_id) if layout_id is not None else None)
+
+    def select(self, img, name, markers=None):
+        """Return (template, marker centroids) for a decoded sheet, searching the markers unless given."""
+        pts = find_markers(img, self.debug, debug_dir=self.debug_dir) if markers is None else markers
+        by_name = [t for t in self.templates.values() if t.pattern and fnmatch.fnmatch(name, t.pattern)]
+        if len(by_name) == 1:
+            return by_name[0], pts
+        candidates = by_name or list(self.templates.values())
+        if len(candidates) == 1:
+            return candidates[0], pts
+        # Closest layout shape first; the sheet QR settles layouts of the same shape
+        aspect = marker_aspect(pts)
+        candidates.sort(key=lambda t: abs(np.log(aspect / t.aspect)))
+        if any(t.layout_id for t in candidates):
+            warped, _ = candidates[0].reader.warp(img, markers=pts)
+            qr = decode_sheet_qr(warped, candidates[0].reader.layout.qr_rect, self.debug)
+            if qr:
+                for t in candidates:
+                    if t.layout_id == qr['layout']:
+                        return t, pts
+        if self.debug >= 1:
+            print(f"[DEBUG] {name}: marker aspect {aspect:.3f}, template {candidates[0].name}")
+        return candidates[0], pts
+
+    def read(self, image, name=None, tracker=None, markers=None, duplicates=None):
+        """Grade one sheet with its template; returns (template name, SheetResult).
+
+        `tracker` is accepted for read_sheets() but unused: consecutive sheets
+        may belong to different layouts. `markers` and `duplicates` are as
+        in OMRReader.read.
+        """
+        if isinstance(image, str):
+            name = name or os.path.basename(image)
+            img = cv2.imread(image)
+            if img is None:
+                raise RuntimeError(f"Could not read image {image}")
+        else:
+            img = image
+        name = name or "sheet"
+        # junk pages are turned away before the marker search that picks the template
+        if self.preflight and markers is None:
+            reason, checks = preflight(img)
+            if reason:
+                raise SheetRejected(reason, checks)
+        template, pts = self.select(img, name, markers)
+        return template.name, template.reader.read(img, name, markers=pts, duplicates=duplicates)
+
+def _write_skipped(path, columns, rows, label):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csvmod.DictWriter(f, fieldnames=columns, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Saved {label} to {path} ({len(rows)} rows)")
+
+def process_templates(registry, folder, out_csv="results.csv", output_dir="output",
+                      get_info=False, jobs=1, shard=None, artifact_format=None, artifact_workers=2,
+                      duplicates='link'):
+    """Grade every .png sheet in `folder`, writing each template's outputs to output_dir/<template>/.
+
+    Pages rejected by the pre-flight check, skipped rescans and quarantined
+    sheets belong to no template and are listed in output_dir/rejects.csv,
+    duplicates.csv and failures.json.
+    """
+    runs = {}
+    skipped = {'rejects': [], 'duplicates': []}
+    index = DuplicateIndex(skip=duplicates == 'skip') if duplicates != 'off' else None
+    read = partial(registry.read, duplicates=index)
+    quarantine = Quarantine(output_dir)
+    # a low-resolution scan is upscaled to the widest layout before its template is known
+    min_width = max(t.reader.layout.warp_w for t in registry.templates.values())
+    for fname, result in read_sheets(read, list_sheets(folder, shard), jobs):
+        if isinstance(result, SheetFailed):
+            result = quarantine.retry(read, fname, result, min_width, registry.debug)
+            if isinstance(result, SheetFailed):
+                continue
+        if isinstance(result, SheetRejected):
+            print(f"[WARN] Skipping {os.path.basename(fname)}: {result}")
+            key = 'duplicates' if isinstance(result, SheetDuplicate) else 'rejects'
+            skipped[key].append(result.row(os.path.basename(fname)))
+            continue
+        tname, sheet = result
+        if sheet.duplicate_of:
+            print(f"[WARN] {sheet.file} looks like a rescan of {sheet.duplicate_of[0]}")
+        print(f"Processing image {os.path.basename(fname)} ({tname})...")
+        if tname not in runs:
+            template_dir = os.path.join(output_dir, tname)
+            runs[tname] = (ArtifactWriter(*_output_dirs(template_dir), artifact_format, artifact_workers),
+                           ResultWriter(registry.templates[tname].reader, template_dir, out_csv))
+        artifacts, writer = runs[tname]
+        artifacts.submit(sheet)
+        writer.write(sheet)
+
+    for tname, (artifacts, writer) in runs.items():
+        artifacts.close()
+        writer.close()
+        if get_info:
+            write_info_pdf(os.path.join(output_dir, tname))
+    quarantine.close()
+    if skipped['rejects']:
+        _write_skipped(os.path.join(output_dir, 'rejects.csv'), REJECT_COLUMNS, skipped['rejects'], "rejected pages")
+    if skipped['duplicates']:
+        _write_skipped(os.path.join(output_dir, 'duplicates.csv'), DUPLICATE_COLUMNS, skipped['duplicates'],
+                       "skipped duplicates")
+    return {tname: writer.counts['results'] for tname, (_, writer) in runs.items()}
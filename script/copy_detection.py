@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+copy_detection.py
+
+Lee `results_transformed_to_A.csv` (o los resultados fusionados) y
+`answersA.json`, y ordena los pares de estudiantes por coincidencias en
+respuestas incorrectas idénticas, el indicio clásico de copia.
+
+Para cada par se cuentan las preguntas en que ambos eligieron la misma opción
+incorrecta y se compara con lo esperable por azar: si en una pregunta quienes
+fallan eligen la opción o con frecuencia p_o, dos estudiantes que fallan esa
+pregunta coinciden con probabilidad s = Σ p_o². La suma de s sobre las
+preguntas que ambos fallan es la esperanza, y el estadístico es
+z = (coincidencias - esperanza) / desviación.
+
+Los recuentos de todos los pares se calculan como productos de matrices 0/1
+(una columna por pregunta y opción incorrecta) por bloques de pares que caben
+en caché, así que miles de hojas se analizan en segundos sin recorrer los
+pares uno a uno. Con --group-by solo se comparan estudiantes del mismo grupo
+(aula, tema...). Como se hacen millones de comparaciones, el umbral de z por
+defecto es el que deja en promedio menos de 0,05 falsos positivos en total.
+
+    python script/copy_detection.py -r results_transformed_to_A.csv -a answersA.json
+    python script/copy_detection.py --group-by tema --min-z 4 -o copy_pairs.csv
+"""
+
+import json
+import argparse
+from pathlib import Path
+from statistics import NormalDist
+
+import numpy as np
+# pandas se importa dentro de las funciones que lo usan: tarda en cargar y no
+# hace falta para --help
+
+BLANK = {'', '-'}
+# Lado de los bloques de pares: 512 × 4096 float32 son 8 MB por matriz
+BLOCK_ROWS = 512
+BLOCK_COLS = 4096
+
+def load_answers(results_path: Path, answers_path: Path, groups_path: Path = None):
+    import pandas as pd
+    df = pd.read_csv(results_path, dtype=str).fillna('-')
+    if groups_path:
+        # Columnas extra (p. ej. aula) de otro CSV con columna 'file'
+        df = df.merge(pd.read_csv(groups_path, dtype=str), on='file', how='left')
+    with answers_path.open(encoding='utf-8') as f:
+        key = json.load(f)
+    return df, key
+
+def encode(df, key):
+    """Matrices 0/1 de respuestas incorrectas.
+
+    Devuelve (questions, options, wrong_choice, wrong): wrong_choice tiene una
+    columna por (pregunta, opción) con 1 donde el estudiante eligió esa opción
+    y es incorrecta; wrong tiene una columna por pregunta fallada (las
+    preguntas en blanco no cuentan como fallo).
+    """
+    questions = [q for q in sorted(key, key=int) if f'Q{q}' in df.columns]
+    # texto de ancho fijo: las comparaciones se hacen en C y no objeto a objeto
+    answers = df[[f'Q{q}' for q in questions]].to_numpy().astype('U')
+    options = [a for a in np.unique(answers) if a not in BLANK]
+    n, nq, nopt = len(df), len(questions), len(options)
+    wrong_choice = np.zeros((n, nq, nopt), dtype=np.float32)
+    for k, opt in enumerate(options):
+        wrong_choice[:, :, k] = answers == opt
+    for j, q in enumerate(questions):
+        # misma normalización que al calificar: 'A,D', 'A;D' o 'a, d'
+        correct = {o.strip().upper() for o in key[q].replace(';', ',').split(',') if o.strip()}
+        for k, opt in enumerate(options):
+            if opt in correct:
+                wrong_choice[:, j, k] = 0
+    wrong = wrong_choice.sum(axis=2)
+    return questions, options, wrong_choice.reshape(n, nq * nopt), wrong
+
+def coincidence_odds(wrong_choice, wrong):
+    """s_q = Σ_o p_qo²: probabilidad de que dos fallos en la pregunta q elijan la misma opción."""
+    n, nq = wrong.shape
+    per_option = wrong_choice.reshape(n, nq, -1).sum(axis=0)
+    totals = per_option.sum(axis=1, keepdims=True)
+    p = np.divide(per_option, totals, out=np.zeros_like(per_option), where=totals > 0)
+    return (p ** 2).sum(axis=1)
+
+def default_min_z(pairs, false_positives=0.05):
+    """z que, entre `pairs` comparaciones independientes, superan en promedio `false_positives` pares."""
+    return NormalDist().inv_cdf(1 - false_positives / max(pairs, 1))
+
+def score_pairs(wrong_choice, wrong, s, members, min_identical, min_z):
+    """Arrays (i, j, coincidencias, esperanza, z) de los pares de `members` que superan ambos umbrales.
+
+    Los pares se recorren por bloques de BLOCK_ROWS × BLOCK_COLS estudiantes
+    por encima de la diagonal, de modo que cada par se evalúa una sola vez y
+    las matrices intermedias caben en caché.
+    """
+    wc, w = wrong_choice[members], wrong[members]
+    ws, wv = w * s, w * (s * (1 - s))
+    n = len(members)
+    found = []
+    for r0 in range(0, n, BLOCK_ROWS):
+        r1 = min(n, r0 + BLOCK_ROWS)
+        for c0 in range(r0, n, BLOCK_COLS):
+            c1 = min(n, c0 + BLOCK_COLS)
+            identical = wc[r0:r1] @ wc[c0:c1].T
+            # esperanza y varianza de las coincidencias: Σ_q w_i w_j s_q y Σ_q w_i w_j s_q (1 - s_q)
+            expected = ws[r0:r1] @ w[c0:c1].T
+            sd = wv[r0:r1] @ w[c0:c1].T
+            np.sqrt(np.maximum(sd, 1e-6, out=sd), out=sd)
+            z = (identical - expected) / sd
+            hit = (z >= min_z) & (identical >= min_identical)
+            if c0 == r0:
+                # solo j > i: la diagonal y lo que queda por debajo ya se han visto
+                hit &= np.arange(r0, r1)[:, None] < np.arange(c0, c1)[None, :]
+            a, b = np.nonzero(hit)
+            if len(a):
+                found.append((members[r0 + a], members[c0 + b], identical[a, b], expected[a, b], z[a, b]))
+    if not found:
+        return tuple(np.empty(0) for _ in range(5))
+    return tuple(np.concatenate(col) for col in zip(*found))
+
+def shared_wrong(wrong_choice, i, j, questions):
+    """Preguntas en que i y j dieron la misma respuesta incorrecta."""
+    same = (wrong_choice[i] * wrong_choice[j]).reshape(len(questions), -1).any(axis=1)
+    return [f'Q{questions[k]}' for k in np.flatnonzero(same)]
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Ordena pares de estudiantes por respuestas incorrectas idénticas (detección de copia)."
+    )
+    parser.add_argument("-r", "--results", type=Path, default=Path("results_transformed_to_A.csv"),
+                        help="CSV de respuestas en Tema A (default: results_transformed_to_A.csv)")
+    parser.add_argument("-a", "--answers", type=Path, default=Path("answersA.json"),
+                        help="JSON de respuestas correctas Tema A (default: answersA.json)")
+    parser.add_argument("-o", "--output", type=Path, default=Path("copy_pairs.csv"),
+                        help="CSV de pares sospechosos (default: copy_pairs.csv)")
+    parser.add_argument("--group-by", help="Comparar solo estudiantes con el mismo valor en esta columna (p. ej. tema o aula)")
+    parser.add_argument("--groups", type=Path, help="CSV con columna 'file' y columnas de agrupación a añadir a los resultados")
+    parser.add_argument("--min-identical", type=int, default=5,
+                        help="Mínimo de respuestas incorrectas idénticas para informar un par (default: 5)")
+    parser.add_argument("--min-z", type=float,
+                        help="Mínimo del estadístico z para informar un par "
+                             "(default: el que deja < 0,05 falsos positivos esperados entre todos los pares)")
+    parser.add_argument("--top", type=int, default=20, help="Pares a mostrar por pantalla (default: 20)")
+    args = parser.parse_args()
+    import pandas as pd
+
+    df, key = load_answers(args.results, args.answers, args.groups)
+    questions, options, wrong_choice, wrong = encode(df, key)
+    s = coincidence_odds(wrong_choice, wrong)
+
+    if args.group_by:
+        if args.group_by not in df.columns:
+            parser.error(f"la columna {args.group_by!r} no está en los resultados")
+        groups = [(g, np.flatnonzero((df[args.group_by] == g).to_numpy()))
+                  for g in sorted(df[args.group_by].unique())]
+    else:
+        groups = [('', np.arange(len(df)))]
+
+    pairs = sum(len(m) * (len(m) - 1) // 2 for _, m in groups)
+    min_z = args.min_z if args.min_z is not None else default_min_z(pairs)
+
+    rows = []
+    for g, members in groups:
+        for i, j, identical, expected, z in zip(*score_pairs(wrong_choice, wrong, s, members,
+                                                             args.min_identical, min_z)):
+            rows.append({
+                'file_a': df.at[i, 'file'], 'file_b': df.at[j, 'file'],
+                'group': g,
+                'identical_wrong': int(identical),
+                'wrong_a': int(wrong[i].sum()), 'wrong_b': int(wrong[j].sum()),
+                'expected': round(float(expected), 2), 'z': round(float(z), 2),
+                'questions': ';'.join(shared_wrong(wrong_choice, i, j, questions)),
+            })
+    out = pd.DataFrame(rows, columns=['file_a', 'file_b', 'group', 'identical_wrong', 'wrong_a',
+                                      'wrong_b', 'expected', 'z', 'questions'])
+    if not args.group_by:
+        out = out.drop(columns='group')
+    out = out.sort_values(['z', 'identical_wrong'], ascending=False)
+    out.to_csv(args.output, index=False)
+
+    print(f"{len(df)} estudiantes, {len(questions)} preguntas, {pairs} pares comparados (z >= {min_z:.2f})")
+    if len(out):
+        print(out.head(args.top).drop(columns='questions').to_string(index=False))
+    print(f"✔ {len(out)} pares sospechosos guardados en {args.output}")
+
+if __name__ == '__main__':
+    main()
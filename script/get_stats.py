@@ -5,21 +5,36 @@ generate_exam_report.py
 
 Lee `results_transformed_to_A.csv`, `grades_all.csv` y `answersA.json` (o los archivos que se indiquen)
 del directorio de trabajo y genera un PDF con métricas generales y por pregunta,
-incluyendo distribución de respuestas por pregunta.
+incluyendo distribución de respuestas por pregunta. Con --db las respuestas y notas
+se consultan a la base SQLite de omr_store.py en lugar de los CSV.
+
+Cada página del informe se describe con los datos mínimos que la dibujan y se
+renderiza a PNG en procesos paralelos. Las imágenes se guardan en una caché
+indexada por el hash de esos datos, de modo que al volver a ejecutar tras
+corregir unas pocas respuestas solo se redibujan las páginas afectadas antes
+de montar el PDF final.
 """
 
+import os
+import re
+import sys
 import json
 import math
+import hashlib
 import argparse
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
-from scipy.stats import pointbiserialr
+# pandas, matplotlib y scipy se importan dentro de las funciones que los usan: tardan
+# segundos en cargar y no hacen falta para --help ni para load_data()
+
+# Cambiar al modificar el aspecto de alguna figura, para invalidar la caché
+CACHE_VERSION = 1
+OPTIONS = ['A', 'B', 'C', 'D', 'NR']
 
 def load_data(results_path: Path, grades_path: Path, answers_path: Path):
+    import pandas as pd
     # Respuestas ya mapeadas a Tema A
     df = pd.read_csv(results_path, dtype=str).fillna('-')
     # Calificaciones reales
@@ -32,8 +47,40 @@ def load_data(results_path: Path, grades_path: Path, answers_path: Path):
         answers = json.load(f)
     return df, answers
 
+def load_store_data(db, exam, answers_path: Path, mapping_path: Path = None):
+    """Como load_data, con respuestas y notas consultadas a la base SQLite de omr_store.py.
+
+    Las hojas de otros temas se pasan a Tema A con el mapping de --mapping
+    (ver transform_results.py).
+    """
+    import importlib.util
+    import pandas as pd
+    # omr_store.py vive en la raíz del repositorio, junto a OMR-reader.py
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from omr_store import ResultStore
+    with answers_path.open(encoding='utf-8') as f:
+        answers = json.load(f)
+    with ResultStore(db) as store:
+        rows = store.results(exam)
+        grades = {r['file']: r['grade'] for r in store.grades(exam)}
+    themes = sorted({r['tema'] for r in rows} - {'A', ''})
+    if themes and not mapping_path:
+        raise ValueError(f"Hay hojas de los temas {themes}: indica --mapping para pasarlas a Tema A")
+    if mapping_path:
+        spec = importlib.util.spec_from_file_location('transform_results', Path(__file__).with_name('transform_results.py'))
+        transform = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(transform)
+        mapping = transform.load_mapping(mapping_path)
+        inverted = transform.build_inverted_options(mapping)
+        rows = [transform.transform_row(dict(r, tema=r['tema'] or 'A'), mapping, inverted, len(answers)) for r in rows]
+    # en la base una pregunta en blanco es '', en el CSV una celda vacía que se lee como '-'
+    df = pd.DataFrame(rows, dtype=str).replace('', '-').fillna('-')
+    df['grade'] = pd.to_numeric(df['file'].map(grades), errors='coerce').fillna(0.0)
+    return df, answers
+
 def compute_item_stats(df, answers):
     """Para cada pregunta, calcula dificultad y discriminación."""
+    from scipy.stats import pointbiserialr
     n_questions = len(answers)
     diffs, discs = {}, {}
     grades = df['grade'].values
@@ -52,10 +99,12 @@ def compute_item_stats(df, answers):
 
     return diffs, discs
 
-def plot_overall(df, pdf):
+def plot_overall(grades):
+    import pandas as pd
+    import matplotlib.pyplot as plt
     fig = plt.figure(figsize=(8, 10))
     fig.clf()
-    stats = df['grade'].agg(['count', 'mean', 'median', 'std'])
+    stats = pd.Series(grades, dtype=float).agg(['count', 'mean', 'median', 'std'])
     text = (
         f"Estudiantes: {int(stats['count'])}\n"
         f"Media: {stats['mean']:.2f}\n"
@@ -65,14 +114,15 @@ def plot_overall(df, pdf):
     ax1 = fig.add_subplot(211); ax1.axis('off')
     ax1.text(0.1, 0.5, text, fontsize=12, va='center')
     ax2 = fig.add_subplot(212)
-    ax2.hist(df['grade'], bins=8, edgecolor='black')
+    ax2.hist(grades, bins=8, edgecolor='black')
     ax2.set_xlabel('Calificación')
     ax2.set_ylabel('Número de estudiantes')
     ax2.set_title('Distribución de calificaciones')
     fig.tight_layout()
-    pdf.savefig(fig)
+    return fig
 
-def plot_item_difficulty(diffs, pdf):
+def plot_item_difficulty(diffs):
+    import matplotlib.pyplot as plt
     items = list(diffs.keys())
     vals  = [diffs[q] for q in items]
     order = np.argsort(vals)
@@ -86,11 +136,12 @@ def plot_item_difficulty(diffs, pdf):
     ax.set_xticklabels([f"Q{q}" for q in sorted_q], rotation=90, fontsize=8)
     ax.set_ylim(0, 1)
     fig.tight_layout()
-    pdf.savefig(fig)
+    return fig
 
-def plot_item_discrimination(discs, pdf):
+def plot_item_discrimination(discs):
+    import matplotlib.pyplot as plt
     items = list(discs.keys())
-    vals  = [discs[q] for q in items]
+    vals  = [np.nan if discs[q] is None else discs[q] for q in items]
 
     fig, ax = plt.subplots(figsize=(10, 6))
     ax.bar([f"Q{q}" for q in items], vals)
@@ -98,38 +149,114 @@ def plot_item_discrimination(discs, pdf):
     ax.set_title('Item discriminación')
     ax.set_xticklabels([f"Q{q}" for q in items], rotation=90, fontsize=8)
     fig.tight_layout()
-    pdf.savefig(fig)
+    return fig
 
-def plot_question_panels(df, answers, pdf):
-    n_questions = len(answers)
-    options = ['A','B','C','D','NR']
-    ncols = 6
-    nrows = math.ceil(n_questions / ncols)
+def plot_question_panels(panels, n_students, ncols=6):
+    """Una página de paneles: panels es [(pregunta, conteos por opción, correctas)]."""
+    import matplotlib.pyplot as plt
+    nrows = math.ceil(len(panels) / ncols)
     fig, axes = plt.subplots(nrows=nrows, ncols=ncols,
                              figsize=(ncols*3, nrows*3), squeeze=False)
     axes = axes.flatten()
 
-    for q in range(1, n_questions+1):
-        ax = axes[q-1]
-        vc = df[f'Q{q}'].value_counts()
-        counts = [
-            vc.get(opt, 0) if opt!='NR' else vc.get('-', 0)
-            for opt in options
-        ]
-        correct = [o.strip() for o in answers[str(q)].split(',') if o.strip()]
-        colors = ['green' if opt in correct else 'lightblue' for opt in options]
-        ax.bar(options, counts, color=colors)
+    for ax, (q, counts, correct) in zip(axes, panels):
+        colors = ['green' if opt in correct else 'lightblue' for opt in OPTIONS]
+        ax.bar(OPTIONS, counts, color=colors)
         ax.set_title(f'Pregunta {q}', fontsize=9)
-        ax.set_ylim(0, len(df))
+        ax.set_ylim(0, n_students)
         ax.tick_params(axis='x', labelsize=6)
         ax.tick_params(axis='y', labelsize=6)
 
     # Quitar ejes sobrantes
-    for idx in range(n_questions, len(axes)):
+    for idx in range(len(panels), len(axes)):
         fig.delaxes(axes[idx])
 
     fig.tight_layout()
-    pdf.savefig(fig)
+    return fig
+
+PLOTS = {
+    'overall': plot_overall,
+    'difficulty': plot_item_difficulty,
+    'discrimination': plot_item_discrimination,
+    'panels': plot_question_panels,
+}
+
+# Nombre de las páginas en la caché; al limpiarla solo se borran los ficheros
+# con este nombre, por si --cache-dir apunta a una carpeta con otras imágenes
+CACHE_PREFIX = 'exam-page-'
+CACHE_FILE = re.compile(re.escape(CACHE_PREFIX) + r'(%s)-[0-9a-f]{24}\.png' % '|'.join(PLOTS))
+
+def build_pages(df, answers, diffs, discs, per_page):
+    """Lista de páginas (tipo, argumentos): solo datos serializables a JSON."""
+    import pandas as pd
+    def clean(v):
+        return None if pd.isna(v) else float(v)
+    pages = [
+        ('overall', [[float(g) for g in df['grade']]]),
+        ('difficulty', [{q: clean(v) for q, v in diffs.items()}]),
+        ('discrimination', [{q: clean(v) for q, v in discs.items()}]),
+    ]
+    panels = []
+    for q in range(1, len(answers) + 1):
+        vc = df[f'Q{q}'].value_counts()
+        counts = [int(vc.get(opt if opt != 'NR' else '-', 0)) for opt in OPTIONS]
+        correct = [o.strip() for o in answers[str(q)].split(',') if o.strip()]
+        panels.append([q, counts, correct])
+    for i in range(0, len(panels), per_page):
+        pages.append(('panels', [panels[i:i + per_page], len(df)]))
+    return pages
+
+def page_key(kind, args, dpi):
+    payload = json.dumps([CACHE_VERSION, dpi, kind, args], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:24]
+
+def render_page(kind, args, path, dpi):
+    """Dibuja una página en un PNG (en el proceso trabajador)."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    if kind in ('difficulty', 'discrimination'):
+        # JSON convierte las claves de pregunta en texto
+        args = [{int(q): v for q, v in args[0].items()}]
+    fig = PLOTS[kind](*args)
+    tmp = f"{path}.tmp.png"
+    fig.savefig(tmp, dpi=dpi)
+    plt.close(fig)
+    os.replace(tmp, path)  # una página a medias nunca queda en la caché
+    return path
+
+def render_pages(pages, cache_dir, dpi, jobs):
+    """Devuelve las rutas PNG de todas las páginas, dibujando solo las que faltan en la caché."""
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    paths = [cache_dir / f"{CACHE_PREFIX}{kind}-{page_key(kind, args, dpi)}.png" for kind, args in pages]
+    todo = [(kind, args, str(path)) for (kind, args), path in zip(pages, paths) if not path.exists()]
+    if jobs > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(todo))) as pool:
+            futures = [pool.submit(render_page, kind, args, path, dpi) for kind, args, path in todo]
+            for f in futures:
+                f.result()
+    else:
+        for kind, args, path in todo:
+            render_page(kind, args, path, dpi)
+    # Las páginas que ya no forman parte del informe se borran de la caché
+    for old in cache_dir.glob(f"{CACHE_PREFIX}*.png"):
+        if CACHE_FILE.fullmatch(old.name) and old not in paths:
+            old.unlink()
+    return paths, len(todo)
+
+def assemble_pdf(paths, output, dpi):
+    """Monta el PDF final con una página por imagen, del tamaño de su figura."""
+    from PIL import Image
+    from reportlab.pdfgen import canvas
+    c = canvas.Canvas(str(output))
+    for path in paths:
+        with Image.open(path) as img:
+            w, h = img.size
+        size = (w * 72 / dpi, h * 72 / dpi)
+        c.setPageSize(size)
+        c.drawImage(str(path), 0, 0, *size)
+        c.showPage()
+    c.save()
 
 def main():
     parser = argparse.ArgumentParser(
@@ -159,19 +286,59 @@ def main():
         default=Path("exam_report.pdf"),
         help="Nombre del PDF de salida (default: exam_report.pdf)"
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Procesos que dibujan páginas en paralelo (default: número de CPUs)"
+    )
+    parser.add_argument(
+        "--per-page",
+        type=int,
+        default=24,
+        help="Preguntas por página de paneles (default: 24)"
+    )
+    parser.add_argument(
+        "--dpi",
+        type=int,
+        default=150,
+        help="Resolución de las páginas (default: 150)"
+    )
+    parser.add_argument(
+        "--db",
+        type=Path,
+        help="Base SQLite de omr_store.py de la que leer respuestas y notas en lugar de --results/--grades"
+    )
+    parser.add_argument(
+        "--exam",
+        help="Examen a leer de --db (obligatorio con --db)"
+    )
+    parser.add_argument(
+        "--mapping",
+        type=Path,
+        help="Con --db, temas_mapping.json para pasar a Tema A las hojas de otros temas"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        help="Carpeta de la caché de páginas (default: .<salida>_cache junto al PDF)"
+    )
     args = parser.parse_args()
+    if args.db and not args.exam:
+        parser.error("--db requiere --exam")
 
-    df, answers = load_data(args.results, args.grades, args.answers)
+    if args.db:
+        df, answers = load_store_data(args.db, args.exam, args.answers, args.mapping)
+    else:
+        df, answers = load_data(args.results, args.grades, args.answers)
     diffs, discs = compute_item_stats(df, answers)
+    pages = build_pages(df, answers, diffs, discs, args.per_page)
 
-    with PdfPages(args.output) as pdf:
-        plot_overall(df, pdf)
-        plot_item_difficulty(diffs, pdf)
-        plot_item_discrimination(discs, pdf)
-        plot_question_panels(df, answers, pdf)
+    cache_dir = args.cache_dir or args.output.with_name(f".{args.output.stem}_cache")
+    paths, drawn = render_pages(pages, cache_dir, args.dpi, args.jobs)
+    assemble_pdf(paths, args.output, args.dpi)
 
-    print(f"✔ Reporte generado: {args.output}")
+    print(f"✔ Reporte generado: {args.output} ({len(paths)} páginas, {drawn} redibujadas)")
 
 if __name__ == '__main__':
     main()
-
@@ -2,13 +2,15 @@
 import sys
 from pathlib import Path
 import argparse
-import pandas as pd
+# pandas se importa dentro de las funciones que lo usan: tarda en cargar y no
+# hace falta para --help
 
 def find_theme_dirs(base_dir: Path, prefix: str):
     return [p for p in base_dir.iterdir()
             if p.is_dir() and p.name.startswith(prefix)]
 
 def merge_csvs(theme_dirs, prefix, itn_name, grades_name, results_name):
+    import pandas as pd
     itn_list, grades_list, results_list = [], [], []
     for d in theme_dirs:
         itn     = pd.read_csv(d / itn_name)
@@ -27,6 +29,23 @@ def merge_csvs(theme_dirs, prefix, itn_name, grades_name, results_name):
     results_all = pd.concat(results_list,ignore_index=True)
     return itn_all, grades_all, results_all
 
+def open_store(db):
+    # omr_store.py vive en la raíz del repositorio, junto a OMR-reader.py
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from omr_store import ResultStore
+    return ResultStore(db)
+
+def load_store(db, exam):
+    """Las mismas tres tablas que merge_csvs, consultadas a la base SQLite de --db."""
+    import pandas as pd
+    with open_store(db) as store:
+        itn_all = pd.DataFrame(store.identities(exam), columns=["image", "name", "id"])
+        grades = store.grades(exam)
+        results = store.results(exam)
+    grades_all = pd.DataFrame(grades, columns=list(grades[0]) if grades else ["file", "grade", "tema"])
+    results_all = pd.DataFrame(results, columns=list(results[0]) if results else ["file", "tema"])
+    return itn_all, grades_all, results_all
+
 def sanity_checks(itn_all, grades_all):
     grades_all["image"] = grades_all["file"].str.replace(r"\.png$", "", regex=True)
 
@@ -71,18 +90,28 @@ def main():
                         help="Prefix for output filenames (e.g. 'all_').")
     parser.add_argument("--out-dir", default=".",
                         help="Output directory (default: current directory)")
+    parser.add_argument("--db",
+                        help="Read the tables from this SQLite store (see omr_store.py) instead of the tema* folders")
+    parser.add_argument("--exam",
+                        help="Exam to read from --db (required with --db)")
     args = parser.parse_args()
-
-    base = Path(args.base_dir)
-    theme_dirs = find_theme_dirs(base, args.prefix)
-    if not theme_dirs:
-        print(f"No directories starting with '{args.prefix}' found in {base}", 
-              file=sys.stderr)
-        sys.exit(1)
-
-    itn_all, grades_all, results_all = merge_csvs(
-        theme_dirs, args.prefix, args.itn, args.grades, args.results
-    )
+    if args.db and not args.exam:
+        parser.error("--db requires --exam")
+    import pandas as pd
+
+    if args.db:
+        itn_all, grades_all, results_all = load_store(args.db, args.exam)
+    else:
+        base = Path(args.base_dir)
+        theme_dirs = find_theme_dirs(base, args.prefix)
+        if not theme_dirs:
+            print(f"No directories starting with '{args.prefix}' found in {base}", 
+                  file=sys.stderr)
+            sys.exit(1)
+
+        itn_all, grades_all, results_all = merge_csvs(
+            theme_dirs, args.prefix, args.itn, args.grades, args.results
+        )
 
     out_dir = Path(args.out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+startup_time.py
+
+Mide el tiempo de arranque en frío de los puntos de entrada del repositorio.
+Cada uno se lanza varias veces en un intérprete nuevo con `-X importtime`
+(los scripts con `--help`, los módulos con un simple `import`) y se informa
+la mediana del tiempo total, el tiempo de imports y los módulos más pesados.
+
+    python script/startup_time.py
+    python script/startup_time.py --json startup.json
+    python script/startup_time.py --baseline startup.json --max-regression 20
+"""
+
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Scripts (se ejecutan con --help) y módulos importables (se importan)
+SCRIPTS = [
+    "OMR-reader.py", "omr_service.py", "omr_shards.py", "omr_sheet.py",
+    "generate_students_info_pdf.py", "script/get_stats.py",
+    "script/transform_results.py", "script/merge_datasets.py",
+    "script/temaA_to_temaB_map.py", "script/copy_detection.py",
+    "grid_autocal.py", "omr_regrade.py", "omr_store.py",
+]
+MODULES = ["omr_reader", "handwriting_ocr"]
+NOISE_MS = 15
+
+def parse_importtime(stderr):
+    """Devuelve {módulo de primer nivel: µs acumulados} de la salida de -X importtime."""
+    top = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # cabecera
+        # los imports anidados llevan más sangría en la columna del nombre
+        if len(parts[2]) - len(parts[2].lstrip()) > 1:
+            continue
+        name = parts[2].strip()
+        top[name] = top.get(name, 0) + int(parts[1])
+    return top
+
+def measure(target, runs):
+    if target.endswith(".py"):
+        cmd = [sys.executable, "-X", "importtime", str(ROOT / target), "--help"]
+    else:
+        cmd = [sys.executable, "-X", "importtime", "-c", f"import {target}"]
+    walls, imports, tops = [], [], {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+        walls.append((time.perf_counter() - start) * 1000)
+        top = parse_importtime(proc.stderr)
+        imports.append(sum(top.values()) / 1000)
+        for name, us in top.items():
+            tops.setdefault(name, []).append(us / 1000)
+        if proc.returncode != 0:
+            # p. ej. una dependencia opcional sin instalar: se informa, no se oculta
+            error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"
+            return {"target": target, "error": error}
+    heaviest = sorted(((statistics.median(v), k) for k, v in tops.items()), reverse=True)
+    return {
+        "target": target,
+        "wall_ms": round(statistics.median(walls), 1),
+        "import_ms": round(statistics.median(imports), 1),
+        "heaviest": [[name, round(ms, 1)] for ms, name in heaviest],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Mide el arranque en frío de los scripts y módulos con -X importtime."
+    )
+    parser.add_argument("targets", nargs="*", help="Scripts (.py, relativos a la raíz) o módulos; por defecto, todos los puntos de entrada")
+    parser.add_argument("--runs", type=int, default=5, help="Ejecuciones por objetivo; se informa la mediana (default: 5)")
+    parser.add_argument("--top", type=int, default=3, help="Módulos más pesados a mostrar por objetivo (default: 3)")
+    parser.add_argument("--json", type=Path, help="Guardar los resultados en este JSON (para seguirlos en el tiempo)")
+    parser.add_argument("--baseline", type=Path, help="JSON de una ejecución anterior con el que comparar")
+    parser.add_argument("--max-regression", type=float, default=20.0,
+                        help="Con --baseline, %% de aumento del tiempo total que se considera regresión (default: 20)")
+    args = parser.parse_args()
+
+    targets = args.targets or SCRIPTS + MODULES
+    results = [measure(t, args.runs) for t in targets]
+
+    baseline = {}
+    if args.baseline:
+        with args.baseline.open(encoding="utf-8") as f:
+            baseline = {r["target"]: r for r in json.load(f)["results"] if "wall_ms" in r}
+
+    regressions = []
+    print(f"{'objetivo':34} {'total ms':>9} {'imports ms':>11}  más pesados")
+    for r in results:
+        if "error" in r:
+            print(f"{r['target']:34} {'-':>9} {'-':>11}  ERROR: {r['error']}")
+            continue
+        heavy = ", ".join(f"{n} {ms:.0f}" for n, ms in r["heaviest"][:args.top])
+        line = f"{r['target']:34} {r['wall_ms']:9.1f} {r['import_ms']:11.1f}  {heavy}"
+        old = baseline.get(r["target"])
+        if old:
+            change = 100 * (r["wall_ms"] - old["wall_ms"]) / old["wall_ms"]
+            line += f"  ({change:+.0f}% vs base)"
+            # por debajo de NOISE_MS la diferencia es ruido del sistema
+            if change > args.max_regression and r["wall_ms"] - old["wall_ms"] > NOISE_MS:
+                regressions.append(r["target"])
+        print(line)
+
+    if args.json:
+        with args.json.open("w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "runs": args.runs, "results": results}, f, indent=2)
+        print(f"✔ Resultados guardados en {args.json}")
+    if regressions:
+        print(f"✘ Regresión de arranque (> {args.max_regression:.0f}%): {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
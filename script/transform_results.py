@@ -5,13 +5,14 @@ transform_results.py
 
 Lee `temas_mapping.json` y `results_all.csv` (o los archivos que se especifiquen)
 y genera `results_transformed_to_A.csv` (o el nombre de salida que se indique)
-donde todas las respuestas están en el orden y codificación de Tema A.
+donde todas las respuestas están en el orden y codificación de Tema A. Con --db
+las respuestas se consultan a la base SQLite de omr_store.py en lugar del CSV.
 """
 
+import sys
 import json
 import argparse
 from pathlib import Path
-import pandas as pd
 
 def load_mapping(mapping_path: Path):
     with mapping_path.open(encoding='utf-8') as f:
@@ -51,6 +52,14 @@ def transform_row(row, mapping, inverted_opts, n_questions=42):
         raise ValueError(f"Fila con tema desconocido: {row['tema']}")
     return new
 
+def load_store_results(db, exam):
+    """Filas de results_all.csv (file, Q1..Qn, tema) guardadas en la base SQLite."""
+    # omr_store.py vive en la raíz del repositorio, junto a OMR-reader.py
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from omr_store import ResultStore
+    with ResultStore(db) as store:
+        return store.results(exam)
+
 def main():
     parser = argparse.ArgumentParser(
         description="Transforma un CSV de resultados de Tema A/B a la codificación de Tema A."
@@ -67,6 +76,15 @@ def main():
         default=Path('results_all.csv'),
         help="CSV de entrada con columna 'tema' (default: results_all.csv)"
     )
+    parser.add_argument(
+        '--db',
+        type=Path,
+        help="Base SQLite de omr_store.py de la que leer las respuestas en lugar de --input"
+    )
+    parser.add_argument(
+        '--exam',
+        help="Examen a leer de --db (obligatorio con --db)"
+    )
     parser.add_argument(
         '--output', '-o',
         type=Path,
@@ -80,18 +98,24 @@ def main():
         help="Número de preguntas (default: 42)"
     )
     args = parser.parse_args()
+    if args.db and not args.exam:
+        parser.error("--db requiere --exam")
 
     # Cargar mapping y preparar opciones invertidas
     mapping = load_mapping(args.mapping)
     inverted_opts = build_inverted_options(mapping)
 
-    # Leer CSV de resultados
-    df = pd.read_csv(args.input, dtype=str).fillna('')
+    # Leer los resultados del CSV o de la base
+    import pandas as pd
+    if args.db:
+        rows = load_store_results(args.db, args.exam)
+    else:
+        rows = [row for _, row in pd.read_csv(args.input, dtype=str).fillna('').iterrows()]
 
     # Transformar fila por fila
     output_rows = [
         transform_row(row, mapping, inverted_opts, args.questions)
-        for _, row in df.iterrows()
+        for row in rows
     ]
 
     # Columnas en el orden deseado: file, Q1..Q{n}, tema
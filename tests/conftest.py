@@ -0,0 +1,39 @@
+import os
+import sys
+import json
+
+import pytest
+
+# the engine modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sheets import write_config, render_sheet, rescan, random_answers, write_scans
+
+# the files a run writes that must not depend on how it was run
+OUTPUTS = ("results.csv", "grades.csv", os.path.join("students-info", "info.csv"), "fills.u16", "fills_index.csv")
+
+@pytest.fixture
+def config(tmp_path):
+    """Path of a grid_config.json for the synthetic layout of tests/sheets.py."""
+    return write_config(str(tmp_path))
+
+@pytest.fixture
+def batch(tmp_path, config):
+    """A folder of 12 QR-coded scans and the OMRReader arguments to grade it against an answer key."""
+    sheets = {f"{i:02d}.png": rescan(render_sheet(random_answers(i), qr=f"OMR:x:A:{100000 + i}"),
+                                     seed=i, angle=0.05, shift=2, noise=2)
+              for i in range(12)}
+    answers = str(tmp_path / "answers.json")
+    with open(answers, "w") as f:
+        json.dump({str(q): "A" for q in range(1, 11)}, f)
+    return write_scans(str(tmp_path / "scans"), sheets), dict(config=config, debug=0, answers_json=answers,
+                                                              read_qr=True)
+
+@pytest.fixture
+def same_outputs():
+    """Check that two output folders hold byte-identical `names` (default: OUTPUTS)."""
+    def check(expected, actual, names=OUTPUTS):
+        for name in names:
+            with open(os.path.join(expected, name), 'rb') as a, open(os.path.join(actual, name), 'rb') as b:
+                assert a.read() == b.read(), name
+    return check
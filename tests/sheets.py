@@ -0,0 +1,100 @@
+"""Synthetic scans for the tests: a small two-column layout drawn with OpenCV.
+
+The four corner markers are centred MARGIN px from the page edges, so a
+warped sheet is the page shifted by MARGIN and bubble centres can be drawn
+straight from the layout's warped coordinates. Like omr_sheet.py, the page
+has an orientation bar beside its top-left marker.
+"""
+import os
+import json
+
+import cv2
+import numpy as np
+
+from omr_reader import ORIENTATION_BAR
+
+PAGE_W, PAGE_H = 900, 1300
+MARGIN = 60
+MARKER = 60
+CONFIG = {
+    "warp_w": PAGE_W - 2 * MARGIN,
+    "warp_h": PAGE_H - 2 * MARGIN,
+    "columns": 2,
+    "rows": 5,
+    "options": ["A", "B", "C", "D"],
+    "grids": [
+        {"x": 0.08, "y": 0.3, "w": 0.35, "h": 0.55, "bubble_spacing_px": 60, "bubble_radius_px": 16},
+        {"x": 0.55, "y": 0.3, "w": 0.35, "h": 0.55, "bubble_spacing_px": 60, "bubble_radius_px": 16},
+    ],
+}
+QUESTIONS = CONFIG["columns"] * CONFIG["rows"]
+
+def write_config(folder, **extra):
+    path = os.path.join(folder, "grid_config.json")
+    with open(path, "w") as f:
+        json.dump(dict(CONFIG, **extra), f)
+    return path
+
+def bubble_centres():
+    """{(question, option): (x, y)} in warped pixels, as omr_reader.Layout places them."""
+    centres = {}
+    W, H, rows = CONFIG["warp_w"], CONFIG["warp_h"], CONFIG["rows"]
+    for col, g in enumerate(CONFIG["grids"]):
+        x0, y0, h0 = g["x"] * W, g["y"] * H, g["h"] * H
+        for i in range(rows):
+            y = y0 + (i + 0.5) * (h0 / rows)
+            for j, opt in enumerate(CONFIG["options"]):
+                x = x0 + g["bubble_radius_px"] + j * g["bubble_spacing_px"]
+                # through normalized coordinates, with the rounding of measure_bubbles
+                centres[(col * rows + i + 1, opt)] = (int(x / W * W), int(y / H * H))
+    return centres
+
+def render_sheet(answers, qr=None, mark_radius=13, ink=40, name=None, bar=True):
+    """BGR page with the printed form and `answers` ({question: option(s)}) marked.
+
+    `qr` is the text of a sheet QR drawn between the bottom markers and
+    `name` is written in the header, like a student's handwriting. `bar=False`
+    leaves out the orientation bar, like sheets printed before it.
+    """
+    img = np.full((PAGE_H, PAGE_W, 3), 255, np.uint8)
+    for cx, cy in [(MARGIN, MARGIN), (PAGE_W - MARGIN, MARGIN),
+                   (PAGE_W - MARGIN, PAGE_H - MARGIN), (MARGIN, PAGE_H - MARGIN)]:
+        half = MARKER // 2
+        cv2.rectangle(img, (cx - half, cy - half), (cx + half - 1, cy + half - 1), (0, 0, 0), -1)
+    if bar:
+        offset, length, thickness = (MARKER * k for k in ORIENTATION_BAR)
+        x0, half_t = round(MARGIN + offset - length / 2), round(thickness / 2)
+        cv2.rectangle(img, (x0, MARGIN - half_t), (x0 + round(length) - 1, MARGIN + half_t - 1), (0, 0, 0), -1)
+    cv2.putText(img, "Tema A", (260, 125), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 2)
+    if name:
+        cv2.putText(img, name, (120, 250), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (20, 20, 20), 2)
+    for (q, opt), (x, y) in bubble_centres().items():
+        centre = (x + MARGIN, y + MARGIN)
+        cv2.circle(img, centre, 16, (90, 90, 90), 1)
+        if opt in answers.get(q, ''):
+            cv2.circle(img, centre, mark_radius, (ink, ink, ink), -1)
+    if qr:
+        code = cv2.QRCodeEncoder.create().encode(qr)
+        code = cv2.resize(code, None, fx=3, fy=3, interpolation=cv2.INTER_NEAREST)
+        x, y = MARGIN + 390 - code.shape[1] // 2, PAGE_H - MARGIN - code.shape[0] - 4
+        img[y:y + code.shape[0], x:x + code.shape[1]] = code[..., None]
+    return img
+
+def rescan(img, seed=0, angle=0.4, shift=4, noise=4):
+    """The same page fed again: slightly rotated and shifted, with sensor noise."""
+    rng = np.random.default_rng(seed)
+    M = cv2.getRotationMatrix2D((PAGE_W / 2, PAGE_H / 2), rng.uniform(-angle, angle), 1.0)
+    M[:, 2] += rng.uniform(-shift, shift, 2)
+    out = cv2.warpAffine(img, M, (PAGE_W, PAGE_H), borderValue=(255, 255, 255))
+    return np.clip(out + rng.normal(0, noise, out.shape), 0, 255).astype(np.uint8)
+
+def random_answers(seed, blank=0.1):
+    rng = np.random.default_rng(seed)
+    return {q: str(rng.choice(CONFIG["options"])) for q in range(1, QUESTIONS + 1) if rng.random() >= blank}
+
+def write_scans(folder, sheets):
+    """Write {file name: BGR page} as PNGs into `folder` and return it."""
+    os.makedirs(folder, exist_ok=True)
+    for name, img in sheets.items():
+        cv2.imwrite(os.path.join(folder, name), img)
+    return folder
@@ -0,0 +1,59 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+import omr_reader
+from omr_reader import ArtifactFormat, ArtifactWriter, SheetResult
+
+def sheet(name, crops=True):
+    rng = np.random.default_rng(len(name))
+    return SheetResult(file=name, answers={}, confidence={},
+                       crops={"name": rng.integers(0, 255, (60, 300, 3), np.uint8)} if crops else {},
+                       detections=rng.integers(0, 255, (200, 120, 3), np.uint8))
+
+def test_formats_and_preview_scale(tmp_path):
+    detections, info = str(tmp_path / "detections"), str(tmp_path / "students-info")
+    os.makedirs(detections)
+    writer = ArtifactWriter(detections, info, ArtifactFormat('jpg', 80, 0.5))
+    sheets = [sheet(f"{i}.png") for i in range(5)]
+    for s in sheets:
+        writer.submit(s)
+    writer.close()
+    assert sorted(os.listdir(detections)) == [f"{i}_detections.jpg" for i in range(5)]
+    assert cv2.imread(os.path.join(detections, "0_detections.jpg")).shape == (100, 60, 3)
+    # crops stay full-size lossless PNG for the OCR and the PDF
+    crop = cv2.imread(os.path.join(info, "3", "name.png"))
+    assert np.array_equal(crop, sheets[3].crops["name"])
+
+def test_full_queue_blocks_submit(tmp_path, monkeypatch):
+    release = threading.Event()
+    saved = []
+    def slow_save(s, *args):
+        release.wait(10)
+        saved.append(s.file)
+    monkeypatch.setattr(omr_reader, "save_artifacts", slow_save)
+    writer = ArtifactWriter(str(tmp_path), str(tmp_path), workers=1, queue_size=2)
+    writer.submit(sheet("0.png"))
+    writer.submit(sheet("1.png"))
+    third = threading.Thread(target=writer.submit, args=(sheet("2.png"),))
+    third.start()
+    third.join(0.3)
+    assert third.is_alive()
+    release.set()
+    third.join(10)
+    writer.close()
+    assert saved == ["0.png", "1.png", "2.png"]
+
+def test_failed_write_is_a_warning(tmp_path, monkeypatch, capsys):
+    def save(s, *args):
+        if s.file == "1.png":
+            raise OSError("disk full")
+    monkeypatch.setattr(omr_reader, "save_artifacts", save)
+    writer = ArtifactWriter(str(tmp_path), str(tmp_path))
+    for i in range(3):
+        writer.submit(sheet(f"{i}.png", crops=False))
+    writer.close()
+    assert writer.failed == 1
+    assert "[WARN] Could not save images of 1.png: disk full" in capsys.readouterr().out
@@ -0,0 +1,49 @@
+import os
+import sys
+import json
+import subprocess
+
+import cv2
+import pytest
+
+from grid_autocal import calibrate, compare_layouts
+from omr_reader import OMRReader
+from sheets import CONFIG, QUESTIONS, render_sheet, rescan, random_answers
+
+AUTOCAL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "grid_autocal.py")
+
+@pytest.mark.parametrize("sample", [
+    # rotated slightly clockwise, so the top-right marker sits above the top-left one
+    rescan(render_sheet({}), seed=5),
+    # pencil marks cover the printed circle
+    rescan(render_sheet(random_answers(6), mark_radius=16), seed=6),
+], ids=["blank", "filled"])
+def test_calibrated_config_matches_the_layout(tmp_path, config, sample):
+    grid, report, _ = calibrate(sample, warp_w=CONFIG["warp_w"], warp_h=CONFIG["warp_h"])
+    assert report["confidence"] >= 0.9
+    assert (grid["columns"], grid["rows"], grid["options"]) == (CONFIG["columns"], CONFIG["rows"], CONFIG["options"])
+    assert [g["bubbles_found"] for g in report["grids"]] == [20, 20]
+    assert compare_layouts(grid, config)["max_px"] < 2
+    path = str(tmp_path / "calibrated.json")
+    with open(path, "w") as f:
+        json.dump(grid, f)
+    answers = random_answers(7)
+    sheet = OMRReader(path, debug=0).read(rescan(render_sheet(answers), seed=7, angle=0.05, shift=2, noise=2))
+    assert sheet.answers == {q: answers.get(q, '') for q in range(1, QUESTIONS + 1)}
+
+def test_unexpected_shape_has_no_confidence():
+    _, report, _ = calibrate(render_sheet({}), columns=2, rows=6)
+    assert report["confidence"] == 0
+    assert "expected 6 rows, found 5" in report["warnings"]
+
+def test_cli_writes_only_a_confident_fit(tmp_path):
+    sample, output = str(tmp_path / "sample.png"), str(tmp_path / "grid_config.json")
+    cv2.imwrite(sample, render_sheet({}))
+    refused = subprocess.run([sys.executable, AUTOCAL, sample, "--output", output, "--rows", "6"],
+                             capture_output=True, text=True)
+    assert refused.returncode == 1 and not os.path.exists(output)
+    report = str(tmp_path / "calib.json")
+    subprocess.run([sys.executable, AUTOCAL, sample, "--output", output, "--rows", "5", "--report", report],
+                   check=True, capture_output=True)
+    with open(output) as f, open(report) as r:
+        assert json.load(f)["rows"] == 5 and json.load(r)["confidence"] >= 0.9
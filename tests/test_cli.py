@@ -0,0 +1,19 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+CLI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "OMR-reader.py")
+
+@pytest.mark.parametrize("flags, error", [
+    (["--processes", "2", "--watch"], "--processes cannot be combined with --watch or --templates"),
+    (["--processes", "2", "--templates", "templates.json"], "--processes cannot be combined"),
+    (["--jobs", "2", "--processes", "2"], "--jobs cannot be combined with --processes or --watch"),
+    (["--jobs", "2", "--watch"], "--jobs cannot be combined"),
+    (["--shard", "0/2", "--watch"], "--shard cannot be combined"),
+])
+def test_incompatible_flags_are_rejected(tmp_path, flags, error):
+    run = subprocess.run([sys.executable, CLI, str(tmp_path)] + flags, capture_output=True, text=True, cwd=tmp_path)
+    assert run.returncode == 2
+    assert error in run.stderr
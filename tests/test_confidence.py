@@ -0,0 +1,25 @@
+import pytest
+
+from omr_reader import OMRReader, clearly_blank
+from sheets import QUESTIONS, render_sheet, random_answers
+
+@pytest.mark.parametrize("second_pass", [True, False])
+def test_double_mark_is_flagged(config, second_pass):
+    answers = {**random_answers(40, blank=0), 3: "AC"}
+    sheet = OMRReader(config, debug=0, second_pass=second_pass).read(render_sheet(answers))
+    assert sheet.flags == {3: 'multi'}
+    assert sheet.answers[3] in ("A", "C")
+    assert [r["flag"] for r in sheet.review_rows] == ["multi"]
+
+@pytest.mark.parametrize("second_pass", [True, False])
+def test_blank_questions_are_not_sent_to_review(config, second_pass):
+    answers = {q: opt for q, opt in random_answers(41, blank=0).items() if q % 3}
+    # a low min_fill: the printed outlines of blank bubbles come close to it
+    sheet = OMRReader(config, debug=0, second_pass=second_pass, min_fill=100).read(render_sheet(answers))
+    assert [sheet.answers[q] for q in range(1, QUESTIONS + 1)] == [answers.get(q, '') for q in range(1, QUESTIONS + 1)]
+    assert sheet.flags == {}
+
+def test_faint_mark_is_not_clearly_blank():
+    assert clearly_blank([88, 86, 90, 87], 200)
+    assert not clearly_blank([88, 170, 90, 87], 200)
+    assert not clearly_blank([88, 210, 90, 87], 200)
@@ -0,0 +1,11 @@
+import pandas as pd
+
+from omr_reader import load_script
+
+copy_detection = load_script('copy_detection')
+
+def test_key_is_normalised_like_grading():
+    df = pd.DataFrame({'file': ['a.png', 'b.png'], 'Q1': ['A', 'D'], 'Q2': ['B', 'C']})
+    for key in ({'1': 'A,D', '2': 'B'}, {'1': 'a; d', '2': 'b'}):
+        questions, options, wrong_choice, wrong = copy_detection.encode(df, key)
+        assert wrong.tolist() == [[0, 0], [0, 1]]
@@ -0,0 +1,76 @@
+import os
+import csv
+
+from omr_reader import OMRReader, DuplicateIndex, hamming, process_folder, shard_of
+from omr_shards import merge_shards, write_manifest, shard_dir
+from sheets import render_sheet, rescan, random_answers, write_scans
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+def test_identical_copy_is_linked_with_default_flags(tmp_path, config):
+    page = render_sheet(random_answers(1))
+    scans = write_scans(str(tmp_path / "scans"), {"a.png": page, "b.png": render_sheet(random_answers(2)), "c.png": page.copy()})
+    out = str(tmp_path / "out")
+    process_folder(OMRReader(config, debug=0), scans, output_dir=out)
+    rows = read_csv(os.path.join(out, "duplicates.csv"))
+    assert rows == [{"file": "c.png", "duplicate_of": "a.png", "distance": "0", "action": "graded"}]
+    assert [r["file"] for r in read_csv(os.path.join(out, "results.csv"))] == ["a.png", "b.png", "c.png"]
+
+def test_rescan_is_skipped(tmp_path, config):
+    page = render_sheet(random_answers(3))
+    scans = write_scans(str(tmp_path / "scans"), {"a.png": page, "b.png": rescan(page, seed=5)})
+    out = str(tmp_path / "out")
+    process_folder(OMRReader(config, debug=0), scans, output_dir=out, duplicates='skip')
+    assert [r["file"] for r in read_csv(os.path.join(out, "results.csv"))] == ["a.png"]
+    assert read_csv(os.path.join(out, "duplicates.csv"))[0]["action"] == "skipped"
+
+def test_different_sheet_ids_are_never_duplicates(tmp_path, config):
+    answers = random_answers(4)
+    reader = OMRReader(config, debug=0, read_qr=True)
+    index = DuplicateIndex(skip=True)
+    first = reader.read(render_sheet(answers, qr="OMR:x:A:100001"), "a.png", duplicates=index)
+    second = reader.read(render_sheet(answers, qr="OMR:x:A:100002"), "b.png", duplicates=index)
+    assert hamming(first.phash, second.phash) == 0
+    assert second.duplicate_of is None
+
+def test_blank_sheets_are_not_matched(config):
+    reader = OMRReader(config, debug=0)
+    index = DuplicateIndex()
+    sheets = [reader.read(render_sheet({}), f"{i}.png", duplicates=index) for i in range(3)]
+    assert [s.phash for s in sheets] == [0, 0, 0]
+    assert all(s.duplicate_of is None for s in sheets)
+
+def test_sheets_one_answer_apart_are_not_duplicates(config):
+    answers = random_answers(6, blank=0)
+    other = dict(answers)
+    other[1] = "A" if answers[1] != "A" else "B"
+    reader = OMRReader(config, debug=0)
+    index = DuplicateIndex()
+    reader.read(render_sheet(answers), "a.png", duplicates=index)
+    assert reader.read(render_sheet(other), "b.png", duplicates=index).duplicate_of is None
+
+def test_cross_shard_rescan_is_dropped_in_skip_mode(tmp_path, config):
+    # names whose copies land in different shards of 2
+    names = [f"s{i:02d}.png" for i in range(40)]
+    first = next(n for n in names if shard_of(n, 2) == 0)
+    copy = next(n for n in names if shard_of(n, 2) == 1 and n > first)
+    page = render_sheet(random_answers(7))
+    sheets = {first: page, copy: page.copy()}
+    sheets.update({n: render_sheet(random_answers(i + 10)) for i, n in enumerate(names[:6]) if n not in sheets})
+    scans = write_scans(str(tmp_path / "scans"), sheets)
+
+    single = str(tmp_path / "single")
+    process_folder(OMRReader(config, debug=0), scans, output_dir=single, duplicates='skip')
+    merged = str(tmp_path / "merged")
+    for i in range(2):
+        out = shard_dir(merged, (i, 2))
+        process_folder(OMRReader(config, debug=0), scans, output_dir=out, shard=(i, 2), duplicates='skip')
+        write_manifest(out, scans, (i, 2), duplicates='skip')
+    merge_shards(merged)
+
+    assert copy not in [r["file"] for r in read_csv(os.path.join(merged, "results.csv"))]
+    for name in ("results.csv", "duplicates.csv"):
+        with open(os.path.join(single, name)) as a, open(os.path.join(merged, name)) as b:
+            assert a.read() == b.read(), name
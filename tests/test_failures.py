@@ -0,0 +1,124 @@
+import os
+import csv
+import json
+
+import cv2
+import pytest
+
+from omr_reader import OMRReader, process_folder
+from omr_pipeline import process_folder_shm
+from sheets import QUESTIONS, render_sheet, rescan, random_answers, write_config, write_scans
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+def read_failures(out):
+    with open(os.path.join(out, "failures.json")) as f:
+        return json.load(f)
+
+def feed(tmp_path, broken):
+    """Three good scans plus `broken` ({name: image or bytes}) in one folder."""
+    sheets = {f"{i}.png": rescan(render_sheet(random_answers(i)), seed=i, angle=0.05, shift=2, noise=2)
+              for i in range(3)}
+    sheets.update({n: img for n, img in broken.items() if not isinstance(img, bytes)})
+    scans = write_scans(str(tmp_path / "scans"), sheets)
+    for name, data in broken.items():
+        if isinstance(data, bytes):
+            with open(os.path.join(scans, name), "wb") as f:
+                f.write(data)
+    return scans
+
+def test_corrupt_file_is_quarantined(tmp_path, config, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    scans = feed(tmp_path, {"1b.png": b"\x89PNG\r\n\x1a\n truncated"})
+    out = str(tmp_path / "out")
+    process_folder(OMRReader(config, debug=0), scans, output_dir=out)
+    assert [r["file"] for r in read_csv(os.path.join(out, "results.csv"))] == ["0.png", "1.png", "2.png"]
+    failures = read_failures(out)
+    assert [r["file"] for r in failures["failed"]] == ["1b.png"] and failures["recovered"] == []
+    record = failures["failed"][0]
+    assert [a["rung"] for a in record["attempts"]] == ["read", "blur", "threshold", "full-resolution", "flip"]
+    assert os.path.exists(os.path.join(out, record["quarantined"]))
+    with open(os.path.join(out, "quarantine", "1b.png.json")) as f:
+        assert json.load(f)["error"] == record["error"]
+
+def test_fixed_sheet_leaves_the_quarantine(tmp_path, config, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    scans = feed(tmp_path, {"1b.png": b"not an image"})
+    out = str(tmp_path / "out")
+    process_folder(OMRReader(config, debug=0), scans, output_dir=out)
+    cv2.imwrite(os.path.join(scans, "1b.png"), render_sheet(random_answers(9)))
+    process_folder(OMRReader(config, debug=0), scans, output_dir=out, resume=True)
+    assert not os.path.exists(os.path.join(out, "failures.json"))
+    assert os.listdir(os.path.join(out, "quarantine")) == []
+    assert "1b.png" in [r["file"] for r in read_csv(os.path.join(out, "results.csv"))]
+
+def test_retry_ladder_recovers_low_resolution_and_mirrored_scans(tmp_path, config, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    answers = {name: random_answers(seed) for name, seed in (("half.png", 20), ("mirror.png", 21))}
+    half = cv2.resize(rescan(render_sheet(answers["half.png"]), seed=20), None, fx=0.5, fy=0.5,
+                      interpolation=cv2.INTER_AREA)
+    mirror = cv2.flip(rescan(render_sheet(answers["mirror.png"]), seed=21), 1)
+    scans = feed(tmp_path, {"half.png": half, "mirror.png": mirror})
+    out = str(tmp_path / "out")
+    process_folder(OMRReader(config, debug=0), scans, output_dir=out)
+    failures = read_failures(out)
+    assert failures["failed"] == []
+    assert {r["file"]: r["rung"] for r in failures["recovered"]} == {"half.png": "full-resolution", "mirror.png": "flip"}
+    rows = {r["file"]: r for r in read_csv(os.path.join(out, "results.csv"))}
+    for name, marked in answers.items():
+        assert [rows[name][f"Q{q}"] for q in range(1, QUESTIONS + 1)] == \
+            [marked.get(q, '') for q in range(1, QUESTIONS + 1)], name
+    assert not os.path.exists(os.path.join(out, "quarantine", "mirror.png"))
+
+def test_worker_failure_does_not_stop_pipeline(tmp_path, config, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mirror = cv2.flip(render_sheet(random_answers(22)), 1)
+    scans = feed(tmp_path, {"1b.png": b"not an image", "1c.png": mirror})
+    out = str(tmp_path / "out")
+    process_folder_shm(dict(config=config, debug=0), scans, output_dir=out, processes=2)
+    assert [r["file"] for r in read_csv(os.path.join(out, "results.csv"))] == ["0.png", "1.png", "1c.png", "2.png"]
+    failures = read_failures(out)
+    assert [r["file"] for r in failures["failed"]] == ["1b.png"]
+    assert [r["rung"] for r in failures["recovered"]] == ["flip"]
+
+class FlakyOCR:
+    """Stands in for handwriting_ocr; the first recognition raises, like a model running out of memory."""
+    calls = 0
+
+    def recognize_name_id(self, name_img, id_img, device='cpu'):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("OCR failed")
+        return "Ana", "12345678Z"
+
+    def check_id(self, text):
+        return text, 'valid'
+
+def test_retried_sheet_is_not_its_own_duplicate(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = write_config(str(tmp_path), name_rect=[0.05, 0.05, 0.4, 0.1], id_rect=[0.5, 0.05, 0.3, 0.1])
+    scans = write_scans(str(tmp_path / "scans"), {"a.png": render_sheet(random_answers(30)),
+                                                   "b.png": render_sheet(random_answers(31))})
+    reader = OMRReader(config, debug=0)
+    reader.handwriting_ocr = FlakyOCR()
+    out = str(tmp_path / "out")
+    process_folder(reader, scans, output_dir=out)
+    assert [r["rung"] for r in read_failures(out)["recovered"]] == ["blur"]
+    assert not os.path.exists(os.path.join(out, "duplicates.csv"))
+    assert [r["file"] for r in read_csv(os.path.join(out, "results.csv"))] == ["a.png", "b.png"]
+
+def test_marker_debug_image_only_with_debug(tmp_path, config, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # markers too small to be taken for corner squares
+    page = cv2.resize(render_sheet(random_answers(32)), None, fx=0.4, fy=0.4, interpolation=cv2.INTER_AREA)
+    detections = str(tmp_path / "out" / "detections")
+    for debug in (0, 1):
+        with pytest.raises(RuntimeError, match="Could not find 4 markers") as error:
+            OMRReader(config, debug=debug, preflight=False, debug_dir=detections).read(page, "small.png")
+        assert os.path.exists(os.path.join(detections, "debug_markers.png")) == bool(debug)
+    assert "see " + os.path.join(detections, "debug_markers.png") in str(error.value)
+    with pytest.raises(RuntimeError):
+        OMRReader(config, debug=1, preflight=False).read(page, "small.png")
+    assert not os.path.exists(tmp_path / "debug_markers.png")
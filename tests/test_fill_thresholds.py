@@ -0,0 +1,28 @@
+import numpy as np
+
+from omr_reader import split_fills, fill_thresholds
+
+rng = np.random.default_rng(0)
+blank = rng.normal(0.05, 0.01, 150).clip(0)
+faint = rng.normal(0.45, 0.02, 10)
+dark = rng.normal(0.85, 0.08, 30).clip(max=1)
+
+def test_bimodal_split_falls_between_the_clusters():
+    fills = np.concatenate([blank, faint, dark])
+    t = split_fills(rng.permutation(fills))
+    assert blank.max() < t < faint.min()
+
+def test_unimodal_fills_have_no_split():
+    assert np.isnan(split_fills(blank))
+    assert np.isnan(split_fills(dark))
+    rows = split_fills(np.stack([blank[:30], dark, np.concatenate([blank[:20], dark[:10]])]))
+    assert np.isnan(rows[:2]).all() and blank[:20].max() < rows[2] < dark[:10].min()
+
+def test_fill_thresholds_fall_back_to_min_fill():
+    areas = np.full(4, 800.0)
+    columns = [0, 0, 1, 1]
+    fills = np.zeros((4, 4))
+    fills[:2, 0] = 600   # column 0 has marks, column 1 is all blank
+    thresholds = fill_thresholds(fills, columns, areas, 0.25, mode='column')
+    assert 0 < thresholds[0] == thresholds[1] < 600
+    assert list(thresholds[2:]) == [200, 200]
@@ -0,0 +1,19 @@
+from omr_reader import load_script
+
+get_stats = load_script('get_stats')
+
+def test_cache_cleanup_only_removes_its_own_pages(tmp_path):
+    pages = [('difficulty', [{1: 0.5, 2: 0.25}])]
+    stale = tmp_path / f"{get_stats.CACHE_PREFIX}panels-{'0' * 24}.png"
+    stale.write_bytes(b"old page")
+    foreign = [tmp_path / "foto.png", tmp_path / f"{get_stats.CACHE_PREFIX}notes.png"]
+    for path in foreign:
+        path.write_bytes(b"user file")
+
+    paths, drawn = get_stats.render_pages(pages, tmp_path, dpi=30, jobs=1)
+    assert drawn == 1 and paths[0].exists()
+    assert not stale.exists()
+    assert all(path.exists() for path in foreign)
+
+    _, drawn = get_stats.render_pages(pages, tmp_path, dpi=30, jobs=1)
+    assert drawn == 0
@@ -0,0 +1,25 @@
+import pytest
+
+from handwriting_ocr import check_id
+
+@pytest.mark.parametrize("text, expected", [
+    ("12345678Z", ("12345678Z", "valid")),
+    ("12345678 z", ("12345678Z", "valid")),
+    ("1234567-8Z", ("12345678Z", "valid")),
+    ("X1234567L", ("X1234567L", "valid")),
+    ("Y1234567X", ("Y1234567X", "valid")),
+    ("Z1234567R", ("Z1234567R", "valid")),
+    ("12345678A", ("12345678A", "invalid")),
+    ("X1234567Z", ("X1234567Z", "invalid")),
+])
+def test_dni_and_nie_check_letter(text, expected):
+    assert check_id(text) == expected
+
+def test_lookalike_letters_in_the_number_are_digits():
+    assert check_id("I2345678Z") == ("12345678Z", "valid")
+    assert check_id("X12S4567L") == ("X1254567L", "invalid")
+    assert check_id("XI234567L") == ("X1234567L", "valid")
+
+@pytest.mark.parametrize("text", ["PAB123456", "AB1234567", "1234567", "123456789"])
+def test_other_ids_are_not_checked(text):
+    assert check_id(text) == (text, "other")
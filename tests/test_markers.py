@@ -0,0 +1,50 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from omr_reader import OMRReader, MarkerTracker, find_markers, sheet_homography, process_folder
+from sheets import CONFIG, QUESTIONS, render_sheet, rescan, random_answers, write_scans
+
+def feeder(n):
+    """Sheets as one feeder delivers them: the same position give or take a pixel or two."""
+    return {f"{i:02d}.png": rescan(render_sheet(random_answers(i)), seed=i, angle=0.05, shift=2, noise=2)
+            for i in range(n)}
+
+def test_tracked_markers_match_full_search():
+    tracker = MarkerTracker()
+    tracked = 0
+    for img in feeder(8).values():
+        found = tracker.track(img)
+        if found is not None:
+            tracked += 1
+            assert np.array_equal(found[0], find_markers(img))
+        sheet_homography(img, CONFIG["warp_w"], CONFIG["warp_h"], tracker)
+    assert tracked == 7
+
+def test_marker_reuse_does_not_change_fills(tmp_path, config):
+    scans = write_scans(str(tmp_path / "scans"), feeder(8))
+    outputs = {}
+    for reuse in (True, False):
+        out = str(tmp_path / f"reuse-{reuse}")
+        process_folder(OMRReader(config, debug=0), scans, output_dir=out, reuse_markers=reuse)
+        outputs[reuse] = [open(os.path.join(out, name), 'rb').read()
+                          for name in ("fills.u16", "fills_index.csv", "results.csv")]
+    assert outputs[True] == outputs[False]
+
+def test_odd_sized_scan_does_not_break_tracking(config):
+    # a scan with a wide border puts the markers where the next sheet has no pixels
+    answers = [random_answers(i) for i in range(3)]
+    pages = [rescan(render_sheet(a), seed=i, angle=0.05, shift=2, noise=2) for i, a in enumerate(answers)]
+    padded = cv2.copyMakeBorder(pages[1], 0, 0, 1000, 0, cv2.BORDER_CONSTANT, value=(255, 255, 255))
+    sheets = OMRReader(config, debug=0, preflight=False).read_many([("a.png", pages[0]), ("b.png", padded), ("c.png", pages[2])])
+    assert [s.answers for s in sheets] == [{q: a.get(q, '') for q in range(1, QUESTIONS + 1)} for a in answers]
+
+def test_failed_sheet_is_not_tracked_again():
+    tracker = MarkerTracker()
+    page = render_sheet({})
+    sheet_homography(page, CONFIG["warp_w"], CONFIG["warp_h"], tracker)
+    with pytest.raises(RuntimeError):
+        sheet_homography(np.full_like(page, 255), CONFIG["warp_w"], CONFIG["warp_h"], tracker)
+    assert tracker.last is None
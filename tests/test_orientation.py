@@ -0,0 +1,56 @@
+import os
+import csv
+
+import cv2
+import numpy as np
+import pytest
+
+from omr_reader import OMRReader, MarkerTracker, find_markers, process_folder
+from sheets import QUESTIONS, render_sheet, rescan, random_answers, write_scans
+
+ROTATIONS = {0: None, 90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_COUNTERCLOCKWISE}
+
+def rotate(img, angle):
+    return img if ROTATIONS[angle] is None else cv2.rotate(img, ROTATIONS[angle])
+
+def expected(answers):
+    return {q: answers.get(q, '') for q in range(1, QUESTIONS + 1)}
+
+@pytest.mark.parametrize("angle", sorted(ROTATIONS))
+def test_rotated_scan_is_read_upright(config, angle):
+    answers = random_answers(angle)
+    page = rescan(render_sheet(answers), seed=angle)
+    sheet = OMRReader(config, debug=0).read(rotate(page, angle), "a.png")
+    assert sheet.answers == expected(answers)
+
+def test_markers_follow_the_sheet_not_the_scan():
+    page = render_sheet({})
+    upright = find_markers(page)
+    # upside down, the sheet's top-left marker is the scan's bottom-right one
+    h, w = page.shape[:2]
+    assert np.allclose(find_markers(rotate(page, 180)), [(w, h)] - upright, atol=1)
+
+def test_sheet_without_bar_keeps_scan_order():
+    page = render_sheet({}, bar=False)
+    assert np.array_equal(find_markers(rotate(page, 180)), find_markers(page))
+
+def test_flipped_sheet_in_a_feed(tmp_path, config):
+    answers = [random_answers(i) for i in range(4)]
+    sheets = {f"{i}.png": rotate(rescan(render_sheet(a), seed=i, angle=0.05, shift=2, noise=2), 180 if i == 2 else 0)
+              for i, a in enumerate(answers)}
+    scans = write_scans(str(tmp_path / "scans"), sheets)
+    out = str(tmp_path / "out")
+    process_folder(OMRReader(config, debug=0), scans, output_dir=out)
+    with open(os.path.join(out, "results.csv"), newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [{q: r[f"Q{q}"] for q in range(1, QUESTIONS + 1)} for r in rows] == [expected(a) for a in answers]
+
+@pytest.mark.parametrize("angle", [90, 180, 270])
+def test_rotated_sheet_between_upright_ones_with_one_tracker(config, angle):
+    answers = [random_answers(30 + i) for i in range(3)]
+    pages = [rescan(render_sheet(a), seed=i, angle=0.05, shift=2, noise=2) for i, a in enumerate(answers)]
+    pages[1] = rotate(pages[1], angle)
+    tracker = MarkerTracker()
+    reader = OMRReader(config, debug=0)
+    sheets = [reader.read(page, f"{i}.png", tracker=tracker) for i, page in enumerate(pages)]
+    assert [s.answers for s in sheets] == [expected(a) for a in answers]
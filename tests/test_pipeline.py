@@ -0,0 +1,25 @@
+import os
+
+import cv2
+
+from omr_reader import OMRReader, process_folder
+from omr_pipeline import process_folder_shm
+
+def test_processes_run_matches_single_node_run(tmp_path, batch, same_outputs):
+    scans, kwargs = batch
+    single = str(tmp_path / "single")
+    process_folder(OMRReader(**kwargs), scans, output_dir=single)
+    pooled = str(tmp_path / "pooled")
+    process_folder_shm(kwargs, scans, output_dir=pooled, processes=3)
+    same_outputs(single, pooled)
+
+def test_scans_larger_than_a_slot_are_sent_by_value(tmp_path, batch, same_outputs):
+    scans, kwargs = batch
+    # a later scan at twice the resolution of the one that sized the ring
+    path = os.path.join(scans, "07.png")
+    cv2.imwrite(path, cv2.resize(cv2.imread(path), None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC))
+    single = str(tmp_path / "single")
+    process_folder(OMRReader(**kwargs), scans, output_dir=single)
+    pooled = str(tmp_path / "pooled")
+    process_folder_shm(kwargs, scans, output_dir=pooled, processes=2, slots=1)
+    same_outputs(single, pooled)
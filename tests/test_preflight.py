@@ -0,0 +1,40 @@
+import os
+import csv
+
+import cv2
+import numpy as np
+import pytest
+
+from omr_reader import OMRReader, preflight, process_folder
+from sheets import render_sheet, rescan, random_answers, write_scans
+
+page = render_sheet(random_answers(1))
+
+def blank_page(text="p. 2"):
+    """A separator page: white but for a page number."""
+    img = np.full_like(page, 250)
+    cv2.putText(img, text, (400, 1250), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+    return img
+
+@pytest.mark.parametrize("img", [page, rescan(page, seed=2), cv2.GaussianBlur(page, (0, 0), 0.5)],
+                         ids=["clean", "rescan", "slight-blur"])
+def test_good_pages_pass(img):
+    reason, checks = preflight(img)
+    assert reason is None and checks["markers"] == 4
+
+def test_bad_pages_are_rejected():
+    no_markers = page.copy()
+    no_markers[:150, :150] = 255
+    assert preflight(blank_page())[0] == 'blank'
+    assert preflight(np.full_like(page, 30))[0] == 'dark'
+    assert preflight(cv2.GaussianBlur(page, (0, 0), 3))[0] == 'blurred'
+    assert preflight(no_markers)[0] == 'no markers'
+
+def test_rejected_pages_do_not_stop_the_run(tmp_path, config):
+    scans = write_scans(str(tmp_path / "scans"), {"a.png": page, "b.png": blank_page(), "c.png": page.copy()})
+    out = str(tmp_path / "out")
+    process_folder(OMRReader(config, debug=0), scans, output_dir=out)
+    with open(os.path.join(out, "rejects.csv"), newline='') as f:
+        assert [(r["file"], r["reason"]) for r in csv.DictReader(f)] == [("b.png", "blank")]
+    with open(os.path.join(out, "results.csv"), newline='') as f:
+        assert [r["file"] for r in csv.DictReader(f)] == ["a.png", "c.png"]
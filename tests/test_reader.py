@@ -0,0 +1,62 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from omr_reader import OMRReader
+from sheets import QUESTIONS, render_sheet, rescan, random_answers, write_scans
+
+def pages(n):
+    return {f"{i}.png": rescan(render_sheet(random_answers(i), qr=f"OMR:x:A:{100000 + i}"),
+                               seed=i, angle=0.05, shift=2, noise=2) for i in range(n)}
+
+def expected(seed):
+    answers = random_answers(seed)
+    return {q: answers.get(q, '') for q in range(1, QUESTIONS + 1)}
+
+def test_read_a_path_or_an_array(tmp_path, config):
+    sheets = pages(1)
+    path = os.path.join(write_scans(str(tmp_path / "scans"), sheets), "0.png")
+    reader = OMRReader(config, debug=0)
+    from_path = reader.read(path)
+    from_array = reader.read(sheets["0.png"])
+    assert from_path.file == "0.png" and from_array.file == "sheet"
+    assert reader.read(sheets["0.png"], "named.png").file == "named.png"
+    assert from_path.answers == from_array.answers == expected(0)
+    assert from_path.row == dict({"file": "0.png"}, **{f"Q{q}": a for q, a in expected(0).items()})
+    assert from_path.grades_row is None and from_path.info_row is None
+
+def test_unreadable_path_raises(tmp_path, config):
+    with pytest.raises(RuntimeError, match="Could not read image"):
+        OMRReader(config, debug=0).read(str(tmp_path / "missing.png"))
+
+def test_grades_and_identity_rows(batch):
+    scans, kwargs = batch
+    reader = OMRReader(**kwargs)
+    with open(kwargs["answers_json"]) as f:
+        key = json.load(f)
+    sheet = reader.read(os.path.join(scans, "03.png"))
+    assert sheet.tema == "A" and sheet.sheet_id == "100003"
+    assert list(sheet.row) == reader.result_columns()[0]
+    assert set(sheet.grades_row) == set(reader.result_columns()[1])
+    assert sheet.grade == sum(sheet.answers[q] == key[str(q)] for q in sheet.answers)
+    assert sheet.info_row == {"image": "03.png", "name": "", "id": "", "sheet_id": "100003", "source": "qr"}
+
+@pytest.mark.parametrize("reuse_markers", [True, False])
+def test_read_many_keeps_order(tmp_path, config, reuse_markers):
+    sheets = pages(4)
+    folder = write_scans(str(tmp_path / "scans"), sheets)
+    items = [os.path.join(folder, "0.png"), ("1.png", sheets["1.png"]),
+             os.path.join(folder, "2.png"), ("3.png", sheets["3.png"])]
+    results = list(OMRReader(config, debug=0).read_many(items, reuse_markers=reuse_markers))
+    assert [r.file for r in results] == ["0.png", "1.png", "2.png", "3.png"]
+    assert [r.answers for r in results] == [expected(i) for i in range(4)]
+
+def test_one_reader_is_shared_by_threads(config):
+    sheets = pages(6)
+    reader = OMRReader(config, debug=0)
+    sequential = [reader.read(img, name).row for name, img in sheets.items()]
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        threaded = list(pool.map(lambda item: reader.read(item[1], item[0]).row, sheets.items()))
+    assert threaded == sequential
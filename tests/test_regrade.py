@@ -0,0 +1,10 @@
+from omr_reader import OMRReader, process_folder
+from omr_regrade import regrade
+
+def test_regrade_reproduces_the_run(tmp_path, batch, same_outputs):
+    scans, kwargs = batch
+    run = str(tmp_path / "run")
+    process_folder(OMRReader(**kwargs), scans, output_dir=run)
+    out = str(tmp_path / "regraded")
+    assert regrade(run, out, answers_json=kwargs["answers_json"]) == 12
+    same_outputs(run, out, ("results.csv", "grades.csv"))
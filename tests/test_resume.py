@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from omr_reader import OMRReader, process_folder
+
+class InterruptedReader(OMRReader):
+    """Stops the run, as Ctrl-C would, after reading `left` sheets."""
+    def __init__(self, left, **kwargs):
+        super().__init__(**kwargs)
+        self.left = left
+
+    def read(self, *args, **kwargs):
+        if not self.left:
+            raise KeyboardInterrupt
+        self.left -= 1
+        return super().read(*args, **kwargs)
+
+def test_resumed_run_matches_uninterrupted_run(tmp_path, batch, same_outputs):
+    scans, kwargs = batch
+    single = str(tmp_path / "single")
+    process_folder(OMRReader(**kwargs), scans, output_dir=single)
+    resumed = str(tmp_path / "resumed")
+    with pytest.raises(KeyboardInterrupt):
+        process_folder(InterruptedReader(5, **kwargs), scans, output_dir=resumed)
+    assert not os.path.exists(os.path.join(resumed, "results.csv"))
+    assert os.path.getsize(os.path.join(resumed, "results.csv.partial"))
+    process_folder(OMRReader(**kwargs), scans, output_dir=resumed, resume=True)
+    same_outputs(single, resumed)
+
+def test_interrupted_rerun_keeps_previous_outputs(tmp_path, batch, same_outputs):
+    scans, kwargs = batch
+    single = str(tmp_path / "single")
+    process_folder(OMRReader(**kwargs), scans, output_dir=single)
+    rerun = str(tmp_path / "rerun")
+    process_folder(OMRReader(**kwargs), scans, output_dir=rerun)
+    with pytest.raises(KeyboardInterrupt):
+        process_folder(InterruptedReader(5, **kwargs), scans, output_dir=rerun)
+    same_outputs(single, rerun)
+
+def test_csv_outputs_end_lines_with_newline_only(tmp_path, batch):
+    scans, kwargs = batch
+    out = str(tmp_path / "out")
+    process_folder(OMRReader(**kwargs), scans, output_dir=out)
+    for name in ("results.csv", "grades.csv", os.path.join("students-info", "info.csv"), "fills_index.csv"):
+        with open(os.path.join(out, name), 'rb') as f:
+            data = f.read()
+        assert b"\r" not in data and data.endswith(b"\n"), name
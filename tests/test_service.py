@@ -0,0 +1,71 @@
+import os
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from omr_reader import OMRReader
+from omr_service import GradingService, make_handler, post_images
+from sheets import QUESTIONS, render_sheet, rescan, random_answers, write_scans
+
+@pytest.fixture
+def service(config):
+    """(GradingService with one worker and one queue slot, URL of its server on a free port)."""
+    graded = GradingService(OMRReader(config, debug=0), workers=1, queue_size=1)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(graded, 1 << 24))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield graded, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    graded.pool.shutdown()
+
+def scans(tmp_path, n):
+    answers = {f"{i}.png": random_answers(i) for i in range(n)}
+    folder = write_scans(str(tmp_path / "scans"), {name: rescan(render_sheet(a), seed=i, angle=0.05, shift=2, noise=2)
+                                                   for i, (name, a) in enumerate(answers.items())})
+    return [os.path.join(folder, name) for name in answers], list(answers.values())
+
+def expected(answers):
+    return {str(q): answers.get(q, '') for q in range(1, QUESTIONS + 1)}
+
+def test_grade_and_health(tmp_path, service):
+    _, url = service
+    (path,), (answers,) = scans(tmp_path, 1)
+    result = post_images(url, [path])
+    assert result["file"] == "0.png" and result["answers"] == expected(answers)
+    with urllib.request.urlopen(f"{url}/health") as resp:
+        assert json.load(resp) == {"status": "ok", "in_flight": 0, "capacity": 2}
+
+def test_grade_batch(tmp_path, service):
+    _, url = service
+    paths, answers = scans(tmp_path, 2)
+    results = post_images(url, paths)["results"]
+    assert [r["file"] for r in results] == ["0.png", "1.png"]
+    assert [r["answers"] for r in results] == [expected(a) for a in answers]
+
+def test_full_queue_answers_503(tmp_path, service):
+    graded, url = service
+    paths, _ = scans(tmp_path, 1)
+    with open(paths[0], 'rb') as f:
+        req = urllib.request.Request(f"{url}/grade?name=0.png", data=f.read())
+    graded._acquire(graded.capacity)
+    try:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(req)
+        assert error.value.code == 503 and error.value.headers["Retry-After"] == "1"
+    finally:
+        for _ in range(graded.capacity):
+            graded._release()
+    assert post_images(url, paths)["file"] == "0.png"
+
+def test_bad_requests(tmp_path, service):
+    _, url = service
+    (tmp_path / "broken.png").write_bytes(b"not an image")
+    assert post_images(url, [str(tmp_path / "broken.png")]) == {"file": "broken.png", "error": "could not decode image"}
+    paths, _ = scans(tmp_path, 3)
+    # three sheets do not fit in one worker and one queue slot
+    assert "larger than queue capacity" in post_images(url, paths)["error"]
@@ -0,0 +1,36 @@
+import os
+import shutil
+
+import pytest
+
+from omr_reader import OMRReader, process_folder, list_sheets
+from omr_shards import merge_shards, write_manifest, shard_dir
+
+def run_shards(scans, kwargs, output, n):
+    for i in range(n):
+        out = shard_dir(output, (i, n))
+        process_folder(OMRReader(**kwargs), scans, output_dir=out, shard=(i, n))
+        write_manifest(out, scans, (i, n))
+    return merge_shards(output)
+
+def test_merged_shards_match_single_node_run(tmp_path, batch, same_outputs):
+    scans, kwargs = batch
+    single = str(tmp_path / "single")
+    process_folder(OMRReader(**kwargs), scans, output_dir=single)
+    merged = str(tmp_path / "merged")
+    assert run_shards(scans, kwargs, merged, 3) == 12
+    same_outputs(single, merged)
+    assert not os.path.exists(os.path.join(merged, "failures.json"))
+
+def test_shards_partition_the_inputs(batch):
+    scans, _ = batch
+    parts = [list_sheets(scans, (i, 5)) for i in range(5)]
+    assert sorted(f for part in parts for f in part) == list_sheets(scans)
+
+def test_merge_refuses_missing_shard(tmp_path, batch):
+    scans, kwargs = batch
+    merged = str(tmp_path / "merged")
+    run_shards(scans, kwargs, merged, 3)
+    shutil.rmtree(shard_dir(merged, (1, 3)))
+    with pytest.raises(ValueError, match="missing shards"):
+        merge_shards(merged)
@@ -0,0 +1,87 @@
+import os
+import sys
+import csv
+import subprocess
+
+import pandas as pd
+import pytest
+
+from omr_reader import OMRReader, process_folder, load_script
+from omr_store import ResultStore
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+def graded_run(tmp_path, batch):
+    scans, kwargs = batch
+    out = str(tmp_path / "out")
+    process_folder(OMRReader(**kwargs), scans, output_dir=out)
+    return out, kwargs
+
+def test_store_holds_the_run_tables(tmp_path, batch):
+    out, _ = graded_run(tmp_path, batch)
+    with ResultStore(str(tmp_path / "exams.sqlite")) as store:
+        assert store.import_run(out, "parcial1") == 12
+        # a regrade of the same exam replaces its sheets
+        assert store.import_run(out, "parcial1") == 12
+        assert store.results("parcial1") == read_csv(os.path.join(out, "results.csv"))
+        grades = read_csv(os.path.join(out, "grades.csv"))
+        assert store.grades("parcial1") == [dict(r, grade=float(r["grade"])) for r in grades]
+        assert store.conn.execute("SELECT COUNT(*) FROM sheets").fetchone() == (12,)
+        assert store.conn.execute("SELECT COUNT(*) FROM runs").fetchone() == (1,)
+        assert store.results("parcial2") == []
+
+def test_reimport_replaces_the_run(tmp_path, batch):
+    out, _ = graded_run(tmp_path, batch)
+    with ResultStore(str(tmp_path / "exams.sqlite")) as store:
+        store.import_run(out, "parcial1")
+        # the run lost a sheet since the last import
+        with open(os.path.join(out, "results.csv"), newline='') as f:
+            lines = f.readlines()
+        with open(os.path.join(out, "results.csv"), "w", newline='') as f:
+            f.writelines(lines[:-1])
+        assert store.import_run(out, "parcial1", theme="A") == 11
+        assert store.conn.execute("SELECT exam, theme, sheets FROM runs").fetchall() == [("parcial1", "A", 11)]
+        assert len(store.results("parcial1")) == 11
+        store.import_run(out, "final")
+        assert store.conn.execute("SELECT COUNT(*) FROM runs").fetchone() == (2,)
+        with pytest.raises(ValueError, match="exam name is required"):
+            store.import_run(out, "")
+
+def test_students_are_found_across_exams(tmp_path, batch):
+    out, _ = graded_run(tmp_path, batch)
+    with open(os.path.join(out, "image-to-name.csv"), "w", newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=["image", "name", "id"])
+        writer.writeheader()
+        writer.writerow({"image": "03", "name": "Ana Ruiz", "id": "12345678Z"})
+        writer.writerow({"image": "04", "name": "", "id": ""})
+    with ResultStore(str(tmp_path / "exams.sqlite")) as store:
+        store.import_run(out, "parcial1")
+        store.import_run(out, "final", theme="B")
+        assert store.identities("final") == [{"image": "03", "name": "Ana Ruiz", "id": "12345678Z"}]
+        grade = float(next(r["grade"] for r in read_csv(os.path.join(out, "grades.csv")) if r["file"] == "03.png"))
+        assert store.student("12345678Z") == [("final", "A", "03.png", "Ana Ruiz", grade),
+                                              ("parcial1", "A", "03.png", "Ana Ruiz", grade)]
+
+def test_report_reads_the_store_like_the_csvs(tmp_path, batch):
+    out, kwargs = graded_run(tmp_path, batch)
+    db = str(tmp_path / "exams.sqlite")
+    with ResultStore(db) as store:
+        store.import_run(out, "parcial1")
+    get_stats = load_script('get_stats')
+    answers = tmp_path / "answers.json"
+    from_csv, _ = get_stats.load_data(tmp_path / "out" / "results.csv", tmp_path / "out" / "grades.csv", answers)
+    from_db, _ = get_stats.load_store_data(db, "parcial1", answers)
+    pd.testing.assert_frame_equal(from_db, from_csv, check_dtype=False)
+
+    merge_datasets = load_script('merge_datasets')
+    _, grades_all, results_all = merge_datasets.load_store(db, "parcial1")
+    assert results_all.astype(str).replace('nan', '').to_dict('records') == read_csv(os.path.join(out, "results.csv"))
+    assert list(grades_all["file"]) == [r["file"] for r in read_csv(os.path.join(out, "grades.csv"))]
+
+@pytest.mark.parametrize("script", ["merge_datasets.py", "transform_results.py", "get_stats.py"])
+def test_scripts_require_the_exam_with_db(tmp_path, script):
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "script", script)
+    run = subprocess.run([sys.executable, path, "--db", str(tmp_path / "exams.sqlite")], capture_output=True, text=True)
+    assert run.returncode == 2 and "--exam" in run.stderr
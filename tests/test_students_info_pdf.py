@@ -0,0 +1,48 @@
+import io
+import re
+
+import numpy as np
+from PIL import Image
+
+from generate_students_info_pdf import generate_pdf, prepare_crop
+
+def write_students(folder, n):
+    rng = np.random.default_rng(0)
+    for i in range(n):
+        student = folder / f"{i:03d}"
+        student.mkdir(parents=True)
+        for crop in ("name", "id"):
+            Image.fromarray(rng.integers(0, 256, (120, 600, 3), dtype=np.uint8)).save(student / f"{crop}.png")
+
+def pages(path):
+    return len(re.findall(rb"/Type\s*/Page\b(?!s)", path.read_bytes()))
+
+def test_large_cohort_is_split_into_numbered_parts(tmp_path):
+    info = tmp_path / "students-info"
+    write_students(info, 23)
+    generate_pdf(str(info), str(tmp_path / "names.pdf"), workers=1, max_per_pdf=10)
+    parts = sorted(p.name for p in tmp_path.glob("names*.pdf"))
+    assert parts == ["names_001.pdf", "names_002.pdf", "names_003.pdf"]
+    # about 9 students fit on a page
+    assert [pages(tmp_path / p) for p in parts] == [2, 2, 1]
+    assert (tmp_path / "image-to-name.csv").read_text().count("\n") == 24
+
+def test_small_cohort_stays_in_one_file(tmp_path):
+    info = tmp_path / "students-info"
+    write_students(info, 3)
+    generate_pdf(str(info), str(tmp_path / "names.pdf"), workers=1)
+    assert [p.name for p in tmp_path.glob("names*.pdf")] == ["names.pdf"]
+    assert pages(tmp_path / "names.pdf") == 1
+
+def test_crop_encodings(tmp_path):
+    path = tmp_path / "name.png"
+    Image.fromarray(np.random.default_rng(1).integers(0, 256, (300, 1100, 3), dtype=np.uint8)).save(path)
+    data, w, h = prepare_crop(str(path), dpi=144, encoding="jpeg")
+    img = Image.open(io.BytesIO(data))
+    assert (img.format, img.mode) == ("JPEG", "L")
+    # fitted to the 220 x 60 pt box and kept at 144 dpi, i.e. 2 px per point
+    assert (w, h) == (220, 60) and img.size == (440, 120)
+    data, _, _ = prepare_crop(str(path), dpi=144, encoding="1bit")
+    img = Image.open(io.BytesIO(data))
+    assert (img.format, img.mode) == ("PNG", "1")
+    assert prepare_crop(str(tmp_path / "missing.png")) is None
@@ -0,0 +1,67 @@
+import os
+import csv
+import json
+
+import cv2
+
+from omr_templates import TemplateRegistry, process_templates
+from sheets import CONFIG, PAGE_W, PAGE_H, QUESTIONS, render_sheet, rescan, random_answers, write_scans
+
+# a second layout: the same form printed on a longer page
+TALL_H = 1600
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+def registry(tmp_path, specs, **configs):
+    """TemplateRegistry of `specs`, with {file name: layout overrides} written next to templates.json."""
+    for name, extra in configs.items():
+        with open(tmp_path / name, "w") as f:
+            json.dump(dict(CONFIG, **extra), f)
+    path = tmp_path / "templates.json"
+    with open(path, "w") as f:
+        json.dump(specs, f)
+    return TemplateRegistry(str(path), debug=0)
+
+def tall(page):
+    return cv2.resize(page, (PAGE_W, TALL_H), interpolation=cv2.INTER_AREA)
+
+def answered(seed):
+    answers = random_answers(seed)
+    return [answers.get(q, '') for q in range(1, QUESTIONS + 1)]
+
+def graded(out, template):
+    return {r["file"]: [r[f"Q{q}"] for q in range(1, QUESTIONS + 1)]
+            for r in read_csv(os.path.join(out, template, "results.csv"))}
+
+def test_template_by_file_name(tmp_path):
+    reg = registry(tmp_path, {"bio": {"config": "grid.json", "pattern": "bio_*.png"},
+                              "qui": {"config": "grid.json", "pattern": "qui_*.png"}}, **{"grid.json": {}})
+    sheets = {"bio_1.png": render_sheet(random_answers(1)), "qui_2.png": render_sheet(random_answers(2)),
+              "bio_3.png": render_sheet(random_answers(3))}
+    out = str(tmp_path / "out")
+    assert process_templates(reg, write_scans(str(tmp_path / "scans"), sheets), output_dir=out) == {"bio": 2, "qui": 1}
+    assert graded(out, "bio") == {"bio_1.png": answered(1), "bio_3.png": answered(3)}
+    assert graded(out, "qui") == {"qui_2.png": answered(2)}
+
+def test_template_by_marker_aspect(tmp_path):
+    reg = registry(tmp_path, {"a4": {"config": "a4.json"}, "long": {"config": "long.json"}},
+                   **{"a4.json": {}, "long.json": {"warp_h": round(CONFIG["warp_h"] * TALL_H / PAGE_H)}})
+    sheets = {"1.png": rescan(render_sheet(random_answers(1)), seed=1, angle=0.05, shift=2, noise=2),
+              "2.png": tall(render_sheet(random_answers(2))), "3.png": render_sheet(random_answers(3))}
+    assert [reg.select(img, name)[0].name for name, img in sheets.items()] == ["a4", "long", "a4"]
+    out = str(tmp_path / "out")
+    assert process_templates(reg, write_scans(str(tmp_path / "scans"), sheets), output_dir=out) == {"a4": 2, "long": 1}
+    assert graded(out, "long") == {"2.png": answered(2)}
+
+def test_template_by_sheet_qr(tmp_path):
+    # same shape, told apart only by the layout ID printed in the QR
+    reg = registry(tmp_path, {"bio": {"config": "grid.json", "layout_id": "bio1", "qr": True},
+                              "qui": {"config": "grid.json", "layout_id": "qui1", "qr": True}}, **{"grid.json": {}})
+    sheets = {f"{i}.png": render_sheet(random_answers(i), qr=f"OMR:{layout}:A:{100000 + i}")
+              for i, layout in enumerate(["qui1", "bio1", "qui1"])}
+    out = str(tmp_path / "out")
+    assert process_templates(reg, write_scans(str(tmp_path / "scans"), sheets), output_dir=out) == {"qui": 2, "bio": 1}
+    assert graded(out, "qui") == {"0.png": answered(0), "2.png": answered(2)}
+    assert [r["sheet_id"] for r in read_csv(os.path.join(out, "bio", "students-info", "info.csv"))] == ["100001"]
@@ -0,0 +1,67 @@
+import os
+import csv
+import time
+import threading
+
+import cv2
+
+from omr_reader import OMRReader, watch_folder
+from sheets import render_sheet, rescan, random_answers, write_scans
+
+def read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+class StoppingReader(OMRReader):
+    """Stops the watcher, as Ctrl-C would, when a sheet named stop.png arrives."""
+    def read(self, image, *args, **kwargs):
+        if os.path.basename(str(image)) == "stop.png":
+            raise KeyboardInterrupt
+        return super().read(image, *args, **kwargs)
+
+def watch(config, scans, out, arrivals, timeout=20):
+    """Run watch_folder on `scans` while {name: page} `arrivals` are moved in, then stop it.
+
+    The watcher is stopped once every sheet of the folder is in results.csv,
+    or after `timeout` seconds.
+    """
+    results = os.path.join(out, "results.csv")
+
+    def scanner():
+        for name, page in arrivals.items():
+            time.sleep(0.2)
+            tmp = os.path.join(os.path.dirname(scans), name)
+            cv2.imwrite(tmp, page)
+            os.replace(tmp, os.path.join(scans, name))
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if os.path.exists(results) and len(read_csv(results)) >= len(os.listdir(scans)):
+                break
+            time.sleep(0.05)
+        cv2.imwrite(os.path.join(scans, "stop.png"), render_sheet({}))
+
+    feeder = threading.Thread(target=scanner)
+    feeder.start()
+    try:
+        watch_folder(StoppingReader(config, debug=0), scans, output_dir=out, poll_interval=0.05, settle=0.1)
+    finally:
+        feeder.join()
+    os.remove(os.path.join(scans, "stop.png"))
+
+def test_sheets_are_graded_as_they_arrive(tmp_path, config, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pages = {f"{i}.png": rescan(render_sheet(random_answers(i)), seed=i, angle=0.05, shift=2, noise=2)
+             for i in range(3)}
+    scans = write_scans(str(tmp_path / "scans"), {"0.png": pages.pop("0.png")})
+    out = str(tmp_path / "out")
+    watch(config, scans, out, pages)
+    assert sorted(r["file"] for r in read_csv(os.path.join(out, "results.csv"))) == ["0.png", "1.png", "2.png"]
+    assert sorted(os.listdir(os.path.join(out, "detections"))) == [f"{i}_detections.png" for i in range(3)]
+
+def test_restarted_watcher_skips_graded_sheets(tmp_path, config, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    scans = write_scans(str(tmp_path / "scans"), {"0.png": render_sheet(random_answers(0))})
+    out = str(tmp_path / "out")
+    watch(config, scans, out, {})
+    watch(config, scans, out, {"1.png": render_sheet(random_answers(1))})
+    assert [r["file"] for r in read_csv(os.path.join(out, "results.csv"))] == ["0.png", "1.png"]